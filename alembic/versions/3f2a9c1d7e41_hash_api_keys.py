@@ -0,0 +1,54 @@
+"""hash api keys
+
+Revision ID: 3f2a9c1d7e41
+Revises: 
+Create Date: 2026-10-17 09:00:00.000000
+
+"""
+import hashlib
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f2a9c1d7e41'
+down_revision: Union[str, None] = None
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # Tables are created by `Base.metadata.create_all` at startup, so a fresh
+    # database already has the new columns.
+    columns = {column["name"]
+               for column in sa.inspect(op.get_bind()).get_columns("authen")}
+    if "key" not in columns:
+        return
+
+    op.add_column("authen", sa.Column(
+        "key_hash", sa.String(length=64), nullable=True))
+    op.add_column("authen", sa.Column(
+        "key_prefix", sa.String(length=8), nullable=True))
+
+    authen = sa.table("authen", sa.column("id", sa.Integer), sa.column("key", sa.String),
+                      sa.column("key_hash", sa.String), sa.column("key_prefix", sa.String))
+    connection = op.get_bind()
+    for id, key in connection.execute(sa.select(authen.c.id, authen.c.key)).fetchall():
+        connection.execute(authen.update().where(authen.c.id == id).values(
+            key_hash=hashlib.sha256(key.encode("utf-8")).hexdigest(), key_prefix=key[:8]))
+
+    op.alter_column("authen", "key_hash", nullable=False)
+    op.alter_column("authen", "key_prefix", nullable=False)
+    op.create_index(op.f("ix_authen_key_hash"),
+                    "authen", ["key_hash"], unique=True)
+    op.drop_column("authen", "key")
+
+
+def downgrade() -> None:
+    # Plain keys cannot be recovered from their hashes; existing keys stop working.
+    op.add_column("authen", sa.Column("key", sa.String(), nullable=True))
+    op.drop_index(op.f("ix_authen_key_hash"), table_name="authen")
+    op.drop_column("authen", "key_prefix")
+    op.drop_column("authen", "key_hash")
@@ -0,0 +1,125 @@
+"""conversation turns
+
+Revision ID: 8b4d2e6f1a93
+Revises: 3f2a9c1d7e41
+Create Date: 2026-10-17 12:00:00.000000
+
+"""
+from datetime import datetime, timezone
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8b4d2e6f1a93'
+down_revision: Union[str, None] = '3f2a9c1d7e41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BACKFILL_BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    # Tables are created by `Base.metadata.create_all` at startup, so the table may
+    # already exist; the backfill is idempotent either way.
+    if not sa.inspect(op.get_bind()).has_table("conversation_turn"):
+        op.create_table(
+            "conversation_turn",
+            sa.Column("id", sa.Integer(), nullable=False),
+            sa.Column("conversation_id", sa.String(), nullable=False),
+            sa.Column("message_id", sa.String(), nullable=False),
+            sa.Column("turn_index", sa.Integer(), nullable=False),
+            sa.Column("sender_id", sa.String(), nullable=True),
+            sa.Column("user_message", sa.String(), nullable=False),
+            sa.Column("bot_response", sa.String(), nullable=True),
+            sa.Column("retrieval", postgresql.JSONB(), nullable=True),
+            sa.Column("created_at", sa.DateTime(),
+                      server_default=sa.func.now(), nullable=False),
+            sa.Column("updated_at", sa.DateTime(), nullable=False),
+            sa.PrimaryKeyConstraint("id"),
+            sa.UniqueConstraint("conversation_id", "message_id",
+                                name="conversation_turn__conv_msg_uc"),
+        )
+        op.create_index(op.f("ix_conversation_turn_id"),
+                        "conversation_turn", ["id"], unique=False)
+    backfill()
+
+
+def backfill() -> None:
+    """
+    Split the history stored in `conversation.request` of every conversation into
+    turns. The answer to the last user message is not part of the request; it is
+    `conversation.last_bot_response`. Conversations are read in batches by id.
+    """
+    conversation = sa.table(
+        "conversation",
+        sa.column("id", sa.Integer),
+        sa.column("conversation_id", sa.String),
+        sa.column("sender_id", sa.String),
+        sa.column("last_bot_response", sa.String),
+        sa.column("request", postgresql.JSONB),
+        sa.column("updated_at", sa.DateTime),
+    )
+    turns = sa.table(
+        "conversation_turn",
+        sa.column("conversation_id", sa.String),
+        sa.column("message_id", sa.String),
+        sa.column("turn_index", sa.Integer),
+        sa.column("sender_id", sa.String),
+        sa.column("user_message", sa.String),
+        sa.column("bot_response", sa.String),
+        sa.column("created_at", sa.DateTime),
+        sa.column("updated_at", sa.DateTime),
+    )
+    connection = op.get_bind()
+    last_id = 0
+    while True:
+        rows = connection.execute(
+            sa.select(conversation.c.id, conversation.c.conversation_id, conversation.c.sender_id,
+                      conversation.c.last_bot_response, conversation.c.request, conversation.c.updated_at)
+            .where(conversation.c.id > last_id, conversation.c.request.isnot(None))
+            .order_by(conversation.c.id).limit(BACKFILL_BATCH_SIZE)).fetchall()
+        if not rows:
+            return
+        last_id = rows[-1].id
+        values = [turn for row in rows for turn in split_turns(row)]
+        if values:
+            connection.execute(postgresql.insert(turns).values(
+                values).on_conflict_do_nothing())
+
+
+def split_turns(row) -> list[dict]:
+    turns = []
+    for message in (row.request or {}).get("query") or []:
+        if message.get("role") == "user":
+            created_at = row.updated_at
+            if message.get("timestamp"):
+                # Poe timestamps are microseconds since the epoch.
+                created_at = datetime.fromtimestamp(
+                    message["timestamp"] / 1e6, timezone.utc).replace(tzinfo=None)
+            turns.append({
+                "conversation_id": row.conversation_id,
+                "message_id": message.get("message_id") or f"{row.conversation_id}:{len(turns)}",
+                "turn_index": len(turns),
+                "sender_id": row.sender_id,
+                "user_message": message.get("content") or "",
+                "bot_response": None,
+                "created_at": created_at,
+                "updated_at": created_at,
+            })
+        elif message.get("role") == "bot" and turns and turns[-1]["bot_response"] is None:
+            turns[-1]["bot_response"] = message.get("content")
+    if turns and turns[-1]["bot_response"] is None:
+        turns[-1]["bot_response"] = row.last_bot_response
+        turns[-1]["updated_at"] = row.updated_at
+    return turns
+
+
+def downgrade() -> None:
+    # `conversation.request` was never dropped; only turns recorded since are lost.
+    op.drop_index(op.f("ix_conversation_turn_id"),
+                  table_name="conversation_turn")
+    op.drop_table("conversation_turn")
@@ -0,0 +1,85 @@
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+from pymongo import MongoClient, UpdateOne
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from service.tokenizer import load_tokenizer, count_tokens_batch, tokenizer_name, TOKENIZER_NAME
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+COLLECTION_PREFIXES = ("facts__", "secondary-facts__")
+
+
+def backfill_collection(collection, tokenizer, batch_size: int) -> int:
+    """
+    Store `token_count` and `tokenizer` on every document that has no count for
+    the current tokenizer yet. Returns the number of updated documents.
+    """
+    name = tokenizer_name(tokenizer)
+    cursor = collection.find(
+        {"tokenizer": {"$ne": name}}, {"_id": 1, "text": 1}).batch_size(batch_size)
+
+    updated = 0
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            updated += write_batch(collection, tokenizer, name, batch)
+            batch = []
+            logger.info(f"{collection.name}: {updated} document(s) updated")
+    updated += write_batch(collection, tokenizer, name, batch)
+    return updated
+
+
+def write_batch(collection, tokenizer, name: str, batch: list[dict]) -> int:
+    if not batch:
+        return 0
+    counts = count_tokens_batch(
+        tokenizer, [doc.get("text", "") for doc in batch])
+    collection.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {
+                  "$set": {"token_count": count, "tokenizer": name}})
+        for doc, count in zip(batch, counts)
+    ], ordered=False)
+    return len(batch)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Backfill per-chunk token counts in the facts collections.")
+    parser.add_argument("--db-name", default="tipitaka-viet-db")
+    parser.add_argument("--tokenizer", default=TOKENIZER_NAME)
+    parser.add_argument("--batch-size", type=int, default=500)
+    args = parser.parse_args()
+
+    client = MongoClient(os.environ.get("MONGODB_CONNECTION_STRING"))
+    db = client[args.db_name]
+    tokenizer = load_tokenizer(args.tokenizer)
+
+    for collection_name in sorted(db.list_collection_names()):
+        if not collection_name.startswith(COLLECTION_PREFIXES):
+            continue
+        updated = backfill_collection(
+            db[collection_name], tokenizer, args.batch_size)
+        logger.info(f"{collection_name}: done, {updated} document(s) updated")
+
+
+if __name__ == "__main__":
+    main()
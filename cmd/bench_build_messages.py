@@ -0,0 +1,185 @@
+import io
+import os
+import sys
+import copy
+import contextlib
+import time
+import random
+import argparse
+import statistics
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from service.prompt import build_messages, build_system_prompt, build_chat_input
+from service.tokenizer import count_tokens_batch, tokenizer_name
+from transformers import AutoTokenizer
+# autopep8: on
+
+
+SYLLABLES = (
+    "đức phật dạy các tỳ kheo rằng này pháp cú kinh tương ưng trung bộ "
+    "trường bộ tăng chi tiểu bộ giới định tuệ vô thường khổ vô ngã "
+    "tâm từ bi hỷ xả thiền định chánh niệm tỉnh giác mallikā sāvatthī "
+    "jetavana anāthapiṇḍika ānanda sāriputta moggallāna niết bàn"
+).split()
+
+
+class CountingTokenizer:
+    """Proxy that counts `encode` calls and the number of characters tokenized."""
+
+    def __init__(self, tokenizer):
+        self._tokenizer = tokenizer
+        self.calls = 0
+        self.chars = 0
+
+    def encode(self, text, *args, **kwargs):
+        self.calls += 1
+        self.chars += len(text)
+        return self._tokenizer.encode(text, *args, **kwargs)
+
+    def __call__(self, text, *args, **kwargs):
+        self.calls += 1
+        self.chars += len(text)
+        return self._tokenizer(text, *args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self._tokenizer, name)
+
+
+def build_messages_bisect(tokenizer, query, user_messages, search_results, override_max_tokens=0):
+    """The previous implementation of `build_messages`, kept here as the baseline."""
+    last_bot_response = None
+    for message in reversed(query):
+        if message.role == "bot":
+            last_bot_response = message.content
+            break
+
+    messages = [
+        {"role": "system", "content": ""},
+        {"role": "user", "content": user_messages[-1]}
+    ]
+    if last_bot_response is not None:
+        messages.insert(
+            1, {"role": "assistant", "content": last_bot_response})
+
+    max_tokens = tokenizer.model_max_length
+    if override_max_tokens > 0:
+        max_tokens = override_max_tokens
+
+    def get_token_length(total_sr: int, str_len: int) -> int:
+        cprs = copy.deepcopy(search_results)[:total_sr]
+        cp_messages = copy.deepcopy(messages)
+        cprs[total_sr-1]['content'] = cprs[total_sr-1]['content'][:str_len]
+        cp_messages[0]['content'] = build_system_prompt(cprs)
+        return len(tokenizer.encode(build_chat_input(cp_messages)))
+
+    valid_len = 0
+    ll, hl = 1, len(search_results)
+    while ll <= hl:
+        ml = (ll + hl) // 2
+        if get_token_length(ml, len(search_results[ml-1]['content'])) <= max_tokens:
+            valid_len = ml
+            ll = ml + 1
+        else:
+            hl = ml - 1
+
+    if valid_len == len(search_results):
+        messages[0]['content'] = build_system_prompt(
+            search_results[:valid_len], True)
+        return [messages, valid_len, False]
+
+    ok_str = 0
+    ll, hl = 1000, len(search_results[valid_len]['content'])
+    while ll <= hl:
+        ml = (ll + hl) // 2
+        if get_token_length(valid_len+1, ml) <= max_tokens:
+            ok_str = ml
+            ll = ml + 1
+        else:
+            hl = ml - 1
+
+    if ok_str == 0:
+        messages[0]['content'] = build_system_prompt(
+            search_results[:valid_len], True)
+        return [messages, valid_len, False]
+
+    cpsr = copy.deepcopy(search_results)
+    cpsr[valid_len]['content'] = cpsr[valid_len]['content'][:ok_str]
+    messages[0]['content'] = build_system_prompt(cpsr[:valid_len+1], True)
+    return [messages, valid_len, True]
+
+
+def make_search_results(rng: random.Random, num_results: int, content_chars: int, num_sources: int):
+    results = []
+    for i in range(num_results):
+        words = []
+        while sum(len(w) + 1 for w in words) < content_chars:
+            words.append(rng.choice(SYLLABLES))
+        results.append({
+            'source': f"Kinh Số {rng.randrange(num_sources)} → Phẩm {i}",
+            'content': " ".join(words),
+            'score': 80.0,
+            'chunk_num': i,
+        })
+    return results
+
+
+def bench(fn, tokenizer, search_results, user_messages, max_tokens, rounds):
+    counting = CountingTokenizer(tokenizer)
+    timings = []
+    output = None
+    for _ in range(rounds):
+        # Both implementations print the final context; keep it out of the report.
+        with contextlib.redirect_stdout(io.StringIO()):
+            started = time.perf_counter()
+            output = fn(counting, [], user_messages,
+                        copy.deepcopy(search_results), override_max_tokens=max_tokens)
+            timings.append(time.perf_counter() - started)
+    return output, timings, counting.calls / rounds, counting.chars / rounds
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compare the token-budget packer in build_messages with the old bisection.")
+    parser.add_argument("--tokenizer", default="Qwen/Qwen2.5-72B-Instruct")
+    parser.add_argument("--results", type=int, default=20)
+    parser.add_argument("--content-chars", type=int, default=6000)
+    parser.add_argument("--sources", type=int, default=8)
+    parser.add_argument("--max-tokens", type=int, default=32769 * 95 // 100 - 2048)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--precomputed", action="store_true",
+                        help="attach ingest-time token counts to the search results")
+    args = parser.parse_args()
+
+    tokenizer = AutoTokenizer.from_pretrained(
+        args.tokenizer, trust_remote_code=True)
+    search_results = make_search_results(
+        random.Random(args.seed), args.results, args.content_chars, args.sources)
+    if args.precomputed:
+        counts = count_tokens_batch(
+            tokenizer, [rs['content'] for rs in search_results])
+        for rs, count in zip(search_results, counts):
+            rs['token_count'] = count
+            rs['tokenizer'] = tokenizer_name(tokenizer)
+    user_messages = [
+        "Hoàng hậu Mallikā và công chúa Mallikā có ai đắc quả thánh không?"]
+
+    rows = []
+    for name, fn in [("bisect", build_messages_bisect), ("packer", build_messages)]:
+        output, timings, calls, chars = bench(
+            fn, tokenizer, search_results, user_messages, args.max_tokens, args.rounds)
+        messages, num_results, with_half_content = output
+        total_tokens = len(tokenizer.encode(build_chat_input(messages)))
+        rows.append((name, statistics.median(timings), calls, chars))
+        print(f"{name:>7}: median {statistics.median(timings) * 1000:8.1f} ms | "
+              f"{calls:5.1f} tokenizer calls | {chars / 1000:8.1f}k chars tokenized | "
+              f"results={num_results} half={with_half_content} tokens={total_tokens}/{args.max_tokens}")
+
+    print(f"speedup: {rows[0][1] / rows[1][1]:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
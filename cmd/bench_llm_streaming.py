@@ -0,0 +1,124 @@
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import argparse
+import threading
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import StreamingResponse
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from service.llm import AsyncLLMClient
+# autopep8: on
+
+
+def make_fake_server(tokens: int, delay: float, first_token: float = 0.0) -> FastAPI:
+    """
+    OpenAI-compatible `/chat/completions` that streams `tokens` deltas, `delay` seconds
+    apart, the first one `first_token` seconds after the request.
+    """
+    app = FastAPI()
+
+    @app.post("/chat/completions")
+    async def chat_completions(payload: dict):
+        async def events():
+            await asyncio.sleep(first_token)
+            for i in range(tokens):
+                await asyncio.sleep(delay)
+                chunk = {"choices": [{"index": 0, "delta": {"content": f"t{i} "}}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def start_server(app: FastAPI) -> str:
+    """Serve `app` from a thread of its own, so a blocked client loop cannot stall it."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(
+        app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return f"http://127.0.0.1:{port}"
+
+
+async def converse_async(client: AsyncLLMClient, conversation: int, arrivals: list):
+    async for _ in client.stream_chat(model="fake", messages=[{"role": "user", "content": "hi"}]):
+        arrivals.append((time.perf_counter(), conversation))
+
+
+async def converse_blocking(base_url: str, conversation: int, arrivals: list):
+    """The previous pattern: a synchronous stream iterated inside a coroutine."""
+    with httpx.Client(base_url=base_url, timeout=60) as client:
+        with client.stream("POST", "/chat/completions", json={"model": "fake", "messages": [], "stream": True}) as response:
+            for line in response.iter_lines():
+                if line.startswith("data:") and "[DONE]" not in line:
+                    arrivals.append((time.perf_counter(), conversation))
+
+
+async def run(mode: str, base_url: str, conversations: int, max_concurrency: int):
+    arrivals = []
+    started = time.perf_counter()
+    if mode == "async":
+        client = AsyncLLMClient(api_key="fake", base_url=base_url,
+                                max_concurrency=max_concurrency)
+        await asyncio.gather(*(converse_async(client, i, arrivals) for i in range(conversations)))
+        await client.aclose()
+    else:
+        await asyncio.gather(*(converse_blocking(base_url, i, arrivals) for i in range(conversations)))
+    elapsed = time.perf_counter() - started
+    arrivals.sort()
+    switches = sum(a[1] != b[1] for a, b in zip(arrivals, arrivals[1:]))
+    first_token = {}
+    for at, conversation in arrivals:
+        first_token.setdefault(conversation, at - started)
+    return elapsed, switches, len(arrivals), max(first_token.values())
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Stream several conversations at once from a local fake LLM server and "
+                    "check that their tokens interleave.")
+    parser.add_argument("--conversations", type=int, default=8)
+    parser.add_argument("--tokens", type=int, default=50)
+    parser.add_argument("--delay", type=float, default=0.01,
+                        help="seconds between two tokens of one stream")
+    parser.add_argument("--max-concurrency", type=int, default=32)
+    parser.add_argument("--baseline", action="store_true",
+                        help="also run the previous blocking client")
+    args = parser.parse_args()
+
+    base_url = start_server(make_fake_server(args.tokens, args.delay))
+    single = args.tokens * args.delay
+    results = {}
+    for mode in (["blocking"] if args.baseline else []) + ["async"]:
+        elapsed, switches, tokens, worst_first_token = asyncio.run(
+            run(mode, base_url, args.conversations, args.max_concurrency))
+        results[mode] = elapsed
+        print(f"{mode:>8}: {elapsed:6.2f}s for {args.conversations} conversations "
+              f"({single:.2f}s each) | {tokens} tokens | {switches} switches between conversations | "
+              f"slowest first token {worst_first_token:.2f}s")
+
+    if "blocking" in results:
+        print(f"speedup: {results['blocking'] / results['async']:.1f}x")
+    # Interleaved streams finish in about the time of one stream when the limit allows.
+    expected = single * -(-args.conversations // args.max_concurrency)
+    if results["async"] > 2 * expected + 1:
+        print(f"FAIL: conversations were not streamed concurrently (expected ~{expected:.2f}s)")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,358 @@
+import io
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import asyncio
+import argparse
+import tempfile
+import functools
+import contextlib
+import statistics
+import subprocess
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import fastapi_poe as fp
+from langchain_core.embeddings import Embeddings
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from db import postgres
+from db.lexical_index import LexicalIndex
+from db.local_index import LocalVectorIndex
+from db.write_behind import WriteBehindQueue
+from service.bot import TipitakaAI
+from service.embedding_cache import CachedEmbeddings
+from service.health_check import HealthMonitor
+from service.ingest_stream import chunk_source, chunk_ids
+from service.llm import AsyncLLMClient
+from service.routing import ModelRouter, DEFAULT_MODEL, tokenizer_for
+from service.tokenizer import count_tokens_batch, tokenizer_name, vendored_tokenizer_path
+from bench_build_messages import SYLLABLES, make_search_results
+from bench_llm_streaming import make_fake_server, start_server
+# autopep8: on
+
+
+# Stages reported besides the ones timed by the bot, as sums of those.
+DERIVED_STAGES = {
+    "retrieval": ("lexical", "embed", "search"),
+    "build_messages": ("prepare_prompt", "pack", "repack"),
+}
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic bag-of-words embeddings: every word maps to a fixed random vector
+    (seeded by its CRC32) and a text to the sum of its words, so texts sharing words
+    are close. Each call sleeps `latency` seconds, like a request to the provider.
+    """
+
+    def __init__(self, dimensions: int = 256, latency: float = 0.0) -> None:
+        self.dimensions = dimensions
+        self.latency = latency
+
+    def _embed(self, text: str) -> List[float]:
+        vector = np.zeros(self.dimensions)
+        for word in text.lower().split():
+            vector += _word_vector(word, self.dimensions)
+        return vector.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        time.sleep(self.latency)
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return self._embed(text)
+
+
+@functools.lru_cache(maxsize=None)
+def _word_vector(word: str, dimensions: int) -> np.ndarray:
+    return np.random.default_rng(zlib.crc32(word.encode())).standard_normal(dimensions)
+
+
+def load_corpus(path: Optional[str], rng: random.Random, sources: int, content_chars: int) -> List[Dict[str, str]]:
+    """Sources from an NDJSON upload file (`source_name`, `content`), or generated ones."""
+    if path:
+        with open(path, "r", encoding="utf-8") as f:
+            return [json.loads(line) for line in f if line.strip()]
+    return [{"source_name": rs["source"], "content": rs["content"]}
+            for rs in make_search_results(rng, sources, content_chars, sources)]
+
+
+def fill_index(index: LocalVectorIndex, embeddings: Embeddings, tokenizer, corpus: List[Dict[str, str]],
+               lexical_index: Optional[LexicalIndex] = None) -> List[str]:
+    """Chunk, count and embed the corpus the way `/sources/upload` does; return the chunk texts."""
+    all_texts = []
+    for source in corpus:
+        chunks = chunk_source(source["source_name"], source["content"], slice=1)
+        texts = [text for text, _ in chunks]
+        all_texts.extend(texts)
+        ids = chunk_ids(chunks)
+        if lexical_index is not None:
+            lexical_index.add([{"id": chunk_id, "text": text, **metadata}
+                               for chunk_id, (text, metadata) in zip(ids, chunks)])
+        index.upsert([
+            {"_id": chunk_id, "text": text, "embedding": embedding, **metadata,
+             "token_count": token_count, "tokenizer": tokenizer_name(tokenizer)}
+            for chunk_id, (text, metadata), embedding, token_count in zip(
+                ids, chunks, embeddings.embed_documents(texts),
+                count_tokens_batch(tokenizer, texts))
+        ])
+    return all_texts
+
+
+def make_request(rng: random.Random, i: int, words: int, quoted_texts: Optional[List[str]] = None) -> fp.QueryRequest:
+    """A random question, or with `quoted_texts` a run of words copied from one of them."""
+    if quoted_texts:
+        text = rng.choice(quoted_texts).split()
+        start = rng.randrange(max(len(text) - words, 0) + 1)
+        question = " ".join(text[start:start + words]) + "?"
+    else:
+        # "như thế nào" is not in the generated corpus; like a paraphrased question it
+        # keeps the lexical probe from being confident.
+        question = " ".join(rng.choice(SYLLABLES) for _ in range(words)) + " như thế nào?"
+    return fp.QueryRequest(
+        version="1.0", type="query", user_id=f"bench-user-{i % 50}",
+        conversation_id=f"bench-conversation-{i}", message_id=f"bench-message-{i}",
+        query=[fp.ProtocolMessage(role="user", content=question, message_id=f"bench-message-{i}")])
+
+
+def percentiles(values: List[float]) -> Dict[str, float]:
+    """Count, mean and p50/p95/p99 of durations in seconds, reported in milliseconds."""
+    if len(values) < 2:
+        values = values * 2
+    cuts = statistics.quantiles(values, n=100, method="inclusive")
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+    }
+
+
+def summarize(timings: List[Dict[str, float]], flushes: List[float]) -> Dict[str, Dict[str, float]]:
+    stages: Dict[str, List[float]] = {}
+    for timing in timings:
+        for name, seconds in timing.items():
+            stages.setdefault(name, []).append(seconds)
+        for name, parts in DERIVED_STAGES.items():
+            if any(part in timing for part in parts):
+                stages.setdefault(name, []).append(
+                    sum(timing.get(part, 0.0) for part in parts))
+    if flushes:
+        stages["flush"] = flushes
+    return {name: percentiles(values) for name, values in stages.items()}
+
+
+async def run_level(bot: TipitakaAI, requests: List[fp.QueryRequest], concurrency: int) -> tuple[float, int]:
+    """Answer `requests`, `concurrency` at a time; return the elapsed time and the errors."""
+    semaphore = asyncio.Semaphore(concurrency)
+    errors = 0
+
+    async def answer(request: fp.QueryRequest) -> None:
+        nonlocal errors
+        async with semaphore:
+            async for event in bot.get_response(request):
+                if isinstance(event, fp.ErrorResponse):
+                    errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(answer(request) for request in requests))
+    return time.perf_counter() - started, errors
+
+
+async def bench(args, workdir: str) -> Dict[str, Any]:
+    rng = random.Random(args.seed)
+    router = ModelRouter(default_model=DEFAULT_MODEL)
+    tokenizer = router.tokenizer(DEFAULT_MODEL)
+
+    # Queries pay the simulated provider latency, behind the cache used in production;
+    # indexing does not.
+    embeddings = CachedEmbeddings(
+        FakeEmbeddings(args.dimensions, args.embedding_latency),
+        path=os.path.join(workdir, "embeddings.sqlite3"), namespace="fake")
+    index = LocalVectorIndex(os.path.join(workdir, "index"),
+                             embeddings, dimensions=args.dimensions)
+    # With --lexical, quoted questions are what the lexical probe answers on its own.
+    lexical_index = LexicalIndex(os.path.join(workdir, "lexical.sqlite3")) if args.lexical else None
+    corpus = load_corpus(args.corpus, rng, args.sources, args.content_chars)
+    started = time.perf_counter()
+    texts = fill_index(index, FakeEmbeddings(args.dimensions), tokenizer, corpus, lexical_index)
+    index.reload()
+    print(f"Indexed {len(corpus)} sources, {len(index)} chunks in {time.perf_counter() - started:.1f}s")
+
+    _, session_factory = postgres.init_db(f"sqlite:///{os.path.join(workdir, 'bench.sqlite3')}")
+    flushes: List[float] = []
+    write_behind = None
+    if not args.sync_save:
+        write_behind = WriteBehindQueue(
+            session_factory, flush_interval=args.flush_interval,
+            on_flush=lambda rows, seconds: flushes.append(seconds))
+        write_behind.start()
+
+    base_url = start_server(make_fake_server(
+        args.llm_tokens, 1 / args.tokens_per_second, args.first_token))
+    llm = AsyncLLMClient(api_key="fake", base_url=base_url,
+                         max_concurrency=args.llm_max_concurrency)
+    health_monitor = HealthMonitor({"fake": lambda: None}, interval=3600)
+    await health_monitor.start()
+
+    timings: List[Dict[str, float]] = []
+    bot = TipitakaAI()
+    bot.init(
+        bot_name="bench",
+        health_monitor=health_monitor,
+        llm=llm,
+        vector_store=index,
+        secondary_vector_store=index,
+        session_factory=session_factory,
+        lexical_index=lexical_index,
+        write_behind=write_behind,
+        on_timings=lambda timing: timings.append(dict(timing)),
+        router=router,
+    )
+
+    levels = []
+    try:
+        # The prompt packer prints the final context of every answer.
+        with contextlib.redirect_stdout(io.StringIO()):
+            await run_level(bot, [make_request(rng, -i - 1, args.question_words)
+                                  for i in range(args.warmup)], 1)
+        count = 0
+        for concurrency in args.concurrency:
+            timings.clear()
+            flushes.clear()
+            requests = [make_request(rng, count + i, args.question_words,
+                                     texts if rng.random() < args.quoted_questions else None)
+                        for i in range(args.requests)]
+            count += args.requests
+            with contextlib.redirect_stdout(io.StringIO()):
+                elapsed, errors = await run_level(bot, requests, concurrency)
+            if write_behind is not None:
+                # Wait for this level's rows so their flushes are counted here.
+                while write_behind.stats()["queued"]:
+                    await asyncio.sleep(0.01)
+            level = {
+                "concurrency": concurrency,
+                "requests": len(requests),
+                "errors": errors,
+                "elapsed_seconds": elapsed,
+                "throughput_rps": len(requests) / elapsed,
+                "stages": summarize(timings, flushes),
+            }
+            levels.append(level)
+            print_level(level)
+    finally:
+        await health_monitor.stop()
+        await llm.aclose()
+        if write_behind is not None:
+            write_behind.stop()
+
+    return {
+        "corpus": {"sources": len(corpus), "chunks": len(index)},
+        "write_behind": write_behind.stats() if write_behind is not None else None,
+        "levels": levels,
+    }
+
+
+def print_level(level: Dict[str, Any]) -> None:
+    print(f"\nconcurrency {level['concurrency']}: {level['requests']} requests in "
+          f"{level['elapsed_seconds']:.2f}s, {level['throughput_rps']:.1f} req/s, {level['errors']} errors")
+    for name, stats in level["stages"].items():
+        print(f"  {name:>15}: p50 {stats['p50_ms']:8.1f} ms | p95 {stats['p95_ms']:8.1f} ms | "
+              f"p99 {stats['p99_ms']:8.1f} ms | n={stats['count']}")
+
+
+def compare(result: Dict[str, Any], path: str) -> None:
+    """Print throughput and p95 changes against a previous result file."""
+    with open(path, "r", encoding="utf-8") as f:
+        previous = {level["concurrency"]: level for level in json.load(f)["levels"]}
+    print(f"\nCompared with {path}:")
+    for level in result["levels"]:
+        before = previous.get(level["concurrency"])
+        if before is None:
+            continue
+        changes = [f"throughput {level['throughput_rps'] / before['throughput_rps'] - 1:+.0%}"]
+        for name in ("retrieval", "build_messages", "save", "first_token", "total"):
+            if name in level["stages"] and name in before["stages"]:
+                changes.append(
+                    f"{name} p95 {level['stages'][name]['p95_ms'] / before['stages'][name]['p95_ms'] - 1:+.0%}")
+        print(f"  concurrency {level['concurrency']}: {', '.join(changes)}")
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=parent_dir,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run TipitakaAI.get_response end to end against local stand-ins (fake "
+                    "embeddings, a local vector index of a fixture corpus, a fake streaming LLM "
+                    "and SQLite) and report p50/p95/p99 per stage and the throughput at "
+                    "several concurrency levels.")
+    parser.add_argument("--concurrency", type=lambda value: [int(c) for c in value.split(",")],
+                        default=[1, 4, 16, 64], help="comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=100,
+                        help="requests per concurrency level")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--corpus", help="NDJSON file of {source_name, content}, as for "
+                                         "/sources/upload; generated when omitted")
+    parser.add_argument("--sources", type=int, default=200)
+    parser.add_argument("--content-chars", type=int, default=8000)
+    parser.add_argument("--question-words", type=int, default=15)
+    parser.add_argument("--lexical", action="store_true",
+                        help="search with a lexical index of the corpus as well (LEXICAL_INDEX_PATH)")
+    parser.add_argument("--quoted-questions", type=float, default=0.0,
+                        help="share of questions copied from a corpus chunk; with --lexical "
+                             "these skip the embedding and the vector search")
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--embedding-latency", type=float, default=0.1,
+                        help="seconds per embedding request")
+    parser.add_argument("--first-token", type=float, default=0.3,
+                        help="seconds until the fake LLM streams its first token")
+    parser.add_argument("--tokens-per-second", type=float, default=100)
+    parser.add_argument("--llm-tokens", type=int, default=50,
+                        help="tokens streamed per answer")
+    parser.add_argument("--llm-max-concurrency", type=int, default=32)
+    parser.add_argument("--sync-save", action="store_true",
+                        help="save conversations inside the request instead of the write-behind queue")
+    parser.add_argument("--flush-interval", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default=os.path.join(
+        parent_dir, "bench_results", f"pipeline-{datetime.now():%Y%m%d-%H%M%S}.json"))
+    parser.add_argument("--compare", help="previous result file to compare with")
+    args = parser.parse_args()
+
+    name = tokenizer_for(DEFAULT_MODEL)
+    if not os.path.exists(os.path.join(vendored_tokenizer_path(name), "tokenizer.json")):
+        sys.exit(f"Tokenizer {name} is not vendored; run `python cmd/vendor_tokenizer.py` first")
+
+    started_at = datetime.now(timezone.utc).isoformat()
+    with tempfile.TemporaryDirectory(prefix="bench-pipeline-") as workdir:
+        result = asyncio.run(bench(args, workdir))
+    result = {"started_at": started_at, "commit": git_commit(),
+              "args": {key: value for key, value in vars(args).items() if key not in ("output", "compare")},
+              **result}
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2)
+    print(f"\nSaved to {args.output}")
+    if args.compare:
+        compare(result, args.compare)
+
+
+if __name__ == "__main__":
+    main()
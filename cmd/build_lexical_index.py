@@ -0,0 +1,81 @@
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from db import mongoatlas
+from db.lexical_index import LexicalIndex
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+
+def build(collection, index: LexicalIndex, batch_size: int) -> None:
+    """
+    Add documents of `collection` missing from `index` and drop the ones removed
+    from the collection. Uploads through the API update the index on their own, so
+    this is only needed once, or after importing data behind the API's back.
+    """
+    local = index.ids()
+    remote = {str(doc["_id"]) for doc in collection.find({}, {"_id": 1})}
+    removed = local - remote
+    added = [id for id in remote if id not in local]
+    logger.info(
+        f"{collection.name}: {len(added)} new, {len(removed)} removed")
+
+    if removed:
+        index.delete(removed)
+    for start in range(0, len(added), batch_size):
+        batch = added[start:start + batch_size]
+        docs = collection.find({"_id": {"$in": batch}}, {
+                               "text": 1, "source": 1, "chunk_num": 1})
+        index.add([{"id": str(doc["_id"]), "text": doc.get("text", ""), "source": doc.get("source"),
+                    "chunk_num": doc.get("chunk_num")} for doc in docs])
+        logger.info(
+            f"{collection.name}: indexed {min(start + batch_size, len(added))}/{len(added)}")
+    # One segment per batch was appended; merge them for faster startup.
+    index.compact()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build or incrementally update the BM25 lexical index from MongoDB.")
+    parser.add_argument("--path", default=os.environ.get(
+        "LEXICAL_INDEX_PATH", ".cache/lexical-index.sqlite3"))
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--query", help="run a test query after building")
+    args = parser.parse_args()
+
+    mongodb_helper = mongoatlas.MongoDBHelper(
+        connection_str=os.environ.get("MONGODB_CONNECTION_STRING"),
+        db_name="tipitaka-viet-db",
+        vector_store_name="facts__text-embedding-3-large",
+        secondary_vector_store_name="secondary-facts__text-embedding-3-large",
+        vector_store_index="text-embedding-3-large",
+    )
+    index = LexicalIndex(args.path)
+    build(mongodb_helper.secondary_vector_collection, index, args.batch_size)
+
+    if args.query:
+        for rs in index.search(args.query, k=10):
+            logger.info(
+                f"{rs['bm25']:.2f} ({rs['coverage']:.0%}) {rs['source']} #{rs['chunk_num']}")
+
+
+if __name__ == "__main__":
+    main()
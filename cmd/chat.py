@@ -13,32 +13,13 @@ sys.path.append(parent_dir)
 
 from db import mongoatlas
 from service.health_check import HealthChecker
+from service.routing import MODEL_MAPPING
 from db import postgres
 from service.prompt import build_messages, similarity_search_with_detailed_reranking,build_search_response, refine_search_results, build_bot_summary, similarity_search
 from transformers import AutoTokenizer
 # autopep8: on
 
 
-MODEL_MAPPING = {
-    "Qwen/Qwen2.5-72B-Instruct-Turbo": "Qwen/Qwen2.5-72B-Instruct",
-    "meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
-    "deepseek-ai/DeepSeek-R1-Distill-Llama-70B": "deepseek-ai/DeepSeek-R1-Distill-Llama-70B",
-    "deepseek-ai/deepseek-llm-67b-chat": "deepseek-ai/deepseek-llm-67b-chat",
-    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
-    "meta-llama/Llama-3.2-3B-Instruct-Turbo": "meta-llama/Llama-3.2-3B-Instruct-Turbo",
-    "Qwen/Qwen2.5-7B-Instruct-Turbo": "Qwen/Qwen2.5-7B-Instruct",
-    "mistralai/Mixtral-8x7B-Instruct-v0.1": "mistralai/Mixtral-8x7B-Instruct-v0.1",
-    "microsoft/WizardLM-2-8x22B": "microsoft/WizardLM-2-8x22B",
-    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo",
-    "mistralai/Mixtral-8x22B-Instruct-v0.1": "mistralai/Mixtral-8x22B-Instruct-v0.1",
-    "Qwen/Qwen2-72B-Instruct": "Qwen/Qwen2-72B-Instruct",
-    "scb10x/scb10x-llama3-typhoon-v1-5x-4f316": "scb10x/scb10x-llama3-typhoon-v1-5x-4f316",
-    "meta-llama/Meta-Llama-3-70B-Instruct-Lite": "meta-llama/Meta-Llama-3-70B-Instruct-Lite",
-    "meta-llama/Llama-3-8b-chat-hf": "meta-llama/Llama-3-8b-chat-hf",
-    "meta-llama/Llama-2-13b-chat-hf": "meta-llama/Llama-2-13b-chat-hf",
-}
-
-
 # Setup logging
 load_dotenv()
 logging.basicConfig(
@@ -1,150 +1,326 @@
+import argparse
+import asyncio
+import hashlib
 import json
+import logging
 import os
-import requests
+import random
 import sys
+import time
+
+import httpx
 from dotenv import load_dotenv
+from rich.console import Console
+from rich.logging import RichHandler
 
 BASE_URL = "http://localhost:8080"
 EXTRA_PARAMS = ""
 
+logger = logging.getLogger(__name__)
+
+MANIFEST_VERSION = 1
+# Status codes worth retrying; anything else (400, 403, 422, ...) fails immediately.
+RETRYABLE_STATUS = {408, 425, 429, 500, 502, 503, 504}
+
 
 def load_sources(filename):
     with open(filename, "r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def load_content(source_path, source_dir):
+def resolve_path(source_path, source_dir):
     # If source_path is an absolute path, use it without modifications.
     if os.path.isabs(source_path):
-        full_path = source_path
-    else:
-        # Otherwise, load it relative to the directory containing sources.json (assumed to be the script's directory)
-        full_path = os.path.join(source_dir, source_path)
-    if not os.path.exists(full_path):
-        # File does not exist, skip without printing an error.
-        return None
+        return source_path
+    # Otherwise, load it relative to the directory containing sources.json
+    return os.path.join(source_dir, source_path)
+
+
+def load_content(full_path):
     try:
         with open(full_path, "r", encoding="utf-8") as f:
             return f.read()
     except Exception as e:
-        print(f"Error reading {full_path}: {e}")
+        logger.error(f"Error reading {full_path}: {e}")
         return None
 
 
-def get_nonexistent_sources(sources):
-    names = [s["name"] for s in sources]
-    url = f"{BASE_URL}/sources/exists?{EXTRA_PARAMS}"
-    try:
-        resp = requests.request("GET", url, json=names, headers={
-                                "accept": "application/json", "Content-Type": "application/json"})
-        if resp.status_code == 200:
-            existing: list[bool] = resp.json()
-            return [s for s, e in zip(sources, existing) if not e]
-        else:
-            print(
-                f"Failed to check existence. Server responded with: {resp.status_code}")
-    except Exception as e:
-        print(f"Error calling {url}: {e}")
-        print("Assuming no sources exist.")
-    return sources
+def file_sha256(full_path):
+    digest = hashlib.sha256()
+    with open(full_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
 
+def short_name(name):
+    pre = name[:10].replace("\n", "/n")
+    suf = name[-30:].replace("\n", "/n")
+    return f"{pre}...{suf}"
 
-def upload_sources_batch(sources, source_dir):
+
+class Manifest:
     """
-    Uploads a batch of source files to a remote server.
-
-    This function takes a list of source dictionaries, where each dictionary must
-    contain at least the keys "name" and "path". For each source, it loads the file content
-    (using the load_content function provided elsewhere) and constructs a payload that is then
-    sent to the designated upload URL (constructed using the global BASE_URL).
-
-    If the upload attempt returns a status code of 200, the function prints a success message
-    indicating the number of sources uploaded. Otherwise, if the upload fails and there is only one
-    source in the input list, it prints an error message with details from the server response.
-    In cases where the batch has more than one source and the upload fails, the list is split in half
-    and the function recursively attempts to upload each half separately.
-
-    Parameters:
-        sources (list of dict): A list of source dictionaries, each containing:
-            - "name" (str): A unique name or identifier for the source.
-            - "path" (str): The file path to load the source content.
-
-    Returns:
-        None
+    Checkpoint of uploaded sources, stored as JSON next to sources.json:
+    `{"sources": {name: {"sha256", "status", "updated_at", "error"?}}}`.
+    It is rewritten atomically after every batch, so an interrupted run resumes
+    with the sources that were not confirmed by the server.
     """
-    if not sources:
-        return
 
-    payload = []
+    def __init__(self, path, target):
+        self.path = path
+        self.target = target
+        self.sources = {}
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("target") == target:
+                self.sources = data.get("sources", {})
+            else:
+                logger.warning(
+                    f"Manifest {path} was written for {data.get('target')}, ignoring it")
 
+    def is_done(self, name, sha256):
+        entry = self.sources.get(name)
+        return entry is not None and entry["status"] == "done" and entry["sha256"] == sha256
+
+    def mark(self, names_and_hashes, status, error=None):
+        now = time.time()
+        for name, sha256 in names_and_hashes:
+            entry = {"sha256": sha256, "status": status, "updated_at": now}
+            if error:
+                entry["error"] = error
+            self.sources[name] = entry
+        self.save()
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"version": MANIFEST_VERSION, "target": self.target,
+                      "sources": self.sources}, f, ensure_ascii=False, indent=1)
+        os.replace(tmp_path, self.path)
+
+
+def plan_uploads(sources, source_dir, manifest):
+    """Return `[{name, path, sha256, size}]` for sources that are new, changed or failed."""
+    pending = []
     for s in sources:
-        content = load_content(s["path"], source_dir)
-        if content is None:
-            pre = s["name"][:10].replace("\n", "/n")
-            suf = s["name"][-30:].replace("\n", "/n")
-            print(f"Skipping source '{pre}...{suf}' because file not found.")
+        full_path = resolve_path(s["path"], source_dir)
+        if not os.path.exists(full_path):
+            # File does not exist, skip without printing an error.
+            logger.info(
+                f"Skipping source '{short_name(s['name'])}' because file not found.")
+            continue
+        sha256 = file_sha256(full_path)
+        if manifest.is_done(s["name"], sha256):
             continue
-        payload.append({
-            "source_name": s["name"],
-            "content": content
-        })
+        pending.append({"name": s["name"], "path": full_path, "sha256": sha256,
+                        "size": os.path.getsize(full_path)})
+    return pending
+
 
+async def seed_from_server(client, pending, manifest):
+    """
+    Sources the manifest has never seen but the server already has (e.g. uploaded
+    before the manifest existed) are recorded as done instead of being re-sent.
+    """
+    unseen = [p for p in pending if p["name"] not in manifest.sources]
+    if not unseen:
+        return pending
     try:
-        resp = requests.put(f"{BASE_URL}/sources/upload?{EXTRA_PARAMS}", json=payload,
-                            headers={
-                                "accept": "application/json",
-                                "Content-Type": "application/json",
-                                "X-API-Key": os.environ.get("IMPORT__API_KEY")
-                            })
+        resp = await client.request("GET", f"/sources/exists?{EXTRA_PARAMS}", json=[p["name"] for p in unseen])
+        resp.raise_for_status()
+        existing = resp.json()
     except Exception as e:
-        print(f"Error uploading sources: {e}")
-        return
+        logger.warning(f"Error checking existing sources: {e}. Assuming none exist.")
+        return pending
+    seeded = {p["name"] for p, e in zip(unseen, existing) if e}
+    manifest.mark([(p["name"], p["sha256"])
+                  for p in unseen if p["name"] in seeded], "done")
+    logger.info(f"{len(seeded)} source(s) already on the server")
+    return [p for p in pending if p["name"] not in seeded]
+
+
+def make_batches(pending, batch_bytes):
+    """Group sources into batches of at most `batch_bytes`; bigger sources go alone."""
+    batches, batch, size = [], [], 0
+    for p in pending:
+        if batch and size + p["size"] > batch_bytes:
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(p)
+        size += p["size"]
+    if batch:
+        batches.append(batch)
+    return batches
 
+
+def backoff_delay(attempt, base=1.0, cap=60.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class UploadError(Exception):
+    def __init__(self, message, retryable):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+async def send_batch(client, payload):
+    try:
+        resp = await client.put(f"/sources/replace?{EXTRA_PARAMS}", json=payload)
+    except httpx.HTTPError as e:
+        raise UploadError(f"{type(e).__name__}: {e}", retryable=True)
     if resp.status_code == 200:
-        print(f"Uploaded {len(payload)} source(s) successfully.")
-    elif resp.status_code == 403:
-        print("Access denied. Please check your API key.")
-    elif resp.status_code == 500 or resp.status_code == 400:
-        # If there is only one source, print the error message.
-        if len(sources) == 1:
-            print(
-                f"Failed to upload source '{sources[0]['name']}'. Status code: {resp.status_code}. Response: {resp.text}")
-        else:
-            # Split the list into two parts and try each one.
-            mid = len(sources) // 2
-            print(
-                f"Batch upload failed ({resp.status_code}). Splitting into two batches: 0-{mid-1} and {mid}-{len(sources)-1}")
-            upload_sources_batch(sources[:mid], source_dir)
-            upload_sources_batch(sources[mid:], source_dir)
-    else:
-        print(
-            f"Failed to upload sources. Status code: {resp.status_code}. Response: {resp.text}")
+        return
+    if resp.status_code == 403:
+        raise UploadError("Access denied. Please check your API key.", retryable=False)
+    raise UploadError(f"Status code: {resp.status_code}. Response: {resp.text[:500]}",
+                      retryable=resp.status_code in RETRYABLE_STATUS)
 
 
-def main():
-    if len(sys.argv) > 1:
-        sources_file = sys.argv[1]
-    else:
-        sources_file = os.path.join(os.path.dirname(__file__), "sources.json")
+async def upload_worker(client, queue, manifest, retries, stats):
+    while True:
+        batch = await queue.get()
+        try:
+            await upload_batch(client, queue, batch, manifest, retries, stats)
+        finally:
+            queue.task_done()
+
 
+async def upload_batch(client, queue, batch, manifest, retries, stats):
     try:
-        sources = load_sources(sources_file)
+        await send_with_retries(client, queue, batch, manifest, retries, stats)
     except Exception as e:
-        print(f"Failed to load sources from {sources_file}: {e}")
+        # Any other error (unreadable content, manifest write, ...) fails the batch; a
+        # dead worker would leave `queue.join()` waiting forever.
+        error = f"{type(e).__name__}: {e}"
+        for p in batch:
+            p.pop("content", None)
+        try:
+            manifest.mark([(p["name"], p["sha256"]) for p in batch], "failed", error)
+        except Exception as mark_error:
+            logger.error(f"Error writing manifest: {mark_error}")
+        stats["failed"] += len(batch)
+        logger.error(
+            f"Failed to upload source(s) {', '.join(short_name(p['name']) for p in batch)}. {error}")
+
+
+async def send_with_retries(client, queue, batch, manifest, retries, stats):
+    payload = []
+    for p in batch:
+        if "content" not in p:
+            p["content"] = load_content(p["path"])
+        if p["content"] is not None:
+            payload.append({"source_name": p["name"], "content": p["content"]})
+    names_and_hashes = [(p["name"], p["sha256"])
+                        for p in batch if p["content"] is not None]
+    if not payload:
         return
 
-    sources_to_upload = get_nonexistent_sources(sources)
-    if not sources_to_upload:
-        print("No new sources to upload.")
+    for attempt in range(retries + 1):
+        try:
+            await send_batch(client, payload)
+            for p in batch:
+                p.pop("content", None)
+            manifest.mark(names_and_hashes, "done")
+            stats["done"] += len(payload)
+            logger.info(
+                f"Uploaded {len(payload)} source(s) successfully ({stats['done']}/{stats['total']}).")
+            return
+        except UploadError as e:
+            error = e
+            if not e.retryable or attempt == retries:
+                break
+            delay = backoff_delay(attempt)
+            logger.warning(
+                f"Batch of {len(payload)} source(s) failed ({e}), retrying in {delay:.1f}s")
+            await asyncio.sleep(delay)
+
+    if len(batch) > 1 and error.retryable:
+        # Isolate the failing source(s); contents are kept, files are not read again.
+        logger.warning(
+            f"Batch of {len(batch)} source(s) failed ({error}). Retrying each source on its own.")
+        for p in batch:
+            queue.put_nowait([p])
         return
+    for p in batch:
+        p.pop("content", None)
+    manifest.mark(names_and_hashes, "failed", str(error))
+    stats["failed"] += len(payload)
+    logger.error(
+        f"Failed to upload source(s) {', '.join(short_name(name) for name, _ in names_and_hashes)}. {error}")
+
+
+async def run(args):
+    sources = load_sources(args.sources_file)
+    source_dir = os.path.dirname(args.sources_file)
+    manifest = Manifest(args.manifest, f"{BASE_URL}?{EXTRA_PARAMS}")
+
+    headers = {
+        "accept": "application/json",
+        "X-API-Key": os.environ.get("IMPORT__API_KEY", ""),
+    }
+    timeout = httpx.Timeout(args.timeout, connect=30.0)
+    limits = httpx.Limits(max_connections=args.workers)
+    async with httpx.AsyncClient(base_url=BASE_URL, headers=headers, timeout=timeout, limits=limits) as client:
+        pending = plan_uploads(sources, source_dir, manifest)
+        if pending and not args.no_exists_check:
+            pending = await seed_from_server(client, pending, manifest)
+        if not pending:
+            logger.info("No new or changed sources to upload.")
+            return 0
+
+        batches = make_batches(pending, args.batch_bytes)
+        logger.info(
+            f"{len(pending)} source(s) need to be uploaded in {len(batches)} batch(es) with {args.workers} worker(s).")
+        stats = {"done": 0, "failed": 0, "total": len(pending)}
+        queue = asyncio.Queue()
+        for batch in batches:
+            queue.put_nowait(batch)
+        workers = [asyncio.create_task(upload_worker(client, queue, manifest, args.retries, stats))
+                   for _ in range(args.workers)]
+        await queue.join()
+        for worker in workers:
+            worker.cancel()
+
+    logger.info(
+        f"Done: {stats['done']} uploaded, {stats['failed']} failed. Manifest: {args.manifest}")
+    return 1 if stats["failed"] else 0
 
-    print(f"{len(sources_to_upload)} source(s) need to be uploaded.")
-    source_dir = os.path.dirname(sources_file)
-    upload_sources_batch(sources_to_upload, source_dir)
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Upload the sources listed in sources.json; reruns resume from the manifest.")
+    parser.add_argument("sources_file", nargs="?",
+                        default=os.path.join(os.path.dirname(__file__), "sources.json"))
+    parser.add_argument("--manifest", help="checkpoint file (default: <sources_file>.manifest.json)")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--batch-bytes", type=int, default=4 * 1024 * 1024,
+                        help="maximum payload size of one request")
+    parser.add_argument("--retries", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=600.0,
+                        help="seconds to wait for the server to embed one batch")
+    parser.add_argument("--no-exists-check", action="store_true",
+                        help="do not ask the server which unseen sources it already has")
+    args = parser.parse_args()
+    args.manifest = args.manifest or f"{os.path.splitext(args.sources_file)[0]}.manifest.json"
+
+    try:
+        return asyncio.run(run(args))
+    except Exception as e:
+        logger.error(f"Failed to import sources from {args.sources_file}: {e}")
+        return 1
 
 
 if __name__ == "__main__":
     load_dotenv()
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(message)s",
+        handlers=[RichHandler(console=Console(width=200))]
+    )
+    logging.getLogger("httpx").setLevel(logging.WARNING)
     BASE_URL = os.environ.get("IMPORT__BASE_URL", "http://localhost:8080")
     EXTRA_PARAMS = os.environ.get("IMPORT__EXTRA_PARAMS", "")
-    main()
+    sys.exit(main())
@@ -0,0 +1,160 @@
+import os
+import sys
+import logging
+import argparse
+import bson
+import numpy as np
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+from rich.table import Table
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from db import mongoatlas
+from db.quantization import normalize, truncate, quantize_int8, binarize, to_bson_int8, to_bson_float32, from_bson
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Row-wise indices of the k highest scores, best first."""
+    k = min(k, scores.shape[1])
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, idx, axis=1), axis=1)
+    return np.take_along_axis(idx, order, axis=1)
+
+
+def recall(approx: np.ndarray, exact: np.ndarray) -> float:
+    return float(np.mean([len(set(a) & set(e)) / len(e) for a, e in zip(approx, exact)]))
+
+
+def rescore(corpus: np.ndarray, queries: np.ndarray, shortlist: np.ndarray, k: int) -> np.ndarray:
+    rescored = np.einsum("qsd,qd->qs", corpus[shortlist], queries)
+    return np.take_along_axis(shortlist, top_k(rescored, k), axis=1)
+
+
+def recall_report(matrix: np.ndarray, num_queries: int, k: int, rescore_k: int, matryoshka_dims: list[int] = ()) -> list[dict]:
+    """
+    Use the first `num_queries` rows as queries against the remaining rows and
+    compare the top-k of each compact representation with exact float32 search.
+    """
+    matrix = normalize(matrix.astype(np.float32))
+    queries, corpus = matrix[:num_queries], matrix[num_queries:]
+    exact = top_k(queries @ corpus.T, k)
+
+    quantized = quantize_int8(corpus).astype(np.float32)
+    int8_scores = (queries @ quantized.T) / \
+        np.linalg.norm(quantized, axis=1)
+    signs = np.unpackbits(binarize(corpus), axis=1)[
+        :, :corpus.shape[1]].astype(np.float32) * 2 - 1
+    binary_scores = np.sign(queries) @ signs.T
+
+    rows = [
+        {"name": "float32", "recall": 1.0, "rescored": 1.0},
+        {"name": "int8", "recall": recall(top_k(int8_scores, k), exact),
+         "rescored": recall(rescore(corpus, queries, top_k(int8_scores, rescore_k), k), exact)},
+        {"name": "binary", "recall": recall(top_k(binary_scores, k), exact),
+         "rescored": recall(rescore(corpus, queries, top_k(binary_scores, rescore_k), k), exact)},
+    ]
+    for dims in matryoshka_dims:
+        scores = truncate(queries, dims) @ truncate(corpus, dims).T
+        rows.append({"name": f"matryoshka-{dims}", "recall": recall(top_k(scores, k), exact),
+                     "rescored": recall(rescore(corpus, queries, top_k(scores, rescore_k), k), exact)})
+    return rows
+
+
+def report(collection, sample_size: int, num_queries: int, k: int, rescore_k: int, matryoshka_dims: list[int]) -> None:
+    docs = list(collection.aggregate([
+        {"$sample": {"size": sample_size}},
+        {"$project": {"embedding": 1}},
+    ]))
+    total_docs = collection.estimated_document_count()
+    matrix = np.stack([from_bson(doc["embedding"]) for doc in docs])
+    sample = matrix[0]
+
+    sizes = {
+        "float32": len(bson.encode({"embedding": to_bson_float32(sample)})),
+        "int8": len(bson.encode({"embedding": to_bson_int8(quantize_int8(sample)[0])})),
+        "binary": len(bson.encode({"embedding": bson.Binary(binarize(sample)[0].tobytes())})),
+        **{f"matryoshka-{dims}": len(bson.encode({"embedding": to_bson_float32(truncate(sample, dims)[0])}))
+           for dims in matryoshka_dims},
+    }
+    stored_size = int(np.mean([len(bson.encode({"embedding": doc["embedding"]}))
+                               for doc in docs]))
+
+    table = Table(
+        title=f"{collection.name}: {len(docs)} sampled of {total_docs} documents, {num_queries} queries")
+    for column in ("vector", "bytes / vector", "collection MB", f"recall@{k}", f"recall@{k} (rescore top {rescore_k})"):
+        table.add_column(column)
+    table.add_row("as stored", str(stored_size),
+                  f"{stored_size * total_docs / 1e6:.1f}", "1.000", "-")
+    for row in recall_report(matrix, num_queries, k, rescore_k, matryoshka_dims):
+        size = sizes[row["name"]]
+        table.add_row(row["name"], str(size), f"{size * total_docs / 1e6:.1f}",
+                      f"{row['recall']:.3f}", f"{row['rescored']:.3f}")
+    Console(width=200).print(table)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Migrate collections to compact (int8 / Matryoshka) embeddings and report memory / recall.")
+    parser.add_argument("command", choices=[
+                        "migrate", "migrate-matryoshka", "report"])
+    parser.add_argument("--primary", action="store_true",
+                        help="use the primary collection instead of the secondary one")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--compact-full-precision", action="store_true",
+                        help="also rewrite `embedding` as a float32 binData vector")
+    parser.add_argument("--sample-size", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=20)
+    parser.add_argument("--rescore-k", type=int, default=200)
+    parser.add_argument("--dims", type=int, default=512,
+                        help="truncated dimensions for migrate-matryoshka")
+    parser.add_argument("--matryoshka-dims", default="256,512,1024",
+                        help="comma-separated truncated dimensions to include in the report")
+    args = parser.parse_args()
+
+    embedding_model = "text-embedding-3-large"
+    mongodb_helper = mongoatlas.MongoDBHelper(
+        connection_str=os.environ.get("MONGODB_CONNECTION_STRING"),
+        db_name="tipitaka-viet-db",
+        vector_store_name="facts__text-embedding-3-large",
+        secondary_vector_store_name="secondary-facts__text-embedding-3-large",
+        vector_store_index=embedding_model,
+    )
+    collection = mongodb_helper.vector_collection if args.primary else mongodb_helper.secondary_vector_collection
+
+    if args.command == "migrate":
+        migrated = mongoatlas.migrate_quantized_embeddings(
+            collection, batch_size=args.batch_size, compact_full_precision=args.compact_full_precision)
+        mongoatlas.create_compact_vector_index(
+            collection, f"{embedding_model}__int8", mongoatlas.QUANTIZED_EMBEDDING_KEY, 3072, filters=["source"])
+        logger.info(f"{collection.name}: {migrated} document(s) migrated")
+    elif args.command == "migrate-matryoshka":
+        migrated = mongoatlas.migrate_matryoshka_embeddings(
+            collection, dimensions=args.dims, batch_size=args.batch_size)
+        mongoatlas.create_compact_vector_index(
+            collection, f"{embedding_model}__{args.dims}", mongoatlas.matryoshka_key(args.dims), args.dims, filters=["source"])
+        logger.info(f"{collection.name}: {migrated} document(s) migrated")
+    else:
+        matryoshka_dims = [int(dims)
+                           for dims in args.matryoshka_dims.split(",") if dims]
+        report(collection, args.sample_size, args.queries,
+               args.k, args.rescore_k, matryoshka_dims)
+
+
+if __name__ == "__main__":
+    main()
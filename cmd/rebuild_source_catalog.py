@@ -0,0 +1,53 @@
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from db import mongoatlas
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Rebuild the source catalogs behind /sources/list from the vector collections.")
+    parser.add_argument("--primary-only", action="store_true")
+    parser.add_argument("--secondary-only", action="store_true")
+    args = parser.parse_args()
+
+    mongodb_helper = mongoatlas.MongoDBHelper(
+        connection_str=os.environ.get("MONGODB_CONNECTION_STRING"),
+        db_name="tipitaka-viet-db",
+        vector_store_name="facts__text-embedding-3-large",
+        secondary_vector_store_name="secondary-facts__text-embedding-3-large",
+        vector_store_index="text-embedding-3-large",
+    )
+    targets = []
+    if not args.secondary_only:
+        targets.append(False)
+    if not args.primary_only:
+        targets.append(True)
+    for secondary in targets:
+        catalog = mongodb_helper.create_source_catalog(secondary=secondary)
+        count = catalog.rebuild()
+        logger.info(f"{catalog.collection.name}: {count} source(s)")
+
+
+if __name__ == "__main__":
+    main()
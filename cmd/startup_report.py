@@ -0,0 +1,110 @@
+import os
+import sys
+import json
+import argparse
+import statistics
+import time
+import subprocess
+from collections import defaultdict
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+# autopep8: on
+
+
+# The import cost of the service: import `main` (the bot, the API and every module
+# they import at load time) and load the default tokenizer, as `TipitakaAI.init` does.
+# The rest of startup (clients, indexes, health checks) runs under `__main__` and
+# needs the network, so it is not measured here.
+PROBE = """
+import json, os, time
+started = time.perf_counter()
+import main
+imported = time.perf_counter()
+from service.routing import DEFAULT_MODEL, tokenizer_for
+from service.tokenizer import load_tokenizer, vendored_tokenizer_path
+name = tokenizer_for(DEFAULT_MODEL)
+tokenizer = os.path.exists(os.path.join(vendored_tokenizer_path(name), "tokenizer.json"))
+if tokenizer:
+    load_tokenizer(name)
+print(json.dumps({"import": imported - started, "tokenizer": time.perf_counter() - imported if tokenizer else None}))
+"""
+
+
+def run_probe(python: str, importtime: bool = False) -> tuple[float, dict, str]:
+    """Run `PROBE` in a fresh interpreter; return its wall time, its own timings and stderr."""
+    command = [python] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+    started = time.perf_counter()
+    result = subprocess.run(command, cwd=parent_dir,
+                            capture_output=True, text=True)
+    elapsed = time.perf_counter() - started
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise RuntimeError(f"Startup probe failed with exit code {result.returncode}")
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def parse_importtime(stderr: str) -> list[tuple[int, int, int, str]]:
+    """`(depth, self_us, cumulative_us, module)` for each line of `python -X importtime`."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, int(self_us), int(cumulative_us), name.strip()))
+    return rows
+
+
+def report_imports(rows: list[tuple[int, int, int, str]], top: int) -> None:
+    # `main` is the only top-level import of the probe; its children are what
+    # main.py and the service modules import at load time.
+    direct = [row for row in rows if row[0] == 1]
+    print(f"\nImported by main.py, cumulative (top {top}):")
+    for _, _, cumulative_us, name in sorted(direct, key=lambda row: -row[2])[:top]:
+        print(f"  {cumulative_us / 1e6:7.3f}s  {name}")
+
+    packages = defaultdict(int)
+    for _, self_us, _, name in rows:
+        packages[name.split(".")[0]] += self_us
+    print(f"\nBy top-level package, own time (top {top}):")
+    for name, self_us in sorted(packages.items(), key=lambda item: -item[1])[:top]:
+        print(f"  {self_us / 1e6:7.3f}s  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the import time of the service: a fresh interpreter importing "
+                    "main.py and loading the tokenizer, with the import cost of each module. "
+                    "Network clients and indexes are not started. "
+                    "Exits with status 1 when the median import time exceeds the budget.")
+    parser.add_argument("--budget", type=float,
+                        default=float(os.environ.get("IMPORT_BUDGET_SECONDS", "4")),
+                        help="maximum median import time in seconds (env IMPORT_BUDGET_SECONDS)")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="number of cold starts to time")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--python", default=sys.executable,
+                        help="interpreter of the environment to measure")
+    args = parser.parse_args()
+
+    # One extra run with -X importtime, which slows imports down, for the breakdown only.
+    _, _, stderr = run_probe(args.python, importtime=True)
+    report_imports(parse_importtime(stderr), args.top)
+
+    runs = [run_probe(args.python) for _ in range(args.runs)]
+    import_time = statistics.median(elapsed for elapsed, _, _ in runs)
+    imports = statistics.median(timings["import"] for _, timings, _ in runs)
+    tokenizer = runs[0][1]["tokenizer"]
+    print(f"\nimport main: {imports:.2f}s | tokenizer: "
+          f"{'not vendored' if tokenizer is None else f'{tokenizer:.2f}s'} | "
+          f"import time: {import_time:.2f}s (median of {args.runs}, budget {args.budget:.2f}s)")
+
+    if import_time > args.budget:
+        print(f"FAIL: import time {import_time:.2f}s exceeds the {args.budget:.2f}s budget")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import os
+import sys
+import logging
+import argparse
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+from langchain_openai import OpenAIEmbeddings
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from db import mongoatlas
+from db.local_index import LocalVectorIndex
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+METADATA_FIELDS = ("source", "chunk_num")
+
+
+def sync(collection, index: LocalVectorIndex, batch_size: int) -> None:
+    """
+    Bring `index` in line with `collection`: fetch documents whose id is not in
+    the index yet, tombstone documents that were removed, and update metadata that
+    changed in place. Only new documents pay for transferring their embedding.
+    """
+    local = index.live_documents()
+    remote = {
+        str(doc["_id"]): {field: doc.get(field) for field in METADATA_FIELDS}
+        for doc in collection.find({}, {"_id": 1, **{field: 1 for field in METADATA_FIELDS}})
+    }
+
+    removed = [id for id in local if id not in remote]
+    added = [id for id in remote if id not in local]
+    changed = {id: fields for id, fields in remote.items()
+               if id in local and local[id] != fields}
+    logger.info(
+        f"{collection.name}: {len(added)} new, {len(removed)} removed, {len(changed)} changed")
+
+    if removed:
+        index.delete(removed)
+    if changed:
+        index.update_metadata(changed)
+
+    for start in range(0, len(added), batch_size):
+        batch = added[start:start + batch_size]
+        docs = list(collection.find({"_id": {"$in": batch}}))
+        index.upsert(docs)
+        logger.info(
+            f"{collection.name}: synced {min(start + batch_size, len(added))}/{len(added)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Incrementally sync a local memory-mapped vector index from MongoDB.")
+    parser.add_argument("--path", default=os.environ.get(
+        "LOCAL_VECTOR_INDEX_PATH", ".cache/secondary-index"))
+    parser.add_argument("--primary", action="store_true",
+                        help="sync the primary collection instead of the secondary one")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--quantized", action="store_true",
+                        default=os.environ.get("QUANTIZED_SEARCH", "FALSE").upper() == "TRUE",
+                        help="also maintain the int8 vectors searched by a quantized bot")
+    args = parser.parse_args()
+
+    embedding_model = "text-embedding-3-large"
+    mongodb_helper = mongoatlas.MongoDBHelper(
+        connection_str=os.environ.get("MONGODB_CONNECTION_STRING"),
+        db_name="tipitaka-viet-db",
+        vector_store_name="facts__text-embedding-3-large",
+        secondary_vector_store_name="secondary-facts__text-embedding-3-large",
+        vector_store_index=embedding_model,
+    )
+    collection = mongodb_helper.vector_collection if args.primary else mongodb_helper.secondary_vector_collection
+    index = LocalVectorIndex(
+        args.path, OpenAIEmbeddings(model=embedding_model), dimensions=3072,
+        quantized=args.quantized)
+    sync(collection, index, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import shutil
+import logging
+import argparse
+from dotenv import load_dotenv
+from rich.logging import RichHandler
+from rich.console import Console
+from huggingface_hub import hf_hub_download
+from huggingface_hub.errors import EntryNotFoundError
+
+# autopep8: off # Add parent directory to path to allow absolute imports
+parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(parent_dir)
+
+from service.routing import routable_tokenizers
+from service.tokenizer import TOKENIZER_NAME, FastTokenizer, vendored_tokenizer_path
+# autopep8: on
+
+
+# Setup logging
+load_dotenv()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(message)s",
+    handlers=[RichHandler(console=Console(width=200))]
+)
+logger = logging.getLogger(__name__)
+
+FILES = ["tokenizer.json", "tokenizer_config.json"]
+# Without a config the tokenizer still loads, with no `model_max_length`.
+OPTIONAL_FILES = {"tokenizer_config.json"}
+SAMPLE = "Hoàng hậu Mallikā và công chúa Mallikā có ai đắc quả thánh không?"
+
+
+def vendor(name: str, verify: bool) -> None:
+    path = vendored_tokenizer_path(name)
+    os.makedirs(path, exist_ok=True)
+    for filename in FILES:
+        try:
+            shutil.copyfile(hf_hub_download(name, filename), os.path.join(path, filename))
+        except EntryNotFoundError:
+            if filename not in OPTIONAL_FILES:
+                raise
+    tokenizer = FastTokenizer.from_dir(path, name)
+    logger.info(
+        f"{name}: saved to {path}, {len(tokenizer.encode(SAMPLE))} tokens in the sample")
+
+    if verify:
+        # The vendored copy must count exactly like the transformers tokenizer.
+        from transformers import AutoTokenizer
+        reference = AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+        if reference.encode(SAMPLE, add_special_tokens=False) != tokenizer.encode(SAMPLE, add_special_tokens=False):
+            raise RuntimeError(f"{name}: vendored tokenizer differs from transformers")
+        logger.info(f"{name}: matches transformers")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Copy tokenizer.json files from the Hugging Face hub into TOKENIZER_DIR, "
+                    "so the service loads them offline with the `tokenizers` library. "
+                    "By default every tokenizer the model router can select is vendored.")
+    parser.add_argument("names", nargs="*", default=routable_tokenizers())
+    parser.add_argument("--verify", action="store_true",
+                        help="compare with the transformers tokenizer on a sample")
+    args = parser.parse_args()
+
+    failed = []
+    for name in args.names:
+        try:
+            vendor(name, args.verify)
+        except Exception as e:
+            # Gated repos need HF_TOKEN; a routed model without a vendored tokenizer
+            # downloads it on its first request instead.
+            logger.error(f"{name}: {e}")
+            failed.append(name)
+    if failed:
+        logger.warning(f"Not vendored: {', '.join(failed)}")
+    if TOKENIZER_NAME in failed or len(failed) == len(args.names):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
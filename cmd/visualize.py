@@ -15,6 +15,7 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
 from db import mongoatlas
+from db.quantization import from_bson
 # autopep8: on
 
 
@@ -53,7 +54,7 @@ def main():
 
     # 3. Convert to DataFrame
     df = pd.DataFrame(data)
-    df["embedding"] = df["embedding"].apply(lambda x: np.array(x))  # Convert to NumPy arrays
+    df["embedding"] = df["embedding"].apply(from_bson)  # Convert to NumPy arrays (BSON arrays or binData vectors)
     matrix = np.vstack(df["embedding"].values)  # Convert list of arrays into a matrix
 
     # 4. Apply t-SNE for dimensionality reduction
@@ -0,0 +1,281 @@
+import functools
+import io
+import math
+import os
+import re
+import sqlite3
+import struct
+import logging
+import threading
+import unicodedata
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_WORD_RE = re.compile(r"\w+")
+# Vietnamese đ/Đ is a separate letter, not d + combining mark, so NFD keeps it.
+_FOLD_TABLE = str.maketrans({"đ": "d", "Đ": "D"})
+
+
+def fold(text: str) -> str:
+    """Strip diacritics: "Mallikā" -> "Mallika", "Pháp Cú" -> "Phap Cu", "đức" -> "duc"."""
+    decomposed = unicodedata.normalize("NFD", text.translate(_FOLD_TABLE))
+    return "".join(ch for ch in decomposed if unicodedata.category(ch) != "Mn")
+
+
+# Vietnamese has a few thousand distinct syllables, so folding is memoized per word.
+_fold_word = functools.lru_cache(maxsize=1 << 18)(fold)
+
+
+def words(text: str) -> list[str]:
+    """Lowercased Vietnamese syllables / Pāli words, with diacritics kept (NFC)."""
+    return _WORD_RE.findall(unicodedata.normalize("NFC", text).lower())
+
+
+def tokenize(text: str) -> list[str]:
+    """Index terms: diacritic-folded words, so folded and unfolded spellings match."""
+    return [_fold_word(word) for word in words(text)]
+
+
+class LexicalIndex:
+    """
+    BM25 inverted index over chunk texts, persisted in a single SQLite file.
+
+    - `doc`: one row per chunk (Mongo id, source, chunk_num, term count, zlib text).
+    - `segment`: append-only zlib-compressed posting lists, one segment per `add`
+      call; `compact` merges them.
+
+    Terms are diacritic-folded words; `search` ranks documents that also contain
+    the exact (unfolded) query words higher, so "Mallikā" prefers "Mallikā" over
+    "Mallika" while still matching both.
+    """
+
+    def __init__(self, path: str, k1: float = 1.2, b: float = 0.75, exact_match_boost: float = 0.3) -> None:
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self.exact_match_boost = exact_match_boost
+        self._lock = threading.RLock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS doc ("
+            "num INTEGER PRIMARY KEY, id TEXT NOT NULL, source TEXT, chunk_num INTEGER, "
+            "length INTEGER NOT NULL, text BLOB NOT NULL, deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS doc__id ON doc (id)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS segment (id INTEGER PRIMARY KEY, data BLOB NOT NULL)")
+        self._conn.commit()
+        self._load()
+
+    def __len__(self) -> int:
+        return self._live_docs
+
+    def add(self, docs: Iterable[Dict[str, Any]]) -> int:
+        """
+        Index documents shaped like `{"id", "text", "source", "chunk_num"}`.
+        Documents whose id is already indexed are replaced.
+        """
+        docs = list(docs)
+        if not docs:
+            return 0
+        with self._lock:
+            self._delete_ids([doc["id"] for doc in docs])
+            first_num = len(self._lengths)
+            postings: Dict[str, tuple[list[int], list[int]]] = {}
+            rows = []
+            lengths = []
+            for offset, doc in enumerate(docs):
+                terms = tokenize(doc["text"])
+                for term, tf in Counter(terms).items():
+                    nums, tfs = postings.setdefault(term, ([], []))
+                    nums.append(first_num + offset)
+                    tfs.append(tf)
+                lengths.append(len(terms))
+                rows.append((first_num + offset, doc["id"], doc.get("source"), doc.get("chunk_num"),
+                             len(terms), zlib.compress(doc["text"].encode("utf-8"))))
+
+            segment = {term: (np.asarray(nums, dtype=np.uint32), np.minimum(tfs, 65535).astype(np.uint16))
+                       for term, (nums, tfs) in postings.items()}
+            self._conn.executemany(
+                "INSERT INTO doc (num, id, source, chunk_num, length, text) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.execute(
+                "INSERT INTO segment (data) VALUES (?)", (_encode_segment(segment),))
+            self._conn.commit()
+
+            self._lengths = np.concatenate(
+                [self._lengths, np.asarray(lengths, dtype=np.uint32)])
+            self._deleted = np.concatenate(
+                [self._deleted, np.zeros(len(docs), dtype=bool)])
+            self._ids.update({doc["id"]: first_num + offset
+                             for offset, doc in enumerate(docs)})
+            self._merge_segment(segment)
+            self._live_docs += len(docs)
+            self._total_length += sum(lengths)
+        return len(docs)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._delete_ids(list(ids))
+            self._conn.commit()
+
+    def ids(self) -> set[str]:
+        with self._lock:
+            return set(self._ids)
+
+    def search(self, query: str, k: int = 20) -> list[Dict[str, Any]]:
+        """
+        Return up to `k` results as dicts with `id`, `source`, `chunk_num`, `content`,
+        `bm25` and `coverage` (share of the query's IDF mass found in the document).
+        """
+        query_words = words(query)
+        query_terms = Counter(tokenize(query))
+        with self._lock:
+            if not query_terms or self._live_docs == 0:
+                return []
+            lengths, deleted, total_docs = self._lengths, self._deleted, self._live_docs
+            avg_length = self._total_length / total_docs
+            scores = np.zeros(len(lengths), dtype=np.float32)
+            matched_idf = np.zeros(len(lengths), dtype=np.float32)
+            total_idf = 0.0
+            for term, qtf in query_terms.items():
+                nums, tfs = self._postings.get(term, (None, None))
+                df = 0 if nums is None else len(nums)
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                total_idf += idf * qtf
+                if not df:
+                    continue
+                tf = tfs.astype(np.float32)
+                norm = self.k1 * (1 - self.b + self.b *
+                                  lengths[nums] / avg_length)
+                scores[nums] += qtf * idf * tf * (self.k1 + 1) / (tf + norm)
+                matched_idf[nums] += idf * qtf
+
+        scores[deleted] = 0
+        candidates = np.flatnonzero(scores)
+        if len(candidates) == 0:
+            return []
+        # Rerank a generous shortlist with the exact-diacritic bonus.
+        shortlist = candidates[np.argsort(-scores[candidates])[:k * 3]]
+        results = self._results(shortlist)
+        exact_words = set(query_words) - set(query_terms)
+        for result, num in zip(results, shortlist):
+            result["coverage"] = float(matched_idf[num] / total_idf)
+            result["bm25"] = float(scores[num])
+            if exact_words:
+                present = set(words(result["content"])) & exact_words
+                result["bm25"] *= 1 + self.exact_match_boost * \
+                    len(present) / len(exact_words)
+        results.sort(key=lambda result: result["bm25"], reverse=True)
+        return results[:k]
+
+    def compact(self) -> None:
+        """Merge all segments into one and drop postings of deleted documents."""
+        with self._lock:
+            live = ~self._deleted
+            segment = {}
+            for term, (nums, tfs) in self._postings.items():
+                keep = live[nums]
+                if keep.any():
+                    segment[term] = (nums[keep], tfs[keep])
+            self._conn.execute("DELETE FROM segment")
+            self._conn.execute(
+                "INSERT INTO segment (data) VALUES (?)", (_encode_segment(segment),))
+            self._conn.commit()
+            self._postings = segment
+
+    def _load(self) -> None:
+        with self._lock:
+            count = self._conn.execute(
+                "SELECT COALESCE(MAX(num) + 1, 0) FROM doc").fetchone()[0]
+            self._lengths = np.zeros(count, dtype=np.uint32)
+            self._deleted = np.ones(count, dtype=bool)
+            self._ids: Dict[str, int] = {}
+            for num, id, length, deleted in self._conn.execute("SELECT num, id, length, deleted FROM doc"):
+                self._lengths[num] = length
+                self._deleted[num] = bool(deleted)
+                if not deleted:
+                    self._ids[id] = num
+            self._live_docs = len(self._ids)
+            self._total_length = int(self._lengths[~self._deleted].sum())
+
+            self._postings: Dict[str, tuple[np.ndarray, np.ndarray]] = {}
+            for (data,) in self._conn.execute("SELECT data FROM segment ORDER BY id"):
+                self._merge_segment(_decode_segment(data))
+            logger.info(
+                f"Loaded lexical index {self.path}: {self._live_docs} documents, {len(self._postings)} terms")
+
+    def _merge_segment(self, segment: Dict[str, tuple[np.ndarray, np.ndarray]]) -> None:
+        for term, (nums, tfs) in segment.items():
+            if term in self._postings:
+                old_nums, old_tfs = self._postings[term]
+                nums, tfs = np.concatenate(
+                    [old_nums, nums]), np.concatenate([old_tfs, tfs])
+            self._postings[term] = (nums, tfs)
+
+    def _delete_ids(self, ids: list[str]) -> None:
+        nums = [self._ids.pop(id) for id in ids if id in self._ids]
+        if not nums:
+            return
+        self._deleted[nums] = True
+        self._live_docs -= len(nums)
+        self._total_length -= int(self._lengths[nums].sum())
+        self._conn.executemany(
+            "UPDATE doc SET deleted = 1 WHERE num = ?", [(num,) for num in nums])
+
+    def _results(self, nums: np.ndarray) -> list[Dict[str, Any]]:
+        placeholders = ",".join("?" * len(nums))
+        with self._lock:
+            rows = {
+                num: (id, source, chunk_num, text)
+                for num, id, source, chunk_num, text in self._conn.execute(
+                    f"SELECT num, id, source, chunk_num, text FROM doc WHERE num IN ({placeholders})",
+                    [int(num) for num in nums])
+            }
+        results = []
+        for num in nums:
+            id, source, chunk_num, text = rows[int(num)]
+            results.append({
+                "id": id,
+                "source": source or "Unknown",
+                "chunk_num": chunk_num or 0,
+                "content": zlib.decompress(text).decode("utf-8"),
+            })
+        return results
+
+
+def _encode_segment(segment: Dict[str, tuple[np.ndarray, np.ndarray]]) -> bytes:
+    buffer = io.BytesIO()
+    for term, (nums, tfs) in segment.items():
+        encoded = term.encode("utf-8")
+        buffer.write(struct.pack("<HI", len(encoded), len(nums)))
+        buffer.write(encoded)
+        buffer.write(nums.astype("<u4").tobytes())
+        buffer.write(tfs.astype("<u2").tobytes())
+    return zlib.compress(buffer.getvalue())
+
+
+def _decode_segment(data: bytes) -> Dict[str, tuple[np.ndarray, np.ndarray]]:
+    raw = zlib.decompress(data)
+    segment = {}
+    offset = 0
+    while offset < len(raw):
+        term_length, count = struct.unpack_from("<HI", raw, offset)
+        offset += 6
+        term = raw[offset:offset + term_length].decode("utf-8")
+        offset += term_length
+        nums = np.frombuffer(raw, dtype="<u4", count=count, offset=offset)
+        offset += 4 * count
+        tfs = np.frombuffer(raw, dtype="<u2", count=count, offset=offset)
+        offset += 2 * count
+        segment[term] = (nums.astype(np.uint32), tfs.astype(np.uint16))
+    return segment
@@ -0,0 +1,322 @@
+import os
+import sqlite3
+import logging
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+from .quantization import from_bson, normalize, quantize_int8, rescore_limit
+
+logger = logging.getLogger(__name__)
+
+VECTORS_FILE = "vectors.f32"
+QUANTIZED_VECTORS_FILE = "vectors.i8"
+METADATA_FILE = "metadata.sqlite3"
+# Rows scored per matrix multiplication; bounds the temporary buffers to ~50 MB.
+SEARCH_BLOCK_ROWS = 4096
+
+
+class LocalVectorIndex:
+    """
+    Local replacement for `MongoDBAtlasVectorSearch.similarity_search_with_score`.
+
+    The index directory holds:
+    - `vectors.f32`: an (N, dimensions) float32 matrix of L2-normalized embeddings,
+      memory-mapped read-only and appended to by `upsert`.
+    - `metadata.sqlite3`: one row per vector (id, source, chunk_num, text, ...).
+      Deleted or replaced documents are tombstoned rather than removed from the matrix.
+    - `vectors.i8` (with `quantized=True`): the same rows scalar-quantized to int8.
+      Search then scans this 4x smaller matrix and rescores the best `rescore_k`
+      (default `RESCORE_FACTOR * k`) rows with the float32 vectors, so only those pages of `vectors.f32` are read.
+
+    The index is kept in sync with a Mongo collection by `cmd/sync_local_index.py`;
+    a running bot picks up new data on its next search.
+    """
+
+    def __init__(self, path: str, embedding: Embeddings, dimensions: int = 3072, quantized: bool = False, rescore_k: Optional[int] = None) -> None:
+        self.path = path
+        self.embedding = embedding
+        self.dimensions = dimensions
+        self.quantized = quantized
+        self.rescore_k = rescore_k
+        self._lock = threading.RLock()
+
+        os.makedirs(path, exist_ok=True)
+        self._vectors_path = os.path.join(path, VECTORS_FILE)
+        self._quantized_path = os.path.join(path, QUANTIZED_VECTORS_FILE)
+        for file_path in (self._vectors_path, self._quantized_path):
+            if not os.path.exists(file_path):
+                open(file_path, "wb").close()
+
+        self._conn = sqlite3.connect(os.path.join(
+            path, METADATA_FILE), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk ("
+            "row INTEGER PRIMARY KEY, id TEXT NOT NULL, source TEXT, chunk_num INTEGER, "
+            "text TEXT NOT NULL, token_count INTEGER, tokenizer TEXT, "
+            "deleted INTEGER NOT NULL DEFAULT 0)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS chunk__id ON chunk (id)")
+        self._conn.commit()
+
+        self._loaded_mtime = None
+        self.reload()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    def __len__(self) -> int:
+        return int(self._alive.sum())
+
+    def reload(self) -> None:
+        """Re-map the vector file and reload the columns used for filtering."""
+        with self._lock:
+            rows = os.path.getsize(self._vectors_path) // (4 * self.dimensions)
+            self._vectors = np.memmap(
+                self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimensions)
+            ) if rows else np.zeros((0, self.dimensions), dtype=np.float32)
+            if self.quantized:
+                self._load_quantized(rows)
+
+            self._alive = np.zeros(rows, dtype=bool)
+            self._columns: Dict[str, np.ndarray] = {
+                "source": np.empty(rows, dtype=object),
+                "chunk_num": np.zeros(rows, dtype=np.int64),
+            }
+            for row, source, chunk_num, deleted in self._conn.execute(
+                    "SELECT row, source, chunk_num, deleted FROM chunk WHERE row < ?", (rows,)):
+                self._alive[row] = not deleted
+                self._columns["source"][row] = source
+                self._columns["chunk_num"][row] = chunk_num or 0
+            self._loaded_mtime = self._mtime()
+            logger.info(
+                f"Loaded local vector index {self.path}: {len(self)} live / {rows} rows")
+
+    def similarity_search_with_score(
+        self,
+        query: str,
+        k: int = 4,
+        pre_filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding.embed_query(query), k=k, pre_filter=pre_filter)
+
+    def similarity_search_by_vector_with_score(
+        self,
+        embedding: list[float],
+        k: int = 4,
+        pre_filter: Optional[Dict[str, Any]] = None,
+    ) -> list[tuple[Document, float]]:
+        self._reload_if_changed()
+        with self._lock:
+            vectors, mask = self._vectors, self._filter_mask(pre_filter)
+            if self.quantized:
+                quantized, inv_norms = self._quantized, self._quantized_inv_norms
+
+        query = normalize(np.asarray(embedding, dtype=np.float32))
+        if self.quantized:
+            quantized_rows = len(quantized)
+            rows, _ = _top_k(quantized, query, rescore_limit(k, self.rescore_k),
+                             mask[:quantized_rows], inv_norms)
+            candidates = np.zeros(len(vectors), dtype=bool)
+            candidates[rows] = True
+            # Rows without an int8 copy yet are rescored directly.
+            candidates[quantized_rows:] = mask[quantized_rows:]
+            mask = candidates
+        rows, cosines = _top_k(vectors, query, k, mask)
+        # Same scale as Atlas $vectorSearch with the cosine similarity function.
+        return [(doc, (1 + float(cos)) / 2) for doc, cos in zip(self._documents(rows), cosines)]
+
+    def live_documents(self) -> Dict[str, Dict[str, Any]]:
+        """Return the live documents as {id: {"source": ..., "chunk_num": ...}}."""
+        with self._lock:
+            return {
+                id: {"source": source, "chunk_num": chunk_num}
+                for id, source, chunk_num in self._conn.execute(
+                    "SELECT id, source, chunk_num FROM chunk WHERE deleted = 0")
+            }
+
+    def upsert(self, docs: Iterable[Dict[str, Any]]) -> int:
+        """
+        Append documents shaped like the Mongo ones (`_id`, `text`, `embedding` and
+        metadata fields). Existing rows with the same id are tombstoned.
+        """
+        docs = list(docs)
+        if not docs:
+            return 0
+        with self._lock:
+            # Lists, or float32 binData once `--compact-full-precision` migrated them.
+            matrix = normalize(np.stack([from_bson(doc["embedding"])
+                                         for doc in docs]))
+            if matrix.shape[1] != self.dimensions:
+                raise ValueError(
+                    f"Expected {self.dimensions}-dim embeddings, got {matrix.shape[1]}")
+
+            first_row = os.path.getsize(
+                self._vectors_path) // (4 * self.dimensions)
+            self._tombstone([str(doc["_id"]) for doc in docs])
+            if self.quantized:
+                self._backfill_quantized(first_row)
+            with open(self._vectors_path, "ab") as f:
+                f.write(matrix.tobytes())
+            if self.quantized:
+                with open(self._quantized_path, "ab") as f:
+                    f.write(quantize_int8(matrix).tobytes())
+            self._conn.executemany(
+                "INSERT INTO chunk (row, id, source, chunk_num, text, token_count, tokenizer) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(first_row + i, str(doc["_id"]), doc.get("source"), doc.get("chunk_num"),
+                  doc.get("text", ""), doc.get("token_count"), doc.get("tokenizer"))
+                 for i, doc in enumerate(docs)]
+            )
+            self._conn.commit()
+            # In WAL mode the commit leaves the metadata file's mtime unchanged; a
+            # reader that reloaded after the vector append would miss the new rows.
+            self._touch()
+        return len(docs)
+
+    def _backfill_quantized(self, rows: int) -> None:
+        """Writer only: quantize the rows below `rows` that are missing from vectors.i8."""
+        quantized_rows = os.path.getsize(
+            self._quantized_path) // self.dimensions
+        if quantized_rows > rows:
+            raise ValueError(
+                f"{self._quantized_path} has more rows than {self._vectors_path}")
+        if quantized_rows == rows:
+            return
+        vectors = np.memmap(self._vectors_path, dtype=np.float32,
+                            mode="r", shape=(rows, self.dimensions))
+        with open(self._quantized_path, "ab") as f:
+            for start in range(quantized_rows, rows, SEARCH_BLOCK_ROWS):
+                f.write(quantize_int8(
+                    vectors[start:min(start + SEARCH_BLOCK_ROWS, rows)]).tobytes())
+
+    def _load_quantized(self, rows: int) -> None:
+        # Readers never write the index. Rows a writer has not quantized yet (between
+        # its two appends, or a writer opened without `quantized`) are not in the
+        # int8 matrix; searches score them in float32 instead.
+        quantized_rows = min(os.path.getsize(
+            self._quantized_path) // self.dimensions, rows)
+        if rows - quantized_rows > SEARCH_BLOCK_ROWS:
+            logger.warning(
+                f"{rows - quantized_rows} rows of {self.path} are not quantized; "
+                f"sync with --quantized to add them to {QUANTIZED_VECTORS_FILE}")
+
+        self._quantized = np.memmap(
+            self._quantized_path, dtype=np.int8, mode="r", shape=(quantized_rows, self.dimensions)
+        ) if quantized_rows else np.zeros((0, self.dimensions), dtype=np.int8)
+        self._quantized_inv_norms = np.ones(quantized_rows, dtype=np.float32)
+        for start in range(0, quantized_rows, SEARCH_BLOCK_ROWS):
+            norms = np.linalg.norm(
+                self._quantized[start:start + SEARCH_BLOCK_ROWS].astype(np.float32), axis=1)
+            self._quantized_inv_norms[start:start + SEARCH_BLOCK_ROWS] = 1 / \
+                np.where(norms == 0, 1, norms)
+
+    def update_metadata(self, updates: Dict[str, Dict[str, Any]]) -> None:
+        """Update source/chunk_num of live rows without touching their vectors."""
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunk SET source = ?, chunk_num = ? WHERE id = ? AND deleted = 0",
+                [(fields.get("source"), fields.get("chunk_num"), id)
+                 for id, fields in updates.items()]
+            )
+            self._conn.commit()
+            self._touch()
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._lock:
+            self._tombstone(list(ids))
+            self._conn.commit()
+            self._touch()
+
+    def _tombstone(self, ids: list[str]) -> None:
+        self._conn.executemany(
+            "UPDATE chunk SET deleted = 1 WHERE id = ?", [(id,) for id in ids])
+
+    def _documents(self, rows: np.ndarray) -> list[Document]:
+        if len(rows) == 0:
+            return []
+        placeholders = ",".join("?" * len(rows))
+        with self._lock:
+            fetched = {
+                row: (id, source, chunk_num, text, token_count, tokenizer)
+                for row, id, source, chunk_num, text, token_count, tokenizer in self._conn.execute(
+                    f"SELECT row, id, source, chunk_num, text, token_count, tokenizer FROM chunk WHERE row IN ({placeholders})",
+                    [int(row) for row in rows])
+            }
+        documents = []
+        for row in rows:
+            id, source, chunk_num, text, token_count, tokenizer = fetched[int(row)]
+            metadata = {"_id": id, "source": source, "chunk_num": chunk_num,
+                        "token_count": token_count, "tokenizer": tokenizer}
+            documents.append(Document(page_content=text, metadata={
+                key: value for key, value in metadata.items() if value is not None}))
+        return documents
+
+    def _filter_mask(self, pre_filter: Optional[Dict[str, Any]]) -> np.ndarray:
+        """Evaluate a Mongo-style pre-filter ({field: value} or {field: {"$in": [...]}})."""
+        mask = self._alive.copy()
+        for field, condition in (pre_filter or {}).items():
+            if field not in self._columns:
+                raise ValueError(f"Unsupported pre_filter field: {field}")
+            column = self._columns[field]
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for op, value in condition.items():
+                if op == "$in":
+                    mask &= np.isin(column, list(value))
+                elif op == "$nin":
+                    mask &= ~np.isin(column, list(value))
+                elif op == "$eq":
+                    mask &= column == value
+                elif op == "$ne":
+                    mask &= column != value
+                else:
+                    raise ValueError(f"Unsupported pre_filter operator: {op}")
+        return mask
+
+    def _mtime(self) -> tuple[int, int]:
+        return (os.stat(self._vectors_path).st_mtime_ns,
+                os.stat(os.path.join(self.path, METADATA_FILE)).st_mtime_ns)
+
+    def _touch(self) -> None:
+        os.utime(self._vectors_path)
+
+    def _reload_if_changed(self) -> None:
+        if self._mtime() != self._loaded_mtime:
+            self.reload()
+
+
+def _top_k(vectors: np.ndarray, query: np.ndarray, k: int, mask: np.ndarray, inv_norms: Optional[np.ndarray] = None) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Blockwise cosine top-k over the rows of `vectors` where `mask` is set.
+    Rows must be L2-normalized unless `inv_norms` (1 / row norm) is given, as for
+    int8 rows.
+    """
+    best_rows = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, len(vectors), SEARCH_BLOCK_ROWS):
+        block_mask = mask[start:start + SEARCH_BLOCK_ROWS]
+        if not block_mask.any():
+            continue
+        rows = np.flatnonzero(block_mask) + start
+        block = vectors[rows] if len(rows) < len(block_mask) \
+            else vectors[start:start + SEARCH_BLOCK_ROWS]
+        scores = block.astype(np.float32, copy=False) @ query
+        if inv_norms is not None:
+            scores *= inv_norms[rows]
+        best_rows = np.concatenate([best_rows, rows])
+        best_scores = np.concatenate([best_scores, scores])
+        if len(best_rows) > k:
+            keep = np.argpartition(-best_scores, k)[:k]
+            best_rows, best_scores = best_rows[keep], best_scores[keep]
+
+    order = np.argsort(-best_scores)
+    return best_rows[order], best_scores[order]
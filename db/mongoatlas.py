@@ -1,13 +1,24 @@
-from pymongo import MongoClient
-from typing import Optional
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import OperationFailure
+from pymongo.operations import SearchIndexModel
+from typing import Any, Callable, Dict, Optional
 from langchain_mongodb import MongoDBAtlasVectorSearch
 from langchain.embeddings.base import Embeddings
+from langchain_core.documents import Document
+import numpy as np
 import asyncio
-from typing import Optional
 import logging
 
+from .source_catalog import SourceCatalog
+from .quantization import quantize_int8, truncate, to_bson_int8, to_bson_float32, from_bson, cosine_scores, rescore_limit
+
 logger = logging.getLogger(__name__)
 
+QUANTIZED_EMBEDDING_KEY = "embedding_int8"
+# Fields of a chunk returned with a search result; the vectors are left out.
+CHUNK_FIELDS = ("text", "source", "chunk_num", "token_count", "tokenizer")
+
 
 class MongoDBHelper:
     def __init__(
@@ -24,6 +35,14 @@ class MongoDBHelper:
         self.secondary_vector_collection = self.db[secondary_vector_store_name]
         self.vector_store_index = vector_store_index
 
+    def create_source_catalog(self, secondary: bool = False) -> SourceCatalog:
+        vector_collection = self.secondary_vector_collection if secondary else self.vector_collection
+        catalog = SourceCatalog(
+            self.db[f"catalog__{vector_collection.name}"], vector_collection)
+        catalog.ensure_indexes()
+        catalog.load_known_sources()
+        return catalog
+
     def create_vector_store(self, embedding: Embeddings, should_skip_creating_index: bool, dimensions: int) -> MongoDBAtlasVectorSearch:
         return create_vector_store_helper(
             self.vector_collection, self.vector_store_index, embedding, should_skip_creating_index, dimensions)
@@ -32,6 +51,40 @@ class MongoDBHelper:
         return create_vector_store_helper(
             self.secondary_vector_collection, self.vector_store_index, embedding, should_skip_creating_index, dimensions, filters=["source"])
 
+    def create_quantized_secondary_vector_store(self, vector_store: MongoDBAtlasVectorSearch, should_skip_creating_index: bool, dimensions: int, rescore_k: Optional[int] = None) -> "RescoringVectorSearch":
+        """
+        Search the secondary collection over its int8 `embedding_int8` field and rescore
+        the shortlist with the full-precision `embedding`. Run
+        `migrate_quantized_embeddings` on existing collections first.
+        """
+        index_name = f"{self.vector_store_index}__int8"
+        if not should_skip_creating_index:
+            create_compact_vector_index(
+                self.secondary_vector_collection, index_name, QUANTIZED_EMBEDDING_KEY, dimensions, filters=["source"])
+        return RescoringVectorSearch(
+            vector_store, index_name, QUANTIZED_EMBEDDING_KEY,
+            encode_query=lambda vector: to_bson_int8(
+                quantize_int8(vector)[0]),
+            rescore_k=rescore_k
+        )
+
+    def create_matryoshka_secondary_vector_store(self, vector_store: MongoDBAtlasVectorSearch, should_skip_creating_index: bool, dimensions: int, rescore_k: Optional[int] = None) -> "RescoringVectorSearch":
+        """
+        Search the secondary collection over the truncated `embedding_<dimensions>`
+        field and rerank the shortlist with the full 3072-dim `embedding`. Run
+        `migrate_matryoshka_embeddings` on existing collections first.
+        """
+        index_name = f"{self.vector_store_index}__{dimensions}"
+        if not should_skip_creating_index:
+            create_compact_vector_index(
+                self.secondary_vector_collection, index_name, matryoshka_key(dimensions), dimensions, filters=["source"])
+        return RescoringVectorSearch(
+            vector_store, index_name, matryoshka_key(dimensions),
+            encode_query=lambda vector: to_bson_float32(
+                truncate(vector, dimensions)[0]),
+            rescore_k=rescore_k
+        )
+
 
 def create_vector_store_helper(
     vector_collection: MongoDBAtlasVectorSearch,
@@ -83,3 +136,193 @@ async def create_index_with_timeout_helper(
                 logger.error(
                     f"Failed to create vector search index after {retries} attempts: {str(e)}")
             continue
+
+
+class RescoringVectorSearch:
+    """
+    Two-stage search with the `similarity_search_with_score` surface of
+    `MongoDBAtlasVectorSearch`: Atlas `$vectorSearch` over a compact vector field
+    (`path`) returns `rescore_k` candidates (default `RESCORE_FACTOR * k`) with only
+    their full-precision `embedding`, which are rescored locally. The `fields` of
+    the best `k` are then fetched by id.
+    """
+
+    def __init__(
+            self,
+            vector_store: MongoDBAtlasVectorSearch,
+            index_name: str,
+            path: str,
+            encode_query: Callable[[np.ndarray], Any],
+            rescore_k: Optional[int] = None,
+            num_candidates_factor: int = 10,
+            fields: tuple[str, ...] = CHUNK_FIELDS,
+    ):
+        self.vector_store = vector_store
+        self.index_name = index_name
+        self.path = path
+        self.encode_query = encode_query
+        self.rescore_k = rescore_k
+        self.num_candidates_factor = num_candidates_factor
+        self.fields = fields
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.vector_store.embeddings
+
+    @property
+    def collection(self) -> Collection:
+        return self.vector_store.collection
+
+    def similarity_search_with_score(self, query: str, k: int = 4, pre_filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> list[tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embeddings.embed_query(query), k=k, pre_filter=pre_filter)
+
+    def similarity_search_by_vector_with_score(self, embedding: list[float], k: int = 4, pre_filter: Optional[Dict[str, Any]] = None) -> list[tuple[Document, float]]:
+        query = np.asarray(embedding, dtype=np.float32)
+        limit = rescore_limit(k, self.rescore_k)
+        search = {
+            "index": self.index_name,
+            "path": self.path,
+            "queryVector": self.encode_query(query),
+            "numCandidates": min(limit * self.num_candidates_factor, 10_000),
+            "limit": limit,
+        }
+        if pre_filter:
+            search["filter"] = pre_filter
+        candidates = list(self.collection.aggregate([
+            {"$vectorSearch": search},
+            {"$project": {"_id": 1, "embedding": 1}},
+        ]))
+        if not candidates:
+            return []
+
+        cosines = cosine_scores(query, np.stack(
+            [from_bson(doc["embedding"]) for doc in candidates]))
+        best = [(candidates[i]["_id"], float(cosines[i]))
+                for i in np.argsort(-cosines)[:k]]
+        docs = {doc["_id"]: doc for doc in self.collection.find(
+            {"_id": {"$in": [id for id, _ in best]}}, {field: 1 for field in self.fields})}
+        results = []
+        for id, cosine in best:
+            doc = docs.get(id)
+            if doc is None:
+                # Deleted between the two queries.
+                continue
+            text = doc.pop("text", "")
+            doc["_id"] = str(doc["_id"])
+            # Same scale as Atlas $vectorSearch with the cosine similarity function.
+            results.append(
+                (Document(page_content=text, metadata=doc), (1 + cosine) / 2))
+        return results
+
+
+def create_compact_vector_index(
+        collection: Collection,
+        index_name: str,
+        path: str,
+        dimensions: int,
+        filters: Optional[list[str]] = None,
+) -> None:
+    definition = {"fields": [
+        {"type": "vector", "path": path,
+            "numDimensions": dimensions, "similarity": "cosine"},
+        *[{"type": "filter", "path": field} for field in filters or []],
+    ]}
+    try:
+        collection.create_search_index(SearchIndexModel(
+            definition=definition, name=index_name, type="vectorSearch"))
+    except OperationFailure as e:
+        if "already" not in str(e):
+            raise
+
+
+def matryoshka_key(dimensions: int) -> str:
+    return f"embedding_{dimensions}"
+
+
+def migrate_quantized_embeddings(
+        collection: Collection,
+        ids: Optional[list[str]] = None,
+        batch_size: int = 500,
+        compact_full_precision: bool = False,
+) -> int:
+    """
+    Add the int8 `embedding_int8` field to documents that do not have it yet
+    (optionally only to `ids`). With `compact_full_precision`, `embedding` is also
+    rewritten from a BSON double array into a float32 binData vector, which halves
+    its size and is still accepted by the existing Atlas vector index.
+    Returns the number of migrated documents.
+    """
+    query: Dict[str, Any] = {QUANTIZED_EMBEDDING_KEY: {"$exists": False}}
+    if ids is not None:
+        query["_id"] = {"$in": ids}
+
+    migrated = 0
+    batch = []
+    for doc in collection.find(query, {"embedding": 1}).batch_size(batch_size):
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            migrated += _write_quantized(collection,
+                                         batch, compact_full_precision)
+            batch = []
+            logger.info(f"{collection.name}: quantized {migrated} document(s)")
+    migrated += _write_quantized(collection, batch, compact_full_precision)
+    return migrated
+
+
+def _write_quantized(collection: Collection, batch: list[Dict[str, Any]], compact_full_precision: bool) -> int:
+    if not batch:
+        return 0
+    matrix = np.stack([from_bson(doc["embedding"]) for doc in batch])
+    quantized = quantize_int8(matrix)
+    updates = []
+    for doc, vector, vector_int8 in zip(batch, matrix, quantized):
+        fields = {QUANTIZED_EMBEDDING_KEY: to_bson_int8(vector_int8)}
+        if compact_full_precision:
+            fields["embedding"] = to_bson_float32(vector)
+        updates.append(UpdateOne({"_id": doc["_id"]}, {"$set": fields}))
+    collection.bulk_write(updates, ordered=False)
+    return len(batch)
+
+
+def migrate_matryoshka_embeddings(
+        collection: Collection,
+        ids: Optional[list[str]] = None,
+        dimensions: int = 512,
+        batch_size: int = 500,
+) -> int:
+    """
+    Add the truncated, re-normalized `embedding_<dimensions>` field (float32 binData)
+    to documents that do not have it yet (optionally only to `ids`).
+    Returns the number of migrated documents.
+    """
+    key = matryoshka_key(dimensions)
+    query: Dict[str, Any] = {key: {"$exists": False}}
+    if ids is not None:
+        query["_id"] = {"$in": ids}
+
+    migrated = 0
+    batch = []
+    cursor = collection.find(query, {"embedding": 1}).batch_size(batch_size)
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) >= batch_size:
+            migrated += _write_matryoshka(collection, batch, dimensions)
+            batch = []
+            logger.info(
+                f"{collection.name}: truncated {migrated} document(s) to {dimensions} dims")
+    migrated += _write_matryoshka(collection, batch, dimensions)
+    return migrated
+
+
+def _write_matryoshka(collection: Collection, batch: list[Dict[str, Any]], dimensions: int) -> int:
+    if not batch:
+        return 0
+    truncated = truncate(
+        np.stack([from_bson(doc["embedding"]) for doc in batch]), dimensions)
+    collection.bulk_write([
+        UpdateOne({"_id": doc["_id"]}, {
+                  "$set": {matryoshka_key(dimensions): to_bson_float32(vector)}})
+        for doc, vector in zip(batch, truncated)
+    ], ordered=False)
+    return len(batch)
@@ -1,14 +1,25 @@
+import hashlib
 from typing import Optional, List, Any, Dict
 from sqlalchemy import Column, Integer, String, DateTime, Boolean, func
 from sqlalchemy.orm import Session
 from .base import Base
 
 
+def hash_api_key(api_key: str) -> str:
+    """
+    SHA-256 of an API key. Keys are 256-bit random tokens, so a fast unsalted hash is
+    enough to keep them unusable if the table leaks, and it can be looked up by index.
+    """
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
 class Authen(Base):
     __tablename__ = 'authen'
 
     id = Column(Integer, primary_key=True, index=True)
-    key = Column(String, nullable=False)
+    key_hash = Column(String(64), nullable=False, unique=True, index=True)
+    # First characters of the key, to tell keys apart in listings.
+    key_prefix = Column(String(8), nullable=False)
     user = Column(String, nullable=False)
     description = Column(String, nullable=True)
     created_at = Column(DateTime, server_default=func.now(), nullable=False)
@@ -18,7 +29,7 @@ class Authen(Base):
 
     def __repr__(self) -> str:
         return (
-            f"<Authen(id={self.id}, key='{self.key}', user='{self.user}', "
+            f"<Authen(id={self.id}, key_prefix='{self.key_prefix}', user='{self.user}', "
             f"description='{self.description}', created_at='{self.created_at}', "
             f"updated_at='{self.updated_at}', is_active={self.is_active})>"
         )
@@ -27,7 +38,7 @@ class Authen(Base):
         """Convert the Authen instance to a dictionary."""
         return {
             "id": self.id,
-            "key": self.key,
+            "key_prefix": self.key_prefix,
             "user": self.user,
             "description": self.description,
             "created_at": self.created_at,
@@ -38,9 +49,9 @@ class Authen(Base):
     @classmethod
     def create(cls, session: Session, key: str, user: str,
                description: Optional[str] = None, is_active: bool = True) -> 'Authen':
-        """Create a new Authen record and add it to the session."""
-        auth = cls(key=key, user=user, description=description,
-                   is_active=is_active)
+        """Create a new Authen record and add it to the session. Only the key's hash is stored."""
+        auth = cls(key_hash=hash_api_key(key), key_prefix=key[:8], user=user,
+                   description=description, is_active=is_active)
         session.add(auth)
         session.commit()
         session.refresh(auth)
@@ -51,6 +62,11 @@ class Authen(Base):
         """Retrieve an Authen record by its id."""
         return session.query(cls).filter(cls.id == auth_id).first()
 
+    @classmethod
+    def get_by_key(cls, session: Session, key: str) -> Optional['Authen']:
+        """Retrieve an Authen record by its (unhashed) key."""
+        return session.query(cls).filter(cls.key_hash == hash_api_key(key)).first()
+
     @classmethod
     def get_all(cls, session: Session) -> List['Authen']:
         """Retrieve all Authen records."""
@@ -1,3 +1,19 @@
-from sqlalchemy.orm import declarative_base, DeclarativeMeta
+from typing import Any
+from sqlalchemy import JSON
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import declarative_base, DeclarativeMeta, Session
 
 Base: DeclarativeMeta = declarative_base()
+
+# JSONB in PostgreSQL; plain JSON in SQLite, which has no JSONB type.
+JSONB = postgresql.JSONB().with_variant(JSON(), "sqlite")
+
+
+def dialect_insert(session: Session, model: Any):
+    """
+    `INSERT` construct supporting `on_conflict_do_update` for the session's database
+    (PostgreSQL in production, SQLite in local benchmarks).
+    """
+    if session.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
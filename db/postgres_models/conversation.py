@@ -1,9 +1,8 @@
 from typing import Optional, Dict, Any
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, func
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy import Column, Integer, String, DateTime, func, UniqueConstraint
 from sqlalchemy.orm import Session
-from .base import Base
+from .base import Base, JSONB, dialect_insert
 
 
 class Conversation(Base):
@@ -14,6 +13,8 @@ class Conversation(Base):
     system_prompt: Optional[str] = Column(String, nullable=True)
     last_bot_response: Optional[str] = Column(String, nullable=True)
     sender_id: Optional[str] = Column(String, nullable=True)  # New field added
+    # Poe request of the last turn, full history included. No longer written: turns
+    # are appended to `conversation_turn` instead. Kept for conversations from before.
     request: Optional[Dict[str, Any]] = Column(JSONB, nullable=True)
     created_at: datetime = Column(
         DateTime, server_default=func.now(), nullable=False)
@@ -41,8 +42,8 @@ class Conversation(Base):
         instance = session.query(cls).filter_by(
             conversation_id=conversation_id).first()
         if instance:
-            if system_prompt is not None:
-                instance.system_prompt = system_prompt
+            # The system prompt is the same template every turn; it is only stored
+            # when the conversation is created.
             if last_bot_response is not None:
                 instance.last_bot_response = last_bot_response
             if request is not None:
@@ -63,3 +64,107 @@ class Conversation(Base):
             session.commit()
             session.refresh(instance)
         return instance
+
+    @classmethod
+    def bulk_upsert(cls, session: Session, rows: list[Dict[str, Any]]) -> int:
+        """
+        Upsert many conversations with a single `INSERT ... ON CONFLICT DO UPDATE`.
+        Like `upsert`, None values do not overwrite stored ones and `system_prompt` is
+        only written on insert. When a batch holds several rows for one conversation,
+        the last one wins.
+        """
+        rows = list({row["conversation_id"]: row for row in rows}.values())
+        if not rows:
+            return 0
+        statement = dialect_insert(session, cls).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.conversation_id],
+            set_={
+                **{column: func.coalesce(statement.excluded[column], getattr(cls, column))
+                   for column in ("last_bot_response", "request", "sender_id")},
+                "updated_at": func.now(),
+            }
+        )
+        session.execute(statement)
+        session.commit()
+        return len(rows)
+
+
+class ConversationTurn(Base):
+    """
+    One user message and the bot response to it. Rows are only appended (or updated
+    when the same message is answered again), so a turn costs one small row instead
+    of rewriting the whole history stored in `conversation.request`.
+    """
+    __tablename__ = 'conversation_turn'
+    __table_args__ = (UniqueConstraint('conversation_id', 'message_id',
+                      name='conversation_turn__conv_msg_uc'),)
+
+    id: int = Column(Integer, primary_key=True, index=True)
+    conversation_id: str = Column(String, nullable=False)
+    # Poe message id of the user message.
+    message_id: str = Column(String, nullable=False)
+    # Position of the user message among the user messages of the conversation.
+    turn_index: int = Column(Integer, nullable=False)
+    sender_id: Optional[str] = Column(String, nullable=True)
+    user_message: str = Column(String, nullable=False)
+    bot_response: Optional[str] = Column(String, nullable=True)
+    # `{"query", "cached", "results": [{"id", "source", "chunk_num", "score"}]}`
+    retrieval: Optional[Dict[str, Any]] = Column(JSONB, nullable=True)
+    created_at: datetime = Column(
+        DateTime, server_default=func.now(), nullable=False)
+    updated_at: datetime = Column(
+        DateTime, default=func.now(), onupdate=func.now(), nullable=False)
+
+    def __repr__(self) -> str:
+        return (
+            f"<ConversationTurn(id={self.id}, conversation_id='{self.conversation_id}', "
+            f"message_id='{self.message_id}', turn_index={self.turn_index}, "
+            f"created_at='{self.created_at}')>"
+        )
+
+    @classmethod
+    def bulk_upsert(cls, session: Session, rows: list[Dict[str, Any]]) -> int:
+        """
+        Append many turns with a single `INSERT ... ON CONFLICT DO UPDATE`. A turn for a
+        message that is already stored (e.g. a regenerated answer) replaces its response.
+        """
+        rows = list({(row["conversation_id"], row["message_id"]): row
+                     for row in rows}.values())
+        if not rows:
+            return 0
+        statement = dialect_insert(session, cls).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.conversation_id, cls.message_id],
+            set_={
+                "bot_response": statement.excluded.bot_response,
+                "retrieval": statement.excluded.retrieval,
+                "updated_at": func.now(),
+            }
+        )
+        session.execute(statement)
+        session.commit()
+        return len(rows)
+
+    @classmethod
+    def history(cls, session: Session, conversation_id: str) -> list[Dict[str, Any]]:
+        """Rebuild the messages of a conversation, oldest first, from its turns."""
+        turns = session.query(cls).filter_by(conversation_id=conversation_id).order_by(
+            cls.turn_index, cls.id).all()
+        messages = []
+        for turn in turns:
+            messages.append({
+                "role": "user",
+                "content": turn.user_message,
+                "message_id": turn.message_id,
+                "sender_id": turn.sender_id,
+                "created_at": turn.created_at,
+            })
+            if turn.bot_response is not None:
+                messages.append({
+                    "role": "bot",
+                    "content": turn.bot_response,
+                    "retrieval": turn.retrieval,
+                    "created_at": turn.updated_at,
+                })
+        return messages
@@ -2,7 +2,7 @@ from typing import Optional, Dict, Any
 from datetime import datetime
 from sqlalchemy import Column, Integer, String, JSON, DateTime, func, UniqueConstraint
 from sqlalchemy.orm import Session
-from .base import Base
+from .base import Base, dialect_insert
 
 
 class Reaction(Base):
@@ -103,3 +103,26 @@ class Feedback(Base):
             session.commit()
             session.refresh(instance)
         return instance
+
+    @classmethod
+    def bulk_upsert(cls, session: Session, rows: list[Dict[str, Any]]) -> int:
+        """
+        Upsert many feedbacks with a single `INSERT ... ON CONFLICT DO UPDATE`. When a
+        batch holds several rows for one message and user, the last one wins.
+        """
+        rows = list({(row["message_id"], row["user_id"], row["conversation_id"]): row
+                     for row in rows}.values())
+        if not rows:
+            return 0
+        statement = dialect_insert(session, cls).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=[cls.message_id, cls.user_id, cls.conversation_id],
+            set_={
+                "feedback_type": statement.excluded.feedback_type,
+                "request": statement.excluded.request,
+                "updated_at": func.now(),
+            }
+        )
+        session.execute(statement)
+        session.commit()
+        return len(rows)
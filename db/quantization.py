@@ -0,0 +1,62 @@
+from typing import Any, Optional
+
+import numpy as np
+from bson.binary import Binary, BinaryVectorDtype
+
+
+# Candidates rescored per requested result when `rescore_k` is not set.
+RESCORE_FACTOR = 10
+
+
+def rescore_limit(k: int, rescore_k: Optional[int] = None) -> int:
+    """Size of the shortlist rescored for `k` results: `rescore_k`, or `RESCORE_FACTOR * k`."""
+    return max(k, rescore_k or k * RESCORE_FACTOR)
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norm = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norm == 0, 1, norm)
+
+
+def truncate(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    """
+    Matryoshka truncation: keep the first `dimensions` components and re-normalize.
+    text-embedding-3 models are trained so that these prefixes stay meaningful.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    return normalize(vectors[:, :dimensions])
+
+
+def quantize_int8(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scalar-quantize each row to int8 with its own absmax scale. Cosine similarity
+    is scale invariant, so the per-row scale does not need to be stored.
+    """
+    vectors = np.atleast_2d(np.asarray(vectors, dtype=np.float32))
+    scale = np.abs(vectors).max(axis=1, keepdims=True)
+    scale[scale == 0] = 1
+    return np.round(vectors / scale * 127).astype(np.int8)
+
+
+def binarize(vectors: np.ndarray) -> np.ndarray:
+    """Pack the sign bit of every dimension; 3072 dims become 384 bytes."""
+    return np.packbits(np.atleast_2d(vectors) > 0, axis=1)
+
+
+def to_bson_int8(vector: np.ndarray) -> Binary:
+    return Binary.from_vector(vector.astype(np.int8).tolist(), BinaryVectorDtype.INT8)
+
+
+def to_bson_float32(vector: np.ndarray) -> Binary:
+    return Binary.from_vector(np.asarray(vector, dtype=np.float32).tolist(), BinaryVectorDtype.FLOAT32)
+
+
+def from_bson(value: Any) -> np.ndarray:
+    """Decode an embedding stored either as a BSON array or as a binData vector."""
+    if isinstance(value, Binary):
+        return np.asarray(value.as_vector().data, dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def cosine_scores(query: np.ndarray, candidates: np.ndarray) -> np.ndarray:
+    return normalize(np.atleast_2d(candidates).astype(np.float32)) @ normalize(query.astype(np.float32))
@@ -0,0 +1,179 @@
+import logging
+import re
+import threading
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Optional
+
+from pymongo import ASCENDING, DESCENDING, ReplaceOne
+from pymongo.collection import Collection
+
+from .lexical_index import fold
+
+logger = logging.getLogger(__name__)
+
+# Largest page `SourceCatalog.list` returns.
+MAX_PAGE_SIZE = 1000
+# Names per `$in` query in `SourceCatalog.exists`.
+EXISTS_BATCH_SIZE = 1000
+SORT_FIELDS = {"name": "_id", "title": "title", "chunk_count": "chunk_count",
+               "byte_size": "byte_size", "token_count": "token_count", "ingested_at": "ingested_at"}
+
+
+def display_title(name: str) -> str:
+    """Source names are newline-separated paths, e.g. "Trường Bộ\\nKinh Phạm Võng"."""
+    return name.replace("\n", " → ").title()
+
+
+class SourceCatalog:
+    """
+    One document per source of a vector collection, maintained by ingestion:
+    `{_id: name, title, search, chunk_count, byte_size, token_count, ingested_at}`.
+    `search` is the folded, lowercased title used for diacritic-insensitive filters.
+
+    Aggregates are recomputed from the vector collection for the sources an upload
+    touched (`refresh`), so they stay exact after replacements and deletions.
+
+    The catalog also keeps the set of known source names in memory, loaded once with
+    `load_known_sources` and updated by `refresh`, so that `exists` answers unknown
+    names without a database round trip.
+    """
+
+    def __init__(self, collection: Collection, vector_collection: Collection) -> None:
+        self.collection = collection
+        self.vector_collection = vector_collection
+        self._lock = threading.Lock()
+        self._known: Optional[set[str]] = None
+
+    def ensure_indexes(self) -> None:
+        self.collection.create_index([("title", ASCENDING)])
+        self.collection.create_index([("ingested_at", DESCENDING)])
+        self.vector_collection.create_index([("source", ASCENDING)])
+
+    def load_known_sources(self) -> int:
+        """Load every source name of the vector collection (a scan of the `source` index)."""
+        known = set(self.vector_collection.distinct("source"))
+        with self._lock:
+            self._known = known
+        logger.info(
+            f"{self.vector_collection.name}: {len(known)} known source(s)")
+        return len(known)
+
+    def exists(self, names: list[str]) -> list[bool]:
+        """
+        Return, for each name, whether the vector collection has chunks of it. Names
+        missing from the in-memory set are answered without a query; the others are
+        confirmed with one indexed `$in` query per `EXISTS_BATCH_SIZE` names.
+        """
+        with self._lock:
+            known = self._known
+        candidates = list({name for name in names if known is None or name in known})
+        found = set()
+        for start in range(0, len(candidates), EXISTS_BATCH_SIZE):
+            found.update(self.vector_collection.distinct(
+                "source", {"source": {"$in": candidates[start:start + EXISTS_BATCH_SIZE]}}))
+        if known is not None:
+            # Sources deleted behind our back (e.g. by another process) are forgotten.
+            with self._lock:
+                self._known.difference_update(set(candidates) - found)
+        return [name in found for name in names]
+
+    def refresh(self, names: Iterable[str]) -> int:
+        """Recompute the entries of `names`; sources without chunks are removed."""
+        names = list(set(names))
+        if not names:
+            return 0
+        stats = {doc["_id"]: doc for doc in self.vector_collection.aggregate(
+            _aggregate_pipeline({"source": {"$in": names}}))}
+        existing = {doc["_id"]: doc.get("ingested_at") for doc in self.collection.find(
+            {"_id": {"$in": names}}, {"ingested_at": 1})}
+
+        now = datetime.now(timezone.utc)
+        operations = [ReplaceOne({"_id": name}, _entry(stats[name], existing.get(name) or now, now), upsert=True)
+                      for name in names if name in stats]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        removed = [name for name in names if name not in stats]
+        if removed:
+            self.collection.delete_many({"_id": {"$in": removed}})
+        with self._lock:
+            if self._known is not None:
+                self._known.update(stats)
+                self._known.difference_update(removed)
+        return len(operations)
+
+    def rebuild(self, batch_size: int = 1000) -> int:
+        """Recompute the whole catalog with one aggregation over the vector collection."""
+        now = datetime.now(timezone.utc)
+        existing = {doc["_id"]: doc.get("ingested_at")
+                    for doc in self.collection.find({}, {"ingested_at": 1})}
+        seen = set()
+        operations = []
+        for stats in self.vector_collection.aggregate(
+                _aggregate_pipeline({"source": {"$type": "string"}}), allowDiskUse=True):
+            seen.add(stats["_id"])
+            operations.append(ReplaceOne(
+                {"_id": stats["_id"]}, _entry(stats, existing.get(stats["_id"]) or now, now), upsert=True))
+            if len(operations) >= batch_size:
+                self.collection.bulk_write(operations, ordered=False)
+                operations = []
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+        removed = [name for name in existing if name not in seen]
+        if removed:
+            self.collection.delete_many({"_id": {"$in": removed}})
+        return len(seen)
+
+    def list(
+            self,
+            offset: int = 0,
+            limit: int = 100,
+            query: Optional[str] = None,
+            prefix: Optional[str] = None,
+            sort: str = "name",
+            descending: bool = False,
+    ) -> Dict[str, Any]:
+        """
+        Page through the catalog. `query` matches anywhere in the title, ignoring case
+        and diacritics; `prefix` matches the beginning of the source name (indexed).
+        """
+        filter: Dict[str, Any] = {}
+        if query:
+            filter["search"] = {"$regex": re.escape(fold(query).lower())}
+        if prefix:
+            filter["_id"] = {"$regex": f"^{re.escape(prefix)}"}
+        limit = max(0, min(limit, MAX_PAGE_SIZE))
+
+        cursor = self.collection.find(filter, {"search": 0}).sort(
+            SORT_FIELDS.get(sort, "_id"), DESCENDING if descending else ASCENDING).skip(max(offset, 0)).limit(limit)
+        items = [{"name": doc.pop("_id"), **doc} for doc in cursor]
+        return {
+            "total": self.collection.count_documents(filter),
+            "offset": offset,
+            "limit": limit,
+            "items": items,
+        }
+
+
+def _aggregate_pipeline(match: Dict[str, Any]) -> list[Dict[str, Any]]:
+    return [
+        {"$match": match},
+        {"$group": {
+            "_id": "$source",
+            "chunk_count": {"$sum": 1},
+            "byte_size": {"$sum": {"$strLenBytes": {"$ifNull": ["$text", ""]}}},
+            "token_count": {"$sum": {"$ifNull": ["$token_count", 0]}},
+        }},
+    ]
+
+
+def _entry(stats: Dict[str, Any], ingested_at: datetime, updated_at: datetime) -> Dict[str, Any]:
+    title = display_title(stats["_id"])
+    return {
+        "title": title,
+        "search": fold(title).lower(),
+        "chunk_count": stats["chunk_count"],
+        "byte_size": stats["byte_size"],
+        "token_count": stats["token_count"],
+        "ingested_at": ingested_at,
+        "updated_at": updated_at,
+    }
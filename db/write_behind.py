@@ -0,0 +1,168 @@
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy.orm import Session
+
+logger = logging.getLogger(__name__)
+
+# A row is dropped after failing this many flushes.
+MAX_ATTEMPTS = 3
+
+
+class WriteBehindQueue:
+    """
+    Bounded in-memory queue of rows persisted by a background thread.
+
+    `submit(model, row)` never blocks: the row is appended to the queue, or counted as
+    an overflow and dropped when `max_size` rows are already waiting. The worker
+    flushes when `batch_size` rows are queued or `flush_interval` seconds passed,
+    grouping rows by model and calling `model.bulk_upsert(session, rows)` once per
+    model, i.e. one `INSERT ... ON CONFLICT DO UPDATE` per table and flush. Failed
+    rows are retried on the next flush. `stop` drains the queue before returning.
+
+    `on_flush`, when given, is called from the worker with the number of rows written
+    and the duration in seconds of every flush.
+    """
+
+    def __init__(
+            self,
+            session_factory: Callable[[], Session],
+            max_size: int = 10_000,
+            batch_size: int = 200,
+            flush_interval: float = 1.0,
+            on_flush: Optional[Callable[[int, float], None]] = None,
+    ) -> None:
+        self.session_factory = session_factory
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+
+        self._queue: deque = deque()
+        self._condition = threading.Condition()
+        self._stopping = False
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.flushed = 0
+        self.flushes = 0
+        self.overflows = 0
+        self.failures = 0
+        self.dropped = 0
+        self.last_flush_seconds = 0.0
+
+    def start(self) -> None:
+        if self._thread is not None:
+            return
+        self._stopping = False
+        self._thread = threading.Thread(
+            target=self._run, name="write-behind", daemon=True)
+        self._thread.start()
+        logger.info(
+            f"Write-behind queue started (batch {self.batch_size}, interval {self.flush_interval}s, max {self.max_size})")
+
+    def stop(self, timeout: float = 30.0) -> None:
+        """Flush everything still queued and stop the worker."""
+        if self._thread is None:
+            return
+        with self._condition:
+            self._stopping = True
+            self._condition.notify()
+        self._thread.join(timeout)
+        self._thread = None
+        logger.info(f"Write-behind queue stopped: {self.stats()}")
+
+    def submit(self, model: Any, row: Dict[str, Any]) -> bool:
+        with self._condition:
+            if len(self._queue) >= self.max_size:
+                self.overflows += 1
+                if self.overflows == 1 or self.overflows % 1000 == 0:
+                    logger.warning(
+                        f"Write-behind queue full, {self.overflows} row(s) dropped so far")
+                return False
+            self._queue.append((model, row, 0))
+            self.submitted += 1
+            if len(self._queue) >= self.batch_size:
+                self._condition.notify()
+        return True
+
+    def flush(self) -> int:
+        """Write up to `batch_size` queued rows now; returns the number written."""
+        with self._condition:
+            items = [self._queue.popleft()
+                     for _ in range(min(self.batch_size, len(self._queue)))]
+        if not items:
+            return 0
+
+        by_model: Dict[Any, list] = {}
+        for item in items:
+            by_model.setdefault(item[0], []).append(item)
+
+        written = 0
+        started = time.perf_counter()
+        for model, model_items in by_model.items():
+            session = self.session_factory()
+            try:
+                model.bulk_upsert(session, [row for _, row, _ in model_items])
+                written += len(model_items)
+            except Exception as e:
+                session.rollback()
+                self.failures += 1
+                logger.error(
+                    f"Error writing {len(model_items)} {model.__name__} row(s): {e}")
+                self._retry(model_items)
+            finally:
+                session.close()
+
+        elapsed = time.perf_counter() - started
+        with self._condition:
+            self.flushed += written
+            self.flushes += 1
+            self.last_flush_seconds = elapsed
+        if self.on_flush is not None:
+            try:
+                self.on_flush(written, elapsed)
+            except Exception as e:
+                logger.error(f"Error reporting write-behind flush: {e}")
+        return written
+
+    def stats(self) -> Dict[str, Any]:
+        with self._condition:
+            return {
+                "queued": len(self._queue),
+                "submitted": self.submitted,
+                "flushed": self.flushed,
+                "flushes": self.flushes,
+                "overflows": self.overflows,
+                "failures": self.failures,
+                "dropped": self.dropped,
+                "last_flush_seconds": self.last_flush_seconds,
+            }
+
+    def _retry(self, items: list) -> None:
+        with self._condition:
+            for model, row, attempts in reversed(items):
+                if attempts + 1 >= MAX_ATTEMPTS or len(self._queue) >= self.max_size:
+                    self.dropped += 1
+                    continue
+                self._queue.appendleft((model, row, attempts + 1))
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                if not self._stopping and len(self._queue) < self.batch_size:
+                    self._condition.wait(self.flush_interval)
+                stopping = self._stopping
+            try:
+                while self.flush() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"Error flushing write-behind queue: {e}")
+            if stopping:
+                # Drain: keep flushing until the queue is empty or only failing rows are left.
+                while self._queue and self.flush():
+                    pass
+                return
@@ -1,3 +1,4 @@
+import functools
 import logging
 import os
 
@@ -6,12 +7,21 @@ from dotenv import load_dotenv
 from rich.logging import RichHandler
 from rich.console import Console
 from langchain_openai import OpenAIEmbeddings
+from openai import OpenAI
 
 from db import mongoatlas, postgres
-from service.api import app
+from db.lexical_index import LexicalIndex
+from db.local_index import LocalVectorIndex
+from db.write_behind import WriteBehindQueue
+from service import metrics
+from service.api import app, register_startup, register_shutdown
 from service.auth import APIKeyManager
+from service.answer_cache import SemanticAnswerCache
 from service.bot import TipitakaAI
-from service.health_check import HealthChecker
+from service.embedding_cache import CachedEmbeddings
+from service.health_check import HealthChecker, HealthMonitor
+from service.llm import AsyncLLMClient, TOGETHER_BASE_URL
+from service.routing import ModelRouter, DEFAULT_MODEL
 
 if __name__ == "__main__":
     ###########################################
@@ -45,9 +55,102 @@ if __name__ == "__main__":
     postgres_conn_sr = os.environ.get("POSTGRES_CONNECTION_STRING")
     logger.info(f"POSTGRES_CONNECTION_STRING={postgres_conn_sr}")
 
+    embedding_cache_path = os.environ.get(
+        "EMBEDDING_CACHE_PATH", ".cache/embeddings.sqlite3")
+    embedding_cache_max_mb = int(
+        os.environ.get("EMBEDDING_CACHE_MAX_MB", "1024"))
+    logger.info(
+        f"EMBEDDING_CACHE_PATH={embedding_cache_path}, EMBEDDING_CACHE_MAX_MB={embedding_cache_max_mb}"
+    )
+
+    # When set, the bot answers from a local index synced by cmd/sync_local_index.py
+    # instead of Atlas $vectorSearch. Ingestion still goes to MongoDB.
+    local_vector_index_path = os.environ.get("LOCAL_VECTOR_INDEX_PATH")
+    # Search int8 vectors first and rescore the shortlist with full-precision ones.
+    # Requires `python cmd/quantize_embeddings.py migrate` on existing collections.
+    quantized_search = os.environ.get(
+        "QUANTIZED_SEARCH", "FALSE").upper() == "TRUE"
+    # Alternatively search a truncated MATRYOSHKA_DIMENSIONS-dim vector and rerank with
+    # the full one. Requires `python cmd/quantize_embeddings.py migrate-matryoshka`.
+    matryoshka_dimensions = int(os.environ.get("MATRYOSHKA_DIMENSIONS", "0"))
+    # Candidates rescored per search; 0 rescores 10 per requested result.
+    rescore_k = int(os.environ.get("QUANTIZED_SEARCH_RESCORE_K", "0")) or None
+    logger.info(
+        f"LOCAL_VECTOR_INDEX_PATH={local_vector_index_path}, QUANTIZED_SEARCH={quantized_search}, "
+        f"MATRYOSHKA_DIMENSIONS={matryoshka_dimensions}, QUANTIZED_SEARCH_RESCORE_K={rescore_k}")
+
+    # BM25 index over the secondary collection, fused with vector search. Build it
+    # once with `python cmd/build_lexical_index.py`; uploads keep it up to date.
+    lexical_index_path = os.environ.get("LEXICAL_INDEX_PATH")
+    logger.info(f"LEXICAL_INDEX_PATH={lexical_index_path}")
+
+    # Near-duplicate questions are answered from cache; 0 entries disables it.
+    answer_cache_max_entries = int(
+        os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "1000"))
+    answer_cache_threshold = float(
+        os.environ.get("ANSWER_CACHE_THRESHOLD", "0.97"))
+    answer_cache_ttl_hours = float(
+        os.environ.get("ANSWER_CACHE_TTL_HOURS", "24"))
+    logger.info(
+        f"ANSWER_CACHE_MAX_ENTRIES={answer_cache_max_entries}, ANSWER_CACHE_THRESHOLD={answer_cache_threshold}, "
+        f"ANSWER_CACHE_TTL_HOURS={answer_cache_ttl_hours}")
+
+    # Conversations and feedback are written in batches by a background thread;
+    # 0 WRITE_BEHIND_MAX_QUEUE writes them synchronously instead.
+    write_behind_max_queue = int(
+        os.environ.get("WRITE_BEHIND_MAX_QUEUE", "10000"))
+    write_behind_batch_size = int(
+        os.environ.get("WRITE_BEHIND_BATCH_SIZE", "200"))
+    write_behind_interval = float(
+        os.environ.get("WRITE_BEHIND_INTERVAL", "1.0"))
+    logger.info(
+        f"WRITE_BEHIND_MAX_QUEUE={write_behind_max_queue}, WRITE_BEHIND_BATCH_SIZE={write_behind_batch_size}, "
+        f"WRITE_BEHIND_INTERVAL={write_behind_interval}")
+
+    # Chat completions are streamed from an OpenAI-compatible API (Together by default).
+    llm_base_url = os.environ.get("LLM_BASE_URL", TOGETHER_BASE_URL)
+    llm_max_concurrency = int(os.environ.get("LLM_MAX_CONCURRENCY", "32"))
+    llm_timeout = float(os.environ.get("LLM_TIMEOUT", "120"))
+    logger.info(
+        f"LLM_BASE_URL={llm_base_url}, LLM_MAX_CONCURRENCY={llm_max_concurrency}, LLM_TIMEOUT={llm_timeout}")
+
+    # Routing is off unless ROUTING_SMALL_MODEL is set (e.g. Qwen/Qwen2.5-7B-Instruct-Turbo):
+    # then short prompts, and overflow when the default model is saturated or slow,
+    # go to that smaller model.
+    routing_default_model = os.environ.get(
+        "ROUTING_DEFAULT_MODEL", DEFAULT_MODEL)
+    routing_small_model = os.environ.get("ROUTING_SMALL_MODEL") or None
+    routing_short_context_tokens = int(
+        os.environ.get("ROUTING_SHORT_CONTEXT_TOKENS", "4000"))
+    routing_max_default_in_flight = int(
+        os.environ.get("ROUTING_MAX_DEFAULT_IN_FLIGHT", "16"))
+    routing_first_token_target = float(
+        os.environ.get("ROUTING_FIRST_TOKEN_TARGET", "5"))
+    logger.info(
+        f"ROUTING_DEFAULT_MODEL={routing_default_model}, ROUTING_SMALL_MODEL={routing_small_model}, "
+        f"ROUTING_SHORT_CONTEXT_TOKENS={routing_short_context_tokens}, "
+        f"ROUTING_MAX_DEFAULT_IN_FLIGHT={routing_max_default_in_flight}, "
+        f"ROUTING_FIRST_TOKEN_TARGET={routing_first_token_target}")
+
+    # Health probes run in the background; requests only read the last result.
+    # HEALTH_CHECK_PROVIDERS also probes the embedding and LLM APIs (non-critical).
+    health_check_interval = float(
+        os.environ.get("HEALTH_CHECK_INTERVAL", "30"))
+    health_check_timeout = float(os.environ.get("HEALTH_CHECK_TIMEOUT", "5"))
+    health_check_providers = os.environ.get(
+        "HEALTH_CHECK_PROVIDERS", "false").lower() == "true"
+    logger.info(
+        f"HEALTH_CHECK_INTERVAL={health_check_interval}, HEALTH_CHECK_TIMEOUT={health_check_timeout}, "
+        f"HEALTH_CHECK_PROVIDERS={health_check_providers}")
+
     ###########################################
     ################## INITIALIZE SERVICES ####
-    embeddings = OpenAIEmbeddings(model=embedding_model)
+    embeddings = CachedEmbeddings(
+        OpenAIEmbeddings(model=embedding_model),
+        path=embedding_cache_path,
+        namespace=embedding_model,
+        max_disk_bytes=embedding_cache_max_mb * 1024 * 1024,
+    )
     mongodb_helper = mongoatlas.MongoDBHelper(
         connection_str=mongodb_conn_sr,
         db_name="tipitaka-viet-db",
@@ -61,30 +164,98 @@ if __name__ == "__main__":
     secondary_vector_store = mongodb_helper.create_secondary_vector_store(
         embeddings, mongodb_search_index_created, dimensions=3072
     )
+    retrieval_vector_store = secondary_vector_store
+    if local_vector_index_path:
+        retrieval_vector_store = LocalVectorIndex(
+            local_vector_index_path, embeddings, dimensions=3072,
+            quantized=quantized_search, rescore_k=rescore_k)
+    elif matryoshka_dimensions > 0:
+        retrieval_vector_store = mongodb_helper.create_matryoshka_secondary_vector_store(
+            secondary_vector_store, mongodb_search_index_created, dimensions=matryoshka_dimensions, rescore_k=rescore_k)
+    elif quantized_search:
+        retrieval_vector_store = mongodb_helper.create_quantized_secondary_vector_store(
+            secondary_vector_store, mongodb_search_index_created, dimensions=3072, rescore_k=rescore_k)
+    lexical_index = LexicalIndex(
+        lexical_index_path) if lexical_index_path else None
+    answer_cache = SemanticAnswerCache(
+        embeddings, threshold=answer_cache_threshold,
+        ttl_seconds=answer_cache_ttl_hours * 3600,
+        max_entries=answer_cache_max_entries) if answer_cache_max_entries > 0 else None
+
+    llm = AsyncLLMClient(base_url=llm_base_url,
+                         max_concurrency=llm_max_concurrency, timeout=llm_timeout)
+    router = ModelRouter(
+        default_model=routing_default_model, small_model=routing_small_model,
+        small_context_tokens=routing_short_context_tokens,
+        max_default_in_flight=routing_max_default_in_flight,
+        latency_target=routing_first_token_target)
 
     # Initialize PostgreSQL engine and session factory
     pg_engine, SessionLocal = postgres.init_db(postgres_conn_sr)
     api_key_manager = APIKeyManager(admin_key, SessionLocal)
+    write_behind = WriteBehindQueue(
+        SessionLocal, max_size=write_behind_max_queue,
+        batch_size=write_behind_batch_size,
+        flush_interval=write_behind_interval,
+        on_flush=metrics.observe_flush) if write_behind_max_queue > 0 else None
 
     # Initialize HealthChecker with PostgreSQL engine and MongoDB client
     # Assumes MongoDBHelper exposes a MongoClient as "client"
     mongodb_client = mongodb_helper.client
     health_checker = HealthChecker(
         pg_engine=pg_engine, mongodb_client=mongodb_client)
+    probes = health_checker.probes()
+    if health_check_providers:
+        openai_client = OpenAI(max_retries=0)
+        probes["embeddings"] = lambda: openai_client.models.retrieve(
+            embedding_model)
+        probes["llm"] = llm.probe
+    health_monitor = HealthMonitor(
+        probes, optional=["embeddings", "llm"],
+        interval=health_check_interval, timeout=health_check_timeout)
 
     # Set services in app state
     app.set_vector_store(vector_store)
     app.set_secondary_vector_store(secondary_vector_store)
+    app.set_source_catalog(mongodb_helper.create_source_catalog())
+    app.set_secondary_source_catalog(
+        mongodb_helper.create_source_catalog(secondary=True))
     app.set_api_key_manager(api_key_manager)
-    app.set_health_checker(health_checker)
+    app.set_session_factory(SessionLocal)
+    app.set_health_monitor(health_monitor)
+    register_startup(app, health_monitor.start)
+    register_shutdown(app, health_monitor.stop)
+    register_shutdown(app, llm.aclose)
+    ingest_hooks = []
+    if quantized_search:
+        ingest_hooks.append(mongoatlas.migrate_quantized_embeddings)
+    if matryoshka_dimensions > 0:
+        ingest_hooks.append(functools.partial(
+            mongoatlas.migrate_matryoshka_embeddings, dimensions=matryoshka_dimensions))
+    app.set_ingest_hooks(ingest_hooks)
+    app.set_lexical_index(lexical_index)
+    app.set_answer_cache(answer_cache)
+    app.set_write_behind(write_behind)
+    app.set_model_router(router)
+    app.set_llm(llm)
+    metrics.watch(write_behind=write_behind, llm=llm)
+    if write_behind is not None:
+        # The shutdown handler drains the queue before the process exits.
+        register_startup(app, write_behind.start)
+        register_shutdown(app, write_behind.stop)
     app.list_routes()
 
     bot = TipitakaAI()
     bot.init(
         bot_name=bot_name,
         session_factory=SessionLocal,
-        health_checker=health_checker,
+        health_monitor=health_monitor,
+        llm=llm,
+        router=router,
         vector_store=vector_store,
-        secondary_vector_store=secondary_vector_store,
+        secondary_vector_store=retrieval_vector_store,
+        lexical_index=lexical_index,
+        answer_cache=answer_cache,
+        write_behind=write_behind,
     )
     fp.run(bot, app=app, access_key=poe_access_key)
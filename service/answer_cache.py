@@ -0,0 +1,153 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+class SemanticAnswerCache:
+    """
+    Cache of final bot answers keyed on the embedding of the search query.
+
+    A lookup embeds the query (a cache hit in `CachedEmbeddings` when the same text
+    is searched afterwards) and compares it with every cached query embedding in one
+    matrix product. The closest entry is returned when its cosine similarity is at
+    least `threshold` and it is younger than `ttl_seconds`. When all `max_entries`
+    slots are taken, the least recently used entry is replaced.
+
+    `invalidate` drops everything; answers generated from search results fetched
+    before the invalidation are not stored afterwards (see `generation`).
+    """
+
+    def __init__(
+            self,
+            embeddings: Embeddings,
+            threshold: float = 0.97,
+            ttl_seconds: float = 24 * 3600,
+            max_entries: int = 1000,
+    ) -> None:
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.generation = 0
+
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: list[Optional[Dict[str, Any]]] = [None] * max_entries
+        self._created_at = np.zeros(max_entries, dtype=np.float64)
+        self._used_at = np.zeros(max_entries, dtype=np.float64)
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def lookup(self, query: str) -> Optional[Dict[str, Any]]:
+        """
+        Return the cached entry (`query`, `search_response`, `summary`, `answer`,
+        `search_results`, `similarity`) for the closest earlier query, or None.
+        """
+        vector = self._embed(query)
+        now = time.time()
+        with self._lock:
+            slot = self._closest(vector, now)
+            if slot is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._used_at[slot] = now
+            return self._entries[slot]
+
+    def store(
+            self,
+            query: str,
+            search_response: str,
+            summary: Dict[str, Any],
+            answer: str,
+            search_results: list[Dict[str, Any]],
+            generation: int,
+    ) -> None:
+        """
+        Cache the parts of the response to `query` that do not quote the question: the
+        search table, the `build_bot_summary` arguments other than the question, and
+        the LLM answer. `generation` is the value of `self.generation` read before
+        searching; a stale generation means the corpus changed meanwhile.
+        """
+        vector = self._embed(query)
+        now = time.time()
+        with self._lock:
+            if generation != self.generation:
+                return
+            if self._vectors is None:
+                self._vectors = np.zeros(
+                    (self.max_entries, len(vector)), dtype=np.float32)
+
+            free = [i for i, entry in enumerate(self._entries) if entry is None]
+            if free:
+                slot = free[0]
+            else:
+                slot = int(np.argmin(self._used_at))
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._entries[slot] = {
+                "query": query,
+                "search_response": search_response,
+                "summary": summary,
+                "answer": answer,
+                "search_results": search_results,
+            }
+            self._created_at[slot] = now
+            self._used_at[slot] = now
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._entries = [None] * self.max_entries
+            self._created_at[:] = 0
+            self._used_at[:] = 0
+        logger.info("Answer cache invalidated")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": sum(entry is not None for entry in self._entries),
+                "generation": self.generation,
+            }
+
+    def _embed(self, query: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _closest(self, vector: np.ndarray, now: float) -> Optional[int]:
+        if self._vectors is None:
+            return None
+        expired = [i for i, entry in enumerate(self._entries)
+                   if entry is not None and now - self._created_at[i] > self.ttl_seconds]
+        for slot in expired:
+            self._entries[slot] = None
+            self._used_at[slot] = 0
+        self.expirations += len(expired)
+
+        occupied = np.fromiter(
+            (entry is not None for entry in self._entries), dtype=bool, count=self.max_entries)
+        if not occupied.any():
+            return None
+        similarities = np.where(occupied, self._vectors @ vector, -1)
+        slot = int(np.argmax(similarities))
+        if similarities[slot] < self.threshold:
+            return None
+        self._entries[slot] = {**self._entries[slot],
+                               "similarity": float(similarities[slot])}
+        return slot
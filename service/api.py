@@ -1,22 +1,67 @@
-from uuid import uuid4
+import asyncio
+import inspect
+import json
 import logging
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Iterable, Optional
 from pydantic import BaseModel
 
 from fastapi import Request, HTTPException
 from fastapi import Depends, Security, HTTPException
 from fastapi.security.api_key import APIKeyHeader
+from fastapi.responses import Response, StreamingResponse
 from fastapi import FastAPI, HTTPException, Request
 from fastapi import Depends
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from uuid import uuid4
 from langchain_mongodb import MongoDBAtlasVectorSearch
+from db.lexical_index import LexicalIndex
+from db.postgres_models.conversation import ConversationTurn
+from db.source_catalog import SourceCatalog
 
-from .health_check import HealthChecker
+from . import metrics
+from .health_check import HealthMonitor
 from .auth import APIKeyManager
+from .ingest_stream import chunk_source, chunk_ids, find_existing_chunks, move_chunks, delete_stale_chunks, ingest_stream
+from .tokenizer import load_tokenizer, count_tokens_batch, tokenizer_name
 
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Run the handlers registered with `register_startup` / `register_shutdown`, sync
+    or async. Shutdown handlers run in reverse order of registration.
+    """
+    for handler in app.state.startup_handlers:
+        await _call(handler)
+    try:
+        yield
+    finally:
+        for handler in reversed(app.state.shutdown_handlers):
+            try:
+                await _call(handler)
+            except Exception as e:
+                logger.error(f"Error in shutdown handler {handler}: {e}")
+
+
+async def _call(handler: Callable[[], Any]) -> None:
+    result = handler()
+    if inspect.isawaitable(result):
+        await result
+
+
+def register_startup(app: FastAPI, handler: Callable[[], Any]) -> None:
+    """Run `handler` when `app` starts, before it serves requests; see `lifespan`."""
+    app.state.startup_handlers.append(handler)
+
+
+def register_shutdown(app: FastAPI, handler: Callable[[], Any]) -> None:
+    """Run `handler` when `app` shuts down; see `lifespan`."""
+    app.state.shutdown_handlers.append(handler)
+
+
+app = FastAPI(lifespan=lifespan)
+app.state.startup_handlers = []
+app.state.shutdown_handlers = []
 api_key_header = APIKeyHeader(name="X-API-Key")
 
 
@@ -33,7 +78,8 @@ def list_routes(app: FastAPI):
             f"Path: {route.path}, Name: {route.name}, Methods: {route.methods}")
 
 
-async def only_authenticated(api_key: str = Security(api_key_header), request: Request = None):
+def only_authenticated(api_key: str = Security(api_key_header), request: Request = None):
+    # Not async: a cache miss queries Postgres, so FastAPI runs this in its threadpool.
     api_key_manager: APIKeyManager = request.app.state.api_key_manager
     if not api_key_manager.validate_api_key(api_key):
         raise HTTPException(
@@ -60,37 +106,96 @@ class TextSource(BaseModel):
 
 @app.put("/sources/upload", dependencies=[Depends(only_authenticated)])
 def upload_sources(request: Request, request_data: list[TextSource], secondary: bool = False):
+    return ingest_sources(request, request_data, secondary, replace=False)
+
+
+@app.put("/sources/replace", dependencies=[Depends(only_authenticated)])
+def replace_sources(request: Request, request_data: list[TextSource], secondary: bool = False):
+    """
+    Like `/sources/upload`, but the uploaded content replaces each source entirely:
+    chunks of these sources that are not in the new content are deleted.
+    """
+    return ingest_sources(request, request_data, secondary, replace=True)
+
+
+def ingest_sources(request: Request, request_data: list[TextSource], secondary: bool, replace: bool):
     try:
-        process_sources(
-            vector_store=request.app.state.secondary_vector_store if secondary else request.app.state.vector_store,
+        vector_store = request.app.state.secondary_vector_store if secondary else request.app.state.vector_store
+        ids = process_sources(
+            vector_store=vector_store,
             sources=request_data,
-            slice=secondary
+            slice=secondary,
+            lexical_index=getattr(
+                request.app.state, "lexical_index", None) if secondary else None,
+            replace=replace
         )
+        run_ingest_hooks(request.app, vector_store, ids)
+        refresh_source_catalog(
+            request.app, secondary, [src.source_name for src in request_data])
+        invalidate_answer_cache(request.app)
         return {"message": "Source processed successfully"}
     except Exception as e:
         logger.error(f"Error processing sources: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@app.put("/sources/upload/stream", dependencies=[Depends(only_authenticated)])
+async def upload_sources_stream(request: Request, secondary: bool = False, replace: bool = False):
+    """
+    Streaming variant of `/sources/upload`: the body is NDJSON (optionally gzipped),
+    one `TextSource` object per line, and the response is NDJSON progress events.
+    Every batch is committed as soon as it is embedded, so a failure keeps the
+    batches written before it. With `replace`, behaves like `/sources/replace`.
+    """
+    vector_store = request.app.state.secondary_vector_store if secondary else request.app.state.vector_store
+
+    async def events():
+        source_names = set()
+        async for event in ingest_stream(
+                request.stream(),
+                vector_store,
+                slice=secondary,
+                tokenizer=load_tokenizer(),
+                lexical_index=getattr(
+                    request.app.state, "lexical_index", None) if secondary else None,
+                on_batch=lambda ids: run_ingest_hooks(
+                    request.app, vector_store, ids),
+                replace=replace):
+            if event["event"] == "source":
+                source_names.add(event["source"])
+            elif event["event"] == "complete":
+                metrics.observe_upload(
+                    event["sources"], event["written"] - event["skipped"], event["skipped"], event["deleted"])
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+        # The catalog aggregation can take a while after a large upload.
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None, refresh_source_catalog, request.app, secondary, source_names)
+        await loop.run_in_executor(None, invalidate_answer_cache, request.app)
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
+
+
 @app.get("/sources/list")
-def get_sources(request: Request, secondary: bool = False):
+def get_sources(request: Request, secondary: bool = False, offset: int = 0, limit: int = 100,
+                q: Optional[str] = None, prefix: Optional[str] = None, sort: str = "name", descending: bool = False):
+    """
+    Page through the source catalog: name, title, chunk count, byte size, token count
+    and ingest time of every source. `q` filters titles (case and diacritics are
+    ignored), `prefix` filters names.
+    """
     try:
-        print()
-        sources = get_sources(
-            request.app.state.secondary_vector_store if secondary else request.app.state.vector_store)
-        return sources
+        catalog = get_source_catalog(request.app, secondary)
+        return catalog.list(offset=offset, limit=limit, query=q, prefix=prefix, sort=sort, descending=descending)
     except Exception as e:
-        logger.error(f"Error checking sources: {e}")
+        logger.error(f"Error listing sources: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/sources/exists")
 def check_source_exist(request: Request, source_name: list[str], secondary: bool = False):
     try:
-        return exists(
-            request.app.state.secondary_vector_store if secondary else request.app.state.vector_store,
-            source_name
-        )
+        return get_source_catalog(request.app, secondary).exists(source_name)
     except Exception as e:
         logger.error(f"Error checking sources: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -117,68 +222,163 @@ def list_api_keys(request: Request):
     return api_key_manager.list_api_keys()
 
 
+@app.get("/cache/stats", dependencies=[Depends(only_admin)])
+def cache_stats(request: Request):
+    stats = {}
+    answer_cache = getattr(request.app.state, "answer_cache", None)
+    if answer_cache is not None:
+        stats["answer_cache"] = answer_cache.stats()
+    embeddings = getattr(request.app.state.vector_store, "embeddings", None)
+    if hasattr(embeddings, "stats"):
+        stats["embedding_cache"] = embeddings.stats()
+    write_behind = getattr(request.app.state, "write_behind", None)
+    if write_behind is not None:
+        stats["write_behind"] = write_behind.stats()
+    return stats
+
+
+@app.get("/routing/stats", dependencies=[Depends(only_admin)])
+def routing_stats(request: Request):
+    return {
+        "models": request.app.state.model_router.stats(),
+        "llm": request.app.state.llm.stats(),
+    }
+
+
+@app.get("/conversations/{conversation_id}/history", dependencies=[Depends(only_admin)])
+def get_conversation_history(request: Request, conversation_id: str):
+    session = request.app.state.session_factory()
+    try:
+        messages = ConversationTurn.history(session, conversation_id)
+    finally:
+        session.close()
+    if not messages:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    return {"conversation_id": conversation_id, "messages": messages}
+
+
 @app.get("/health")
 async def health_check(request: Request):
-    health_checker: HealthChecker = request.app.state.health_checker
-    try:
-        health_checker.check()
-        return {"status": "healthy"}
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
+    health_monitor: HealthMonitor = request.app.state.health_monitor
+    status = health_monitor.status()
+    if status["status"] == "unhealthy":
+        raise HTTPException(status_code=500, detail=status)
+    return status
+
+
+@app.get("/metrics")
+def get_metrics():
+    """Prometheus metrics of this process; unauthenticated like `/health`."""
+    body, content_type = metrics.render()
+    return Response(content=body, media_type=content_type)
 
 
 app.list_routes = lambda: list_routes(app)
 app.set_api_key_manager = lambda api_key_manager: setattr(
     app.state, "api_key_manager", api_key_manager)
-app.set_health_checker = lambda health_checker: setattr(
-    app.state, "health_checker", health_checker)
+app.set_health_monitor = lambda health_monitor: setattr(
+    app.state, "health_monitor", health_monitor)
 app.set_vector_store = lambda vector_store: setattr(
     app.state, "vector_store", vector_store)
 app.set_secondary_vector_store = lambda secondary_vector_store: setattr(
     app.state, "secondary_vector_store", secondary_vector_store)
-
-
-def process_sources(vector_store: MongoDBAtlasVectorSearch, sources: list[TextSource], slice: int = 0):
+app.set_ingest_hooks = lambda ingest_hooks: setattr(
+    app.state, "ingest_hooks", ingest_hooks)
+app.set_lexical_index = lambda lexical_index: setattr(
+    app.state, "lexical_index", lexical_index)
+app.set_answer_cache = lambda answer_cache: setattr(
+    app.state, "answer_cache", answer_cache)
+app.set_source_catalog = lambda source_catalog: setattr(
+    app.state, "source_catalog", source_catalog)
+app.set_secondary_source_catalog = lambda secondary_source_catalog: setattr(
+    app.state, "secondary_source_catalog", secondary_source_catalog)
+app.set_write_behind = lambda write_behind: setattr(
+    app.state, "write_behind", write_behind)
+app.set_model_router = lambda model_router: setattr(
+    app.state, "model_router", model_router)
+app.set_llm = lambda llm: setattr(app.state, "llm", llm)
+app.set_session_factory = lambda session_factory: setattr(
+    app.state, "session_factory", session_factory)
+
+
+def process_sources(vector_store: MongoDBAtlasVectorSearch, sources: list[TextSource], slice: int = 0, tokenizer=None, lexical_index: Optional[LexicalIndex] = None, replace: bool = False):
     """
     Process sources: add documents to the vector store.
+    Chunk ids are content-addressed (see `chunk_ids`), so chunks that are already
+    stored are neither embedded nor inserted again; only their `chunk_num` is updated
+    if they moved. With `replace`, stored chunks of these sources that are not part
+    of the upload anymore are deleted.
+    Each document also stores its token count for the chat-model tokenizer, so that
+    `build_messages` can pack context without re-tokenizing search results.
+    Chunks are also added to `lexical_index` when one is given.
+    Returns the ids of the inserted documents.
     """
+    chunks = []
+    for src in sources:
+        chunks.extend(chunk_source(src.source_name, src.content, slice))
+    ids = chunk_ids(chunks)
 
-    texts = []
-    uuids = []
-    metadatas = []
-    if slice > 0:
-        # Split texts into chunks and add to the vector store
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=100)
+    collection = vector_store.collection
+    existing = find_existing_chunks(collection, ids)
+    moved = move_chunks(
+        collection, [(id, metadata) for id, (_, metadata) in zip(ids, chunks)], existing)
+    new = [(id, text, metadata)
+           for id, (text, metadata) in zip(ids, chunks) if id not in existing]
+    uuids = [id for id, _, _ in new]
+    texts = [text for _, text, _ in new]
+    metadatas = [metadata for _, _, metadata in new]
+
+    tokenizer = tokenizer or load_tokenizer()
+    for metadata, token_count in zip(metadatas, count_tokens_batch(tokenizer, texts)):
+        metadata["token_count"] = token_count
+        metadata["tokenizer"] = tokenizer_name(tokenizer)
+
+    if texts:
+        vector_store.add_texts(
+            texts=texts, metadatas=metadatas, ids=uuids, batch_size=100_000)
+    if lexical_index is not None:
+        lexical_index.add([{"id": id, "text": text, **metadata}
+                          for id, text, metadata in new])
+
+    deleted = []
+    if replace:
+        for source_name in {src.source_name for src in sources}:
+            deleted.extend(delete_stale_chunks(
+                collection, source_name, set(ids)))
+        if deleted and lexical_index is not None:
+            lexical_index.delete(deleted)
+    logger.info(
+        f"Processed {len(sources)} source(s): {len(new)} new, {len(existing)} unchanged ({moved} moved), {len(deleted)} deleted chunk(s)")
+    metrics.observe_upload(len(sources), len(new), len(existing), len(deleted))
+    return uuids
+
+
+def run_ingest_hooks(app: FastAPI, vector_store: MongoDBAtlasVectorSearch, ids: list[str]):
+    """
+    Run the post-ingestion hooks registered with `app.set_ingest_hooks`, e.g. adding
+    quantized vectors to freshly inserted documents.
+    """
+    for hook in getattr(app.state, "ingest_hooks", []):
+        hook(vector_store.collection, ids)
 
-        for src in sources:
-            chunks = text_splitter.split_text(src.content)
-            texts.extend(chunks)
-            uuids.extend([str(uuid4()) for _ in range(len(chunks))])
-            metadatas.extend([{"source": src.source_name, "chunk_num": i}
-                             for i in range(len(chunks))])
-            del chunks
-    else:
-        uuids.extend([str(uuid4()) for _ in range(len(sources))])
-        texts.extend([src.content for src in sources])
-        metadatas.extend([{"source": src.source_name} for src in sources])
 
-    vector_store.add_texts(
-        texts=texts, metadatas=metadatas, ids=uuids, batch_size=100_000)
+def invalidate_answer_cache(app: FastAPI):
+    """Cached answers are grounded on the old corpus; drop them after an upload."""
+    answer_cache = getattr(app.state, "answer_cache", None)
+    if answer_cache is not None:
+        answer_cache.invalidate()
 
 
-def get_sources(vector_store: MongoDBAtlasVectorSearch) -> list[str]:
-    """
-    Retrieve source names from the database.
-    """
-    collection = vector_store.collection
-    sources = collection.find({})
-    return [source['source'] for source in sources]
+def get_source_catalog(app: FastAPI, secondary: bool) -> SourceCatalog:
+    return app.state.secondary_source_catalog if secondary else app.state.source_catalog
 
 
-def exists(vector_store: MongoDBAtlasVectorSearch, source_name: list[str]) -> list[bool]:
+def refresh_source_catalog(app: FastAPI, secondary: bool, source_names: Iterable[str]):
     """
-    Check if source exists in the database.
+    Recompute the catalog entries of the uploaded sources. Failures are only logged:
+    the chunks are stored already and `cmd/rebuild_source_catalog.py` can catch up.
     """
-    collection = vector_store.collection
-    return [collection.find_one({"source": source}) is not None for source in source_name]
+    try:
+        get_source_catalog(app, secondary).refresh(source_names)
+    except Exception as e:
+        logger.error(f"Error refreshing source catalog: {e}")
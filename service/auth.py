@@ -1,21 +1,46 @@
 import secrets
+import threading
+import time
 from datetime import datetime
-from typing import Dict, List, Callable, Any
+from typing import Dict, List, Callable, Any, Tuple
 from sqlalchemy.orm import Session
-from db.postgres_models.authen import Authen  # Adjust this import according to your project structure
+from db.postgres_models.authen import Authen, hash_api_key  # Adjust this import according to your project structure
 
 
 class APIKeyManager:
-    def __init__(self, admin_key: str, session_factory: Callable[[], Session]) -> None:
+    def __init__(
+            self,
+            admin_key: str,
+            session_factory: Callable[[], Session],
+            cache_ttl: float = 300,
+            negative_cache_ttl: float = 30,
+            max_cache_entries: int = 10_000,
+    ) -> None:
         """
         Initialize the APIKeyManager with an admin key and a session factory.
+
+        Validation results are cached in memory by key hash: valid keys for
+        `cache_ttl` seconds, unknown or inactive keys for `negative_cache_ttl` seconds.
+        Revoking a key through this manager drops it from the cache immediately, and
+        a validation that read the key before the revocation does not cache it.
         
         Args:
             admin_key (str): The administrative key used for privileged operations.
             session_factory (Callable[[], Session]): A callable that returns a new SQLAlchemy Session.
+            cache_ttl (float, optional): Seconds a valid key is trusted without a query.
+            negative_cache_ttl (float, optional): Seconds an invalid key is rejected without a query.
+            max_cache_entries (int, optional): Cache size; it is cleared when full.
         """
         self.admin_key: str = admin_key
         self.session_factory: Callable[[], Session] = session_factory
+        self.cache_ttl = cache_ttl
+        self.negative_cache_ttl = negative_cache_ttl
+        self.max_cache_entries = max_cache_entries
+        self._cache: Dict[str, Tuple[bool, float]] = {}
+        # Revocations per key hash. A validation only caches its result when no
+        # revocation happened since it read this, i.e. while it queried the database.
+        self._revocations: Dict[str, int] = {}
+        self._cache_lock = threading.Lock()
 
     def generate_api_key(self, user: str, description: str = "") -> str:
         """
@@ -65,13 +90,32 @@ class APIKeyManager:
         Returns:
             bool: True if the key exists and is active, False otherwise.
         """
+        key_hash = hash_api_key(api_key)
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._cache.get(key_hash)
+            revocations = self._revocations.get(key_hash, 0)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
         session: Session = self.session_factory()
         try:
-            record: Authen = session.query(Authen).filter(Authen.key == api_key).first()
-            return record is not None and record.is_active
+            record: Authen = session.query(Authen).filter(Authen.key_hash == key_hash).first()
+            valid = record is not None and bool(record.is_active)
         finally:
             session.close()
 
+        ttl = self.cache_ttl if valid else self.negative_cache_ttl
+        with self._cache_lock:
+            if self._revocations.get(key_hash, 0) != revocations:
+                # Revoked while we were reading the row; do not cache what we read.
+                return valid
+            if len(self._cache) >= self.max_cache_entries:
+                # Only reachable by someone spraying random keys; start over.
+                self._cache.clear()
+            self._cache[key_hash] = (valid, now + ttl)
+        return valid
+
     def revoke_api_key(self, api_key: str) -> bool:
         """
         Revoke an API key in PostgreSQL by setting its `is_active` field to False.
@@ -84,12 +128,16 @@ class APIKeyManager:
         """
         session: Session = self.session_factory()
         try:
-            record: Authen = session.query(Authen).filter(Authen.key == api_key).first()
+            record: Authen = Authen.get_by_key(session, api_key)
             if record:
                 record.update(session, is_active=False)
                 return True
             return False
         finally:
+            key_hash = hash_api_key(api_key)
+            with self._cache_lock:
+                self._revocations[key_hash] = self._revocations.get(key_hash, 0) + 1
+                self._cache.pop(key_hash, None)
             session.close()
 
     def list_api_keys(self) -> List[Dict[str, Any]]:
@@ -1,41 +1,72 @@
+import asyncio
+import functools
 import logging
 import random
-from typing import Callable
+from typing import Callable, Dict, Optional
 from sqlalchemy.orm import Session
 import fastapi_poe as fp
-from together import Together
 from langchain_mongodb import MongoDBAtlasVectorSearch
-from db.postgres_models.conversation import Conversation
+from db.postgres_models.conversation import Conversation, ConversationTurn
 from db.postgres_models.reaction_feedback import Feedback
-from transformers import AutoTokenizer
+from db.lexical_index import LexicalIndex
+from db.write_behind import WriteBehindQueue
 
-from .health_check import HealthChecker
-from .prompt import build_messages, build_search_response, build_keyword_response, refine_search_results, SYSTEM_PROMPT, INTRODUCTION_MESSAGES, build_bot_summary, similarity_search, MESSAGE_TOO_SHORT, CONTEXT_LENGTH_EXCEEDED, HEALTH_CHECK_FAILED
+from . import metrics
+from .answer_cache import SemanticAnswerCache
+from .health_check import HealthMonitor
+from .llm import AsyncLLMClient
+from .routing import ModelRouter
+from .stages import StageTimer
+from .prompt import build_context_packer, build_messages, build_search_response, build_keyword_response, refine_search_results, SYSTEM_PROMPT, INTRODUCTION_MESSAGES, build_bot_summary, asimilarity_search, lexical_search, lexical_is_confident, fuse_results, build_search_query, RETRIEVAL_EXECUTOR, MESSAGE_TOO_SHORT, CONTEXT_LENGTH_EXCEEDED, HEALTH_CHECK_FAILED
 
 logger = logging.getLogger(__name__)
 
 OVERRIDE_MAX_TOKENS = 32769 * 95 // 100 - 2048
+SEARCH_LIMIT = 20
+
+
+def retrieval_metadata(search_query: str, search_results: list[dict], cached: bool) -> dict:
+    """What a turn stores about retrieval: the query and the ids of the results, not their text."""
+    return {
+        "query": search_query,
+        "cached": cached,
+        "results": [{"id": rs.get("id"), "source": rs.get("source"), "chunk_num": rs.get("chunk_num"),
+                     "score": rs.get("score")} for rs in search_results],
+    }
 
 
 class TipitakaAI(fp.PoeBot):
     def init(
             self,
             bot_name: str,
-            health_checker: HealthChecker,
+            health_monitor: HealthMonitor,
+            llm: AsyncLLMClient,
             vector_store: MongoDBAtlasVectorSearch,
             secondary_vector_store: MongoDBAtlasVectorSearch,
-            session_factory: Callable[[], Session]
+            session_factory: Callable[[], Session],
+            lexical_index: Optional[LexicalIndex] = None,
+            answer_cache: Optional[SemanticAnswerCache] = None,
+            write_behind: Optional[WriteBehindQueue] = None,
+            on_timings: Optional[Callable[[Dict[str, float]], None]] = None,
+            router: Optional[ModelRouter] = None
     ) -> None:
         self.bot_name = bot_name
-        self.together = Together()
-        self.health_checker = health_checker
+        self.llm = llm
+        self.health_monitor = health_monitor
         self.vector_store = vector_store
         self.secondary_vector_store = secondary_vector_store
         self.session_factory = session_factory
+        self.lexical_index = lexical_index
+        self.answer_cache = answer_cache
+        self.write_behind = write_behind
+        # Called with the stage durations (seconds) of every answered request.
+        self.on_timings = on_timings
         self.should_insert_attachment_messages = False
 
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            "Qwen/Qwen2.5-72B-Instruct", trust_remote_code=True)
+        self.router = router or ModelRouter()
+        # Search results are packed with the default model's tokenizer, and packed
+        # again when the request is routed to a model with another tokenizer.
+        self.tokenizer = self.router.tokenizer(self.router.default_model)
 
     async def get_settings(self, _: fp.SettingsRequest) -> fp.SettingsResponse:
         return fp.SettingsResponse(
@@ -44,27 +75,36 @@ class TipitakaAI(fp.PoeBot):
         )
 
     async def on_feedback(self, feedback_request: fp.ReportFeedbackRequest) -> None:
+        row = dict(
+            message_id=feedback_request.message_id,
+            user_id=feedback_request.user_id,
+            conversation_id=feedback_request.conversation_id,
+            feedback_type=feedback_request.feedback_type,
+            request=feedback_request.model_dump()
+        )
+        if self.write_behind is not None:
+            self.write_behind.submit(Feedback, row)
+            return
         session: Session = self.session_factory()
         try:
-            Feedback.upsert(
-                session,
-                message_id=feedback_request.message_id,
-                user_id=feedback_request.user_id,
-                conversation_id=feedback_request.conversation_id,
-                feedback_type=feedback_request.feedback_type,
-                request=feedback_request.model_dump()
-            )
+            Feedback.upsert(session, **row)
         except Exception as e:
             logger.error(f"Error updating feedback: {e}")
         finally:
             session.close()
 
     async def get_response(self, request: fp.QueryRequest):
+        timer = StageTimer()
+        loop = asyncio.get_running_loop()
+
         ######################################
         #### HEALTH CHECK ####################
         try:
-            self.health_checker.check_with_cache()
+            # Reads the snapshot published by the background monitor.
+            with timer.stage("health"):
+                self.health_monitor.check()
         except Exception as e:
+            metrics.count_response("health_check_failed")
             yield fp.ErrorResponse(text=HEALTH_CHECK_FAILED)
             return
 
@@ -77,24 +117,91 @@ class TipitakaAI(fp.PoeBot):
         user_messages = user_messages[-5:]  # Only keep the last 5 messages
 
         if len(user_messages[-1].strip().split()) < 10:
+            metrics.count_response("message_too_short")
             yield fp.PartialResponse(text=MESSAGE_TOO_SHORT, is_replace_response=True)
             return # Early return if the last message is too short
 
         # Filter out messages with less than 10 words
         user_messages = [msg for msg in user_messages if len(
             msg.strip().split()) >= 10]
+
+        # Start the stages that only depend on the user messages: the lexical probe
+        # and the tokenization of the fixed part of the prompt.
+        search_query = build_search_query(user_messages)
+        lexical = None
+        if self.lexical_index is not None:
+            lexical = asyncio.ensure_future(timer.timed("lexical", loop.run_in_executor(
+                RETRIEVAL_EXECUTOR, functools.partial(
+                    lexical_search, self.lexical_index, user_messages, limit=SEARCH_LIMIT))))
+        packer = asyncio.ensure_future(timer.timed("prepare_prompt", loop.run_in_executor(
+            RETRIEVAL_EXECUTOR, functools.partial(
+                build_context_packer, self.tokenizer, request.query, user_messages, override_max_tokens=OVERRIDE_MAX_TOKENS))))
+
         keyword_response = build_keyword_response(user_messages)
         last_bot_response = keyword_response
         yield fp.PartialResponse(text=keyword_response)
 
+        try:
+            lexical_results = await lexical if lexical is not None else None
+        except BaseException:
+            packer.cancel()
+            raise
+
+        # A confident lexical probe (e.g. a query naming a sutta) answers the search on
+        # its own: the query is never embedded, so the answer cache is skipped as well.
+        search = None
+        if lexical_results is not None and lexical_is_confident(lexical_results, SEARCH_LIMIT):
+            logger.debug(
+                f"Lexical search is confident ({lexical_results[0]['coverage']:.2f}), skipping embedding and vector search")
+        else:
+            # The vector search starts as soon as the query is embedded and overlaps
+            # the answer cache lookup; both read the embedding from CachedEmbeddings.
+            embedding = asyncio.ensure_future(timer.timed("embed", loop.run_in_executor(
+                RETRIEVAL_EXECUTOR, self.secondary_vector_store.embeddings.embed_query, search_query)))
+            search = asyncio.ensure_future(self.search(
+                timer, embedding, user_messages, lexical_results))
+
+        ######################################
+        #### CACHED ANSWER ###################
+        use_answer_cache = self.answer_cache is not None and search is not None
+        if use_answer_cache:
+            cache_generation = self.answer_cache.generation
+            # Does not raise; when the embedding failed the lookup embeds again.
+            await asyncio.wait([embedding])
+            try:
+                cached = await timer.timed("answer_cache", loop.run_in_executor(
+                    RETRIEVAL_EXECUTOR, self.answer_cache.lookup, search_query))
+            except Exception as e:
+                cached = None
+                logger.error(f"Error looking up answer cache: {e}")
+            if cached is not None:
+                search.cancel()
+                packer.cancel()
+                logger.info(
+                    f"Answer cache hit ({cached['similarity']:.3f}): {cached['query']!r}")
+                # The summary quotes the question; rebuild it with this user's wording.
+                response = cached['search_response'] + build_bot_summary(
+                    question=user_messages[-1].strip(), **cached['summary']) + cached['answer']
+                last_bot_response += response
+                yield fp.PartialResponse(text=response)
+                with timer.stage("save"):
+                    self.save_conversation(request, last_bot_response, retrieval_metadata(
+                        search_query, cached['search_results'], cached=True))
+                metrics.count_response("cached")
+                self.report_timings(timer)
+                return
+
         ######################################
         #### PRINT SEARCH RESULTS ############
-        search_results = similarity_search(
-            vector_store=self.secondary_vector_store,
-            user_messages=user_messages,
-            limit=20
-        )
+        try:
+            search_results = lexical_results if search is None else await search
+        except BaseException:
+            search.cancel()
+            packer.cancel()
+            raise
         refine_search_results(search_results)
+        retrieval = retrieval_metadata(
+            search_query, search_results, cached=False)
         search_response = build_search_response(
             search_results, without_quote=False)
         last_bot_response += search_response
@@ -102,55 +209,136 @@ class TipitakaAI(fp.PoeBot):
 
         ######################################
         #### BOT RESPONSE ####################
-        messages, num_results, with_half_content = build_messages(
-            self.tokenizer, request.query, user_messages, search_results, override_max_tokens=OVERRIDE_MAX_TOKENS)
+        context_packer, max_tokens = await packer
+        messages, num_results, with_half_content = await timer.timed("pack", loop.run_in_executor(
+            RETRIEVAL_EXECUTOR, context_packer.pack, search_results, max_tokens))
+
+        model, reason = self.router.route(context_packer.packed_tokens)
+        if not self.router.same_tokenizer(model, self.router.default_model):
+            try:
+                messages, num_results, with_half_content = await timer.timed("repack", loop.run_in_executor(
+                    RETRIEVAL_EXECUTOR, lambda: build_messages(
+                        self.router.tokenizer(model), request.query, user_messages, search_results, override_max_tokens=OVERRIDE_MAX_TOKENS)))
+            except Exception as e:
+                logger.error(
+                    f"Error packing for {model}, using {self.router.default_model}: {e}")
+                model, reason = self.router.default_model, "repack_failed"
+        self.router.record(model, reason)
+        logger.info(
+            f"Routing to {model} ({reason}, {context_packer.packed_tokens} prompt tokens)")
 
+        # Stays "cancelled" when Poe closes the stream before the answer is complete.
+        outcome = "cancelled"
         try:
             if messages is None:
                 raise Exception("Context too long")
 
-            bot_summary_msg = build_bot_summary(
-                question=user_messages[-1].strip(),
+            summary = dict(
                 num_results=num_results,
                 with_half_content=with_half_content,
                 total_results=len(search_results)
             )
+            bot_summary_msg = build_bot_summary(
+                question=user_messages[-1].strip(), **summary)
             last_bot_response += bot_summary_msg
             yield fp.PartialResponse(text=bot_summary_msg)
 
-            stream = self.together.chat.completions.create(
-                model="Qwen/Qwen2.5-72B-Instruct-Turbo",
-                temperature=0.5,
-                messages=messages,
-                stream=True
-            )
+            answer = ""
+            with timer.stage("llm"), self.router.track(model) as generation:
+                async for text in self.llm.stream_chat(
+                    model=model,
+                    temperature=0.5,
+                    messages=messages
+                ):
+                    if "first_token" not in timer.timings:
+                        timer.mark("first_token")
+                        generation.token()
+                    yield fp.PartialResponse(text=text)
+                    last_bot_response += text
+                    answer += text
 
-            for chunk in stream:
-                if chunk.choices:
-                    yield fp.PartialResponse(text=chunk.choices[0].delta.content or "")
-                    last_bot_response += chunk.choices[0].delta.content or ""
+            if use_answer_cache:
+                try:
+                    # Normally the query embedding is in CachedEmbeddings since the
+                    # lookup; if that embedding failed, `store` calls the provider.
+                    await loop.run_in_executor(RETRIEVAL_EXECUTOR, functools.partial(
+                        self.answer_cache.store, search_query, search_response, summary, answer,
+                        search_results, cache_generation))
+                except Exception as e:
+                    logger.error(f"Error storing answer in cache: {e}")
+            outcome = "answered"
 
         except Exception as e:
+            outcome = "context_length_exceeded" if messages is None else "llm_error"
             last_bot_response += "\n" + CONTEXT_LENGTH_EXCEEDED
             yield fp.ErrorResponse(text=CONTEXT_LENGTH_EXCEEDED, allow_retry=False)
             logger.error(f"Error getting response: {e}")
 
         finally:
-            conversation_id: str = request.conversation_id
-            try:
-                session: Session = self.session_factory()
-                request.api_key = "<poe_api_key>"
-                request.access_key = "<poe_access_key>"
-                Conversation.upsert(
-                    session,
-                    conversation_id=conversation_id,
-                    system_prompt=SYSTEM_PROMPT,
-                    last_bot_response=last_bot_response,
-                    request=request.model_dump(),
-                    sender_id=request.user_id
-                )
-            except Exception as e:
-                logger.error(
-                    f"Error updating conversation {conversation_id}: {e}")
-            finally:
-                session.close()
+            # With the write-behind queue this only measures the submit; the queue
+            # reports its flushes through its own `on_flush`.
+            with timer.stage("save"):
+                self.save_conversation(request, last_bot_response, retrieval)
+            metrics.count_response(outcome)
+            self.report_timings(timer, model)
+
+    async def search(self, timer: StageTimer, embedding: asyncio.Future, user_messages: list[str], lexical_results: Optional[list[dict]]) -> list[dict]:
+        """Vector search once `embedding` is done, fused with `lexical_results` when given."""
+        try:
+            await embedding
+        except Exception as e:
+            # The search embeds the query again and reports the error if it persists.
+            logger.error(f"Error embedding search query: {e}")
+        vector_results = await timer.timed("search", asimilarity_search(
+            vector_store=self.secondary_vector_store,
+            user_messages=user_messages,
+            limit=SEARCH_LIMIT
+        ))
+        if lexical_results is None:
+            return vector_results
+        return fuse_results(vector_results, lexical_results, SEARCH_LIMIT)
+
+    def report_timings(self, timer: StageTimer, model: Optional[str] = None) -> None:
+        timer.mark("total")
+        logger.info(f"Stages: {timer.summary()}")
+        metrics.observe_timings(timer.timings, model)
+        if self.on_timings is not None:
+            self.on_timings(timer.timings)
+
+    def save_conversation(self, request: fp.QueryRequest, last_bot_response: str, retrieval: Optional[dict] = None) -> None:
+        """
+        Update the conversation and append the current turn. The request itself, which
+        carries the whole history, is not stored; `ConversationTurn.history` rebuilds it.
+        """
+        conversation_id: str = request.conversation_id
+        user_queries = [query for query in request.query if query.role == "user"]
+        user_query = user_queries[-1]
+        conversation = dict(
+            conversation_id=conversation_id,
+            system_prompt=SYSTEM_PROMPT,
+            last_bot_response=last_bot_response,
+            sender_id=request.user_id
+        )
+        turn = dict(
+            conversation_id=conversation_id,
+            message_id=user_query.message_id or request.message_id,
+            turn_index=len(user_queries) - 1,
+            sender_id=request.user_id,
+            user_message=user_query.content,
+            bot_response=last_bot_response,
+            retrieval=retrieval
+        )
+        if self.write_behind is not None:
+            # Persisted by the queue's thread; the response stream never waits on Postgres.
+            self.write_behind.submit(Conversation, conversation)
+            self.write_behind.submit(ConversationTurn, turn)
+            return
+        session: Session = self.session_factory()
+        try:
+            Conversation.upsert(session, **conversation)
+            ConversationTurn.bulk_upsert(session, [turn])
+        except Exception as e:
+            logger.error(
+                f"Error updating conversation {conversation_id}: {e}")
+        finally:
+            session.close()
@@ -0,0 +1,226 @@
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+_WHITESPACE_RE = re.compile(r"\s+")
+# A disk hit only refreshes `accessed_at` when it is older than this; eviction order
+# does not need more precision, and it saves a write on most hits.
+ACCESS_UPDATE_INTERVAL = 3600.0
+# Keys per `IN (...)` query, below SQLite's bound parameter limit.
+QUERY_BATCH_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalize text before it is used as a cache key.
+
+    Vietnamese input arrives both precomposed (NFC) and decomposed (NFD, e.g. from
+    macOS keyboards), and Poe messages often differ only in whitespace, so both are
+    folded here.
+    """
+    return _WHITESPACE_RE.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Two-tier cache in front of an `Embeddings` model.
+
+    - Tier 1: in-process LRU of float32 vectors, bounded by `max_memory_bytes`.
+    - Tier 2: SQLite file on disk, bounded by `max_disk_bytes`; the least recently
+      used rows are evicted first.
+
+    Keys are the SHA-256 of `namespace` plus the normalized text, so vectors of
+    different embedding models never mix.
+
+    The memory tier and the SQLite connection have separate locks, so memory hits of
+    bot queries never wait for the disk writes of a large ingestion.
+    """
+
+    def __init__(
+            self,
+            underlying: Embeddings,
+            path: str,
+            namespace: str,
+            max_memory_bytes: int = 64 * 1024 * 1024,
+            max_disk_bytes: int = 1024 * 1024 * 1024,
+    ) -> None:
+        self.underlying = underlying
+        self.path = path
+        self.namespace = namespace
+        self.max_memory_bytes = max_memory_bytes
+        self.max_disk_bytes = max_disk_bytes
+
+        # `_lock` guards the memory tier and the counters, `_db_lock` the connection.
+        self._lock = threading.Lock()
+        self._db_lock = threading.Lock()
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_bytes = 0
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.memory_evictions = 0
+        self.disk_evictions = 0
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, "
+            "size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS embedding__accessed_at ON embedding (accessed_at)")
+        self._conn.commit()
+        self._disk_bytes = self._conn.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM embedding").fetchone()[0]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        vectors = self._get(keys)
+
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            computed = self.underlying.embed_documents(
+                [texts[i] for i in missing])
+            stored = self._put([keys[i] for i in missing], computed)
+            for i, vector in zip(missing, stored):
+                vectors[i] = vector
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self._get([key])[0]
+        if vector is None:
+            vector = self._put([key], [self.underlying.embed_query(text)])[0]
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        with self._db_lock:
+            disk_bytes = self._disk_bytes
+        with self._lock:
+            return {
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "memory_evictions": self.memory_evictions,
+                "disk_evictions": self.disk_evictions,
+                "memory_items": len(self._memory),
+                "memory_bytes": self._memory_bytes,
+                "disk_bytes": disk_bytes,
+            }
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(
+            f"{self.namespace}\x00{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _get(self, keys: List[str]) -> List[Optional[List[float]]]:
+        blobs: Dict[str, bytes] = {}
+        with self._lock:
+            for key in keys:
+                blob = self._memory.get(key)
+                if blob is not None:
+                    self._memory.move_to_end(key)
+                    blobs[key] = blob
+            self.memory_hits += len(blobs)
+        missing = [key for key in dict.fromkeys(keys) if key not in blobs]
+
+        if missing:
+            found = self._read_disk(missing)
+            blobs.update(found)
+            with self._lock:
+                self.disk_hits += len(found)
+                self.misses += len(missing) - len(found)
+                for key, blob in found.items():
+                    self._remember(key, blob)
+        return [_decode(blobs[key]) if key in blobs else None for key in keys]
+
+    def _read_disk(self, keys: List[str]) -> Dict[str, bytes]:
+        now = time.time()
+        found: Dict[str, bytes] = {}
+        stale = []
+        with self._db_lock:
+            for start in range(0, len(keys), QUERY_BATCH_SIZE):
+                batch = keys[start:start + QUERY_BATCH_SIZE]
+                rows = self._conn.execute(
+                    f"SELECT key, vector, accessed_at FROM embedding WHERE key IN ({','.join('?' * len(batch))})",
+                    batch).fetchall()
+                for key, blob, accessed_at in rows:
+                    found[key] = blob
+                    if now - accessed_at > ACCESS_UPDATE_INTERVAL:
+                        stale.append((now, key))
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embedding SET accessed_at = ? WHERE key = ?", stale)
+                self._conn.commit()
+        return found
+
+    def _put(self, keys: List[str], vectors: List[List[float]]) -> List[List[float]]:
+        """Store the vectors of `keys`, all in one transaction."""
+        blobs = [array("f", vector).tobytes() for vector in vectors]
+        now = time.time()
+        with self._db_lock:
+            for key, blob in zip(keys, blobs):
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO embedding (key, vector, size, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, blob, len(blob), now)
+                )
+                self._disk_bytes += len(blob) * cursor.rowcount
+            if self._disk_bytes > self.max_disk_bytes:
+                self._evict_disk()
+            self._conn.commit()
+        with self._lock:
+            for key, blob in zip(keys, blobs):
+                self._remember(key, blob)
+        # Return the float32 round-tripped vectors so memory, disk and fresh hits agree.
+        return [_decode(blob) for blob in blobs]
+
+    def _remember(self, key: str, blob: bytes) -> None:
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            return
+        self._memory[key] = blob
+        self._memory_bytes += len(blob)
+        while self._memory_bytes > self.max_memory_bytes and self._memory:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= len(evicted)
+            self.memory_evictions += 1
+
+    def _evict_disk(self) -> None:
+        # Evict down to 90% so we do not run an eviction on every insert.
+        target = self.max_disk_bytes * 9 // 10
+        rows = self._conn.execute(
+            "SELECT key, size FROM embedding ORDER BY accessed_at").fetchall()
+        stale = []
+        for key, size in rows:
+            if self._disk_bytes <= target:
+                break
+            stale.append((key,))
+            self._disk_bytes -= size
+        self._conn.executemany("DELETE FROM embedding WHERE key = ?", stale)
+        with self._lock:
+            self.disk_evictions += len(stale)
+        logger.info(
+            f"Evicted {len(stale)} cached embeddings, disk usage {self._disk_bytes} bytes")
+
+
+def _decode(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
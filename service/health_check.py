@@ -1,8 +1,11 @@
+import asyncio
 import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from sqlalchemy import text, Engine
 from pymongo import MongoClient
-from typing import Optional
+from typing import Any, Callable, Dict, Iterable, Optional
 
 logger = logging.getLogger(__name__)
 
@@ -32,11 +35,16 @@ class HealthChecker:
                 raise RuntimeError(f"Health check failed: {e}")
 
     def check(self) -> None:
+        self.check_mongodb()
+        self.check_postgres()
+
+    def check_mongodb(self) -> None:
         try:
             self.mongodb_client.server_info()
         except Exception as e:
             raise RuntimeError(f"MongoDB health check failed: {e}")
 
+    def check_postgres(self) -> None:
         try:
             with self.pg_engine.connect() as connection:
                 result = connection.execute(text("SELECT 1")).scalar()
@@ -45,3 +53,122 @@ class HealthChecker:
                         "PostgreSQL health check returned unexpected result")
         except Exception as e:
             raise RuntimeError(f"PostgreSQL health check failed: {e}")
+
+    def probes(self) -> Dict[str, Callable[[], None]]:
+        return {"mongodb": self.check_mongodb, "postgres": self.check_postgres}
+
+
+class HealthMonitor:
+    """
+    Runs health probes in the background and publishes the result as a snapshot, so
+    that request handlers and `/health` only read an attribute.
+
+    Every `interval` seconds (`failure_interval` while unhealthy) all probes run
+    concurrently in a dedicated thread pool, each bounded by `timeout`. A probe that
+    is still running from an earlier round (e.g. a hung connection) is not started
+    again and counts as failed. Failing `optional` probes make the status "degraded"
+    instead of "unhealthy". A snapshot older than `max_age` is reported as unhealthy,
+    which covers a monitor task that stopped.
+    """
+
+    def __init__(
+            self,
+            probes: Dict[str, Callable[[], Any]],
+            optional: Iterable[str] = (),
+            interval: float = 30.0,
+            failure_interval: float = 5.0,
+            timeout: float = 5.0,
+    ) -> None:
+        self.probes = probes
+        self.optional = set(optional)
+        self.interval = interval
+        self.failure_interval = failure_interval
+        self.timeout = timeout
+        self.max_age = 3 * interval + timeout
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=len(probes), thread_name_prefix="health-probe")
+        self._running: Dict[str, asyncio.Future] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._checked_at = time.monotonic()
+        self.snapshot: Dict[str, Any] = {
+            "status": "starting", "checked_at": None, "probes": {}}
+
+    async def start(self) -> None:
+        """Run a first round of probes, then keep probing in the background."""
+        if self._task is not None:
+            return
+        await self.probe_all()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def status(self) -> Dict[str, Any]:
+        if self.snapshot["status"] != "starting" and time.monotonic() - self._checked_at > self.max_age:
+            return {**self.snapshot, "status": "unhealthy", "error": "Health status is stale"}
+        return self.snapshot
+
+    def check(self) -> None:
+        """Raise if the last published status is unhealthy."""
+        status = self.status()
+        if status["status"] == "unhealthy":
+            failed = [f"{name}: {probe['error']}" for name, probe in status["probes"].items()
+                      if not probe["ok"] and name not in self.optional]
+            raise RuntimeError(
+                f"Health check failed: {'; '.join(failed) or status.get('error')}")
+
+    async def probe_all(self) -> Dict[str, Any]:
+        names = list(self.probes)
+        results = await asyncio.gather(*(self._probe(name) for name in names))
+        probes = dict(zip(names, results))
+        if any(not probes[name]["ok"] for name in names if name not in self.optional):
+            status = "unhealthy"
+        elif all(probe["ok"] for probe in probes.values()):
+            status = "healthy"
+        else:
+            status = "degraded"
+        if status != self.snapshot["status"]:
+            errors = {name: probe["error"]
+                      for name, probe in probes.items() if not probe["ok"]}
+            log = logger.info if status == "healthy" else logger.warning
+            log(f"Health status: {status} {errors}")
+        # Replaced in one assignment; readers never see a half-updated snapshot.
+        self.snapshot = {"status": status,
+                         "checked_at": datetime.utcnow().isoformat(), "probes": probes}
+        self._checked_at = time.monotonic()
+        return self.snapshot
+
+    async def _probe(self, name: str) -> Dict[str, Any]:
+        started = time.perf_counter()
+        running = self._running.get(name)
+        if running is not None and not running.done():
+            return {"ok": False, "error": "Previous probe still running", "latency_ms": None}
+        future = asyncio.get_running_loop().run_in_executor(
+            self._executor, self.probes[name])
+        self._running[name] = future
+        try:
+            await asyncio.wait_for(asyncio.shield(future), self.timeout)
+            error = None
+        except asyncio.TimeoutError:
+            error = f"Timed out after {self.timeout}s"
+        except Exception as e:
+            error = str(e)
+        return {"ok": error is None, "error": error,
+                "latency_ms": round((time.perf_counter() - started) * 1000, 1)}
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.interval if self.snapshot["status"] != "unhealthy" else self.failure_interval)
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Error running health probes: {e}")
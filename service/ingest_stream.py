@@ -0,0 +1,299 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import uuid
+import zlib
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, Optional
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from langchain_mongodb import MongoDBAtlasVectorSearch
+from db.lexical_index import LexicalIndex
+
+from .tokenizer import count_tokens_batch, tokenizer_name
+
+logger = logging.getLogger(__name__)
+
+# Chunks per embedding request and number of requests in flight. Together with the
+# bounded queues below they cap memory at a few batches, whatever the upload size.
+EMBED_BATCH_SIZE = int(os.environ.get("INGEST_EMBED_BATCH_SIZE", "64"))
+EMBED_CONCURRENCY = int(os.environ.get("INGEST_EMBED_CONCURRENCY", "4"))
+# A single NDJSON line (one source) larger than this is rejected.
+MAX_LINE_BYTES = 64 * 1024 * 1024
+
+_GZIP_MAGIC = b"\x1f\x8b"
+# Namespace of the uuid5 chunk ids; changing it re-embeds the whole corpus.
+CHUNK_ID_NAMESPACE = uuid.UUID("6f1c1a52-4b7e-4c55-9d57-3b8f5e0f2a91")
+# `$in` lists are split so that queries stay well below the 16 MB BSON limit.
+ID_QUERY_BATCH_SIZE = 1000
+DUPLICATE_KEY_ERROR = 11000
+
+
+def chunk_source(source_name: str, content: str, slice: int = 0) -> list[tuple[str, Dict[str, Any]]]:
+    """
+    Split one source into `(text, metadata)` pairs the way `/sources/upload` stores
+    them: 1000-character chunks with a `chunk_num` when `slice`, the whole text otherwise.
+    """
+    if slice > 0:
+        # Only uploads split text; loaded on first use to keep it out of startup.
+        from langchain.text_splitter import RecursiveCharacterTextSplitter
+        text_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=1000, chunk_overlap=100)
+        return [(chunk, {"source": source_name, "chunk_num": i})
+                for i, chunk in enumerate(text_splitter.split_text(content))]
+    return [(content, {"source": source_name})]
+
+
+def chunk_ids(chunks: list[tuple[str, Dict[str, Any]]], occurrences: Optional[Dict[tuple[str, bytes], int]] = None) -> list[str]:
+    """
+    Content-addressed ids: uuid5 of source name and chunk text, plus an occurrence
+    number for text repeated within a source. Re-uploading unchanged text yields the
+    same ids, whatever position the chunk moved to. Pass the same `occurrences` to
+    every call when the chunks of a source arrive in several parts.
+    """
+    if occurrences is None:
+        occurrences = {}
+    ids = []
+    for text, metadata in chunks:
+        key = (metadata["source"], hashlib.sha1(text.encode("utf-8")).digest())
+        occurrence = occurrences.get(key, 0)
+        occurrences[key] = occurrence + 1
+        ids.append(str(uuid.uuid5(
+            CHUNK_ID_NAMESPACE, f"{metadata['source']}\x00{occurrence}\x00{text}")))
+    return ids
+
+
+def find_existing_chunks(collection: Collection, ids: list[str]) -> Dict[str, Optional[int]]:
+    """Return `{id: chunk_num}` for the ids already stored in `collection`."""
+    existing = {}
+    for start in range(0, len(ids), ID_QUERY_BATCH_SIZE):
+        for doc in collection.find({"_id": {"$in": ids[start:start + ID_QUERY_BATCH_SIZE]}}, {"chunk_num": 1}):
+            existing[doc["_id"]] = doc.get("chunk_num")
+    return existing
+
+
+def move_chunks(collection: Collection, chunks: Iterable[tuple[str, Dict[str, Any]]], existing: Dict[str, Optional[int]]) -> int:
+    """Update `chunk_num` in place for stored chunks `(id, metadata)` whose position changed."""
+    updates = [UpdateOne({"_id": id}, {"$set": {"chunk_num": metadata["chunk_num"]}})
+               for id, metadata in chunks
+               if id in existing and "chunk_num" in metadata and existing[id] != metadata["chunk_num"]]
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def insert_new_chunks(collection: Collection, docs: list[Dict[str, Any]]) -> list[str]:
+    """
+    Insert `docs` and return the ids that were inserted. Ids that are already stored,
+    e.g. by a concurrent upload of the same content, are left as they are.
+    """
+    try:
+        collection.insert_many(docs, ordered=False)
+        return [doc["_id"] for doc in docs]
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error["code"] != DUPLICATE_KEY_ERROR for error in errors):
+            raise
+        duplicates = {docs[error["index"]]["_id"] for error in errors}
+        return [doc["_id"] for doc in docs if doc["_id"] not in duplicates]
+
+
+def delete_stale_chunks(collection: Collection, source_name: str, keep_ids: set[str]) -> list[str]:
+    """Delete the chunks of `source_name` that are not in `keep_ids`; return their ids."""
+    stale = [doc["_id"] for doc in collection.find({"source": source_name}, {"_id": 1})
+             if doc["_id"] not in keep_ids]
+    for start in range(0, len(stale), ID_QUERY_BATCH_SIZE):
+        collection.delete_many(
+            {"_id": {"$in": stale[start:start + ID_QUERY_BATCH_SIZE]}})
+    return stale
+
+
+async def ndjson_lines(body: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """
+    Yield the non-empty lines of an NDJSON byte stream, transparently gunzipping it
+    when it starts with the gzip magic number.
+    """
+    decompressor = None
+    buffer = b""
+    first = True
+    async for data in body:
+        if first and data:
+            first = False
+            if data.startswith(_GZIP_MAGIC):
+                decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if decompressor is not None:
+            data = decompressor.decompress(data)
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        if len(buffer) > MAX_LINE_BYTES:
+            raise ValueError(f"NDJSON line exceeds {MAX_LINE_BYTES} bytes")
+        for line in lines:
+            if line.strip():
+                yield line
+    if decompressor is not None:
+        buffer += decompressor.flush()
+    if buffer.strip():
+        yield buffer
+
+
+async def ingest_stream(
+        body: AsyncIterator[bytes],
+        vector_store: MongoDBAtlasVectorSearch,
+        slice: int = 0,
+        tokenizer=None,
+        lexical_index: Optional[LexicalIndex] = None,
+        on_batch: Optional[Callable[[list[str]], None]] = None,
+        replace: bool = False,
+        batch_size: int = EMBED_BATCH_SIZE,
+        concurrency: int = EMBED_CONCURRENCY,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Ingest an NDJSON stream of `{"source_name": ..., "content": ...}` objects.
+
+    Sources are chunked as they arrive, embedded in batches of `batch_size` with up
+    to `concurrency` requests in flight, and written to MongoDB one batch at a time,
+    so a failure only loses the batches that were not written yet. Chunks already
+    stored under the same content-addressed id are not embedded again; with
+    `replace`, chunks of the uploaded sources that are no longer present are deleted
+    once the whole stream was ingested. A source may span several lines; its chunks
+    are numbered across them and `done` is only sent once the whole body was read.
+    Yields progress events (`source`, `progress`, `done`, `error`, `complete`) as dicts.
+    """
+    loop = asyncio.get_running_loop()
+    embeddings = vector_store.embeddings
+    collection = vector_store.collection
+    batches: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    writes: asyncio.Queue = asyncio.Queue(maxsize=concurrency)
+    events: asyncio.Queue = asyncio.Queue()
+    totals: Dict[str, int] = {}
+    written: Dict[str, int] = {}
+    source_ids: Dict[str, set[str]] = {}
+    occurrences: Dict[tuple[str, bytes], int] = {}
+    chunk_counts: Dict[str, int] = {}
+    done: set[str] = set()
+    read_all = asyncio.Event()
+    stats = {"skipped": 0, "moved": 0, "deleted": 0, "duplicates": 0}
+
+    async def finish(source_name: str):
+        # Later lines may still add chunks to a source until the whole body was read.
+        if read_all.is_set() and source_name not in done and written[source_name] == totals[source_name]:
+            done.add(source_name)
+            await events.put({"event": "done", "source": source_name})
+
+    async def read():
+        batch = []
+        async for line in ndjson_lines(body):
+            source = json.loads(line)
+            source_name, content = source["source_name"], source["content"]
+            chunks = chunk_source(source_name, content, slice)
+            # Continue the numbering of earlier lines of the same source.
+            offset = chunk_counts.get(source_name, 0)
+            chunk_counts[source_name] = offset + len(chunks)
+            for _, metadata in chunks:
+                if "chunk_num" in metadata:
+                    metadata["chunk_num"] += offset
+            ids = chunk_ids(chunks, occurrences)
+            # Ids already queued by this stream would fail the insert as duplicates.
+            queued = source_ids.setdefault(source_name, set())
+            new = [(id, text, metadata) for id, (text, metadata) in zip(ids, chunks)
+                   if id not in queued]
+            stats["duplicates"] += len(chunks) - len(new)
+            queued.update(id for id, _, _ in new)
+            totals[source_name] = totals.get(source_name, 0) + len(new)
+            written.setdefault(source_name, 0)
+            await events.put({"event": "source", "source": source_name, "chunks": len(new)})
+            for item in new:
+                batch.append(item)
+                if len(batch) >= batch_size:
+                    await batches.put(batch)
+                    batch = []
+        read_all.set()
+        for source_name in totals:
+            await finish(source_name)
+        if batch:
+            await batches.put(batch)
+        for _ in range(concurrency):
+            await batches.put(None)
+
+    async def embed():
+        while (batch := await batches.get()) is not None:
+            existing = await loop.run_in_executor(
+                None, find_existing_chunks, collection, [id for id, _, _ in batch])
+            stats["moved"] += await loop.run_in_executor(
+                None, move_chunks, collection, [(id, metadata) for id, _, metadata in batch], existing)
+            stats["skipped"] += len(existing)
+            new = [item for item in batch if item[0] not in existing]
+            texts = [text for _, text, _ in new]
+            vectors = await embeddings.aembed_documents(texts) if texts else []
+            if tokenizer is not None and texts:
+                token_counts = await loop.run_in_executor(None, count_tokens_batch, tokenizer, texts)
+                for (_, _, metadata), token_count in zip(new, token_counts):
+                    metadata["token_count"] = token_count
+                    metadata["tokenizer"] = tokenizer_name(tokenizer)
+            await writes.put((batch, new, vectors))
+        await writes.put(None)
+
+    async def write():
+        finished = 0
+        while finished < concurrency:
+            item = await writes.get()
+            if item is None:
+                finished += 1
+                continue
+            batch, new, vectors = item
+            docs = [{"_id": id, "text": text, "embedding": vector, **metadata}
+                    for (id, text, metadata), vector in zip(new, vectors)]
+            if docs:
+                ids = await loop.run_in_executor(None, insert_new_chunks, collection, docs)
+                stats["skipped"] += len(docs) - len(ids)
+                inserted = set(ids)
+                docs = [doc for doc in docs if doc["_id"] in inserted]
+                if lexical_index is not None and docs:
+                    await loop.run_in_executor(None, lexical_index.add, [
+                        {"id": doc["_id"], "text": doc["text"], "source": doc["source"], "chunk_num": doc.get("chunk_num")} for doc in docs])
+                if on_batch is not None and ids:
+                    await loop.run_in_executor(None, on_batch, ids)
+
+            counts: Dict[str, int] = {}
+            for _, _, metadata in batch:
+                counts[metadata["source"]] = counts.get(
+                    metadata["source"], 0) + 1
+            for source_name, count in counts.items():
+                written[source_name] += count
+                await events.put({"event": "progress", "source": source_name,
+                                  "written": written[source_name], "total": totals[source_name]})
+                await finish(source_name)
+
+    async def delete_stale():
+        for source_name, ids in source_ids.items():
+            stale = await loop.run_in_executor(None, delete_stale_chunks, collection, source_name, ids)
+            if stale and lexical_index is not None:
+                await loop.run_in_executor(None, lexical_index.delete, stale)
+            stats["deleted"] += len(stale)
+
+    async def run():
+        try:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(read())
+                for _ in range(concurrency):
+                    group.create_task(embed())
+                group.create_task(write())
+            if replace:
+                await delete_stale()
+        except* Exception as errors:
+            for error in errors.exceptions:
+                logger.error(f"Error ingesting stream: {error}")
+                await events.put({"event": "error", "detail": str(error)})
+        await events.put(None)
+
+    runner = asyncio.create_task(run())
+    try:
+        while (event := await events.get()) is not None:
+            yield event
+        yield {"event": "complete", "sources": len(totals), "written": sum(written.values()),
+               "chunks": sum(totals.values()), **stats}
+    finally:
+        runner.cancel()
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, AsyncIterator, Dict, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+
+
+class AsyncLLMClient:
+    """
+    Streaming client for OpenAI-compatible chat completion APIs (Together by default).
+
+    All requests share one pooled `httpx.AsyncClient`, so tokens are read without
+    blocking the event loop and connections are reused across conversations. At most
+    `max_concurrency` generations run at once; further requests wait for a slot.
+    """
+
+    def __init__(
+            self,
+            api_key: Optional[str] = None,
+            base_url: str = TOGETHER_BASE_URL,
+            max_concurrency: int = 32,
+            timeout: float = 120.0,
+    ) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._client = httpx.AsyncClient(
+            base_url=self.base_url,
+            headers={"Authorization": f"Bearer {api_key or os.environ.get('TOGETHER_API_KEY', '')}"},
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(max_connections=max_concurrency,
+                                max_keepalive_connections=max_concurrency),
+        )
+        self.active = 0
+        self.waiting = 0
+
+    async def stream_chat(self, model: str, messages: list[Dict[str, Any]], **params) -> AsyncIterator[str]:
+        """Yield the content deltas of a streamed chat completion."""
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+        try:
+            payload = {"model": model, "messages": messages,
+                       "stream": True, **params}
+            async with self._client.stream("POST", "/chat/completions", json=payload) as response:
+                if response.status_code != 200:
+                    body = await response.aread()
+                    raise RuntimeError(
+                        f"LLM request failed with status {response.status_code}: {body[:500].decode(errors='replace')}")
+                async for line in response.aiter_lines():
+                    if not line.startswith("data:"):
+                        continue
+                    data = line[len("data:"):].strip()
+                    if data == "[DONE]":
+                        break
+                    chunk = json.loads(data)
+                    if chunk.get("error"):
+                        raise RuntimeError(f"LLM stream failed: {chunk['error']}")
+                    for choice in chunk.get("choices") or []:
+                        content = (choice.get("delta") or {}).get("content")
+                        if content:
+                            yield content
+        finally:
+            self.active -= 1
+            self._semaphore.release()
+
+    def probe(self) -> None:
+        """Blocking check that the API is reachable and accepts the key (for `HealthMonitor`)."""
+        httpx.get(f"{self.base_url}/models", headers={"Authorization": self._client.headers["Authorization"]},
+                  timeout=10.0).raise_for_status()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.active, "waiting": self.waiting, "max_concurrency": self.max_concurrency}
+
+    async def aclose(self) -> None:
+        await self._client.aclose()
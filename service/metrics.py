@@ -0,0 +1,108 @@
+from typing import Dict, Optional
+
+from prometheus_client import CONTENT_TYPE_LATEST, Counter, Gauge, Histogram, generate_latest
+
+from db.write_behind import WriteBehindQueue
+
+from .llm import AsyncLLMClient
+
+# Sub-second buckets for the retrieval and packing stages, seconds for the LLM.
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 3.0, 5.0, 7.5,
+               10.0, 15.0, 20.0, 30.0, 45.0, 60.0, 90.0, 120.0)
+
+STAGE_SECONDS = Histogram(
+    "tipitaka_stage_seconds",
+    "Duration of a stage of a bot response: health, lexical, embed, answer_cache, search, "
+    "prepare_prompt, pack, repack or save.",
+    ["stage"], buckets=STAGE_BUCKETS)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "tipitaka_llm_first_token_seconds",
+    "Time from the start of a bot response to the first LLM token.",
+    ["model"], buckets=LLM_BUCKETS)
+LLM_GENERATION_SECONDS = Histogram(
+    "tipitaka_llm_generation_seconds",
+    "Duration of the LLM completion stream.",
+    ["model"], buckets=LLM_BUCKETS)
+RESPONSE_SECONDS = Histogram(
+    "tipitaka_response_seconds",
+    "Duration of a bot response, from the health check to the saved conversation.",
+    buckets=LLM_BUCKETS)
+RESPONSES = Counter(
+    "tipitaka_responses_total",
+    "Bot responses by outcome: answered, cached, message_too_short, "
+    "context_length_exceeded, llm_error, health_check_failed or cancelled.",
+    ["outcome"])
+
+WRITE_BEHIND_FLUSH_SECONDS = Histogram(
+    "tipitaka_write_behind_flush_seconds",
+    "Duration of a write-behind flush to Postgres.",
+    buckets=STAGE_BUCKETS)
+WRITE_BEHIND_ROWS = Counter(
+    "tipitaka_write_behind_rows_total",
+    "Rows written to Postgres by the write-behind queue.")
+WRITE_BEHIND_QUEUED = Gauge(
+    "tipitaka_write_behind_queued",
+    "Rows waiting in the write-behind queue.")
+LLM_ACTIVE = Gauge(
+    "tipitaka_llm_active_streams",
+    "LLM completion streams in progress.")
+LLM_WAITING = Gauge(
+    "tipitaka_llm_waiting_streams",
+    "LLM completion streams waiting for a concurrency slot.")
+
+UPLOAD_SOURCES = Counter(
+    "tipitaka_upload_sources_total",
+    "Sources received by the upload endpoints.")
+UPLOAD_CHUNKS = Counter(
+    "tipitaka_upload_chunks_total",
+    "Chunks of uploaded sources by result: embedded, unchanged or deleted.",
+    ["result"])
+
+# Stages observed with their own histogram rather than `tipitaka_stage_seconds`.
+_LLM_STAGES = {"first_token": LLM_FIRST_TOKEN_SECONDS,
+               "llm": LLM_GENERATION_SECONDS}
+
+
+def observe_timings(timings: Dict[str, float], model: Optional[str] = None) -> None:
+    """Record the `StageTimer` timings of one bot response; `model` labels the LLM stages."""
+    for stage, seconds in timings.items():
+        if stage == "total":
+            RESPONSE_SECONDS.observe(seconds)
+        elif stage in _LLM_STAGES:
+            _LLM_STAGES[stage].labels(model or "unknown").observe(seconds)
+        else:
+            STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+def count_response(outcome: str) -> None:
+    RESPONSES.labels(outcome).inc()
+
+
+def observe_flush(rows: int, seconds: float) -> None:
+    """`WriteBehindQueue.on_flush` callback."""
+    WRITE_BEHIND_FLUSH_SECONDS.observe(seconds)
+    WRITE_BEHIND_ROWS.inc(rows)
+
+
+def observe_upload(sources: int, embedded: int, unchanged: int, deleted: int) -> None:
+    UPLOAD_SOURCES.inc(sources)
+    UPLOAD_CHUNKS.labels("embedded").inc(embedded)
+    UPLOAD_CHUNKS.labels("unchanged").inc(unchanged)
+    UPLOAD_CHUNKS.labels("deleted").inc(deleted)
+
+
+def watch(write_behind: Optional[WriteBehindQueue] = None, llm: Optional[AsyncLLMClient] = None) -> None:
+    """Report the queue depth and LLM concurrency; read when `/metrics` is scraped."""
+    if write_behind is not None:
+        WRITE_BEHIND_QUEUED.set_function(
+            lambda: write_behind.stats()["queued"])
+    if llm is not None:
+        LLM_ACTIVE.set_function(lambda: llm.active)
+        LLM_WAITING.set_function(lambda: llm.waiting)
+
+
+def render() -> tuple[bytes, str]:
+    """The metrics of this process in the Prometheus text format, and its content type."""
+    return generate_latest(), CONTENT_TYPE_LATEST
@@ -1,17 +1,23 @@
+import asyncio
+import bisect
 import copy
+import functools
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from uuid import uuid4
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings
-from typing import Dict, Any, Optional, Tuple, Callable
+from typing import TYPE_CHECKING, Dict, Any, Optional, Tuple, Callable
 import fastapi_poe as fp
 from langchain_mongodb import MongoDBAtlasVectorSearch
-from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
-from langchain_core.vectorstores import InMemoryVectorStore
 from langchain_core.documents import Document
 
+from db.lexical_index import LexicalIndex
+
 from .template_loader import TemplateLoader
+from .tokenizer import Tokenizer, count_tokens, token_end_offsets, tokenizer_name
 
+if TYPE_CHECKING:
+    from langchain_core.embeddings import Embeddings
 
 logger = logging.getLogger(__name__)
 
@@ -26,6 +32,14 @@ MESSAGE_TOO_SHORT = template_loader.get_message('too_short')
 CONTEXT_LENGTH_EXCEEDED = template_loader.get_message('context_length_exceeded')
 HEALTH_CHECK_FAILED = template_loader.get_message('health_check_failed')
 
+# Dedicated pool for blocking retrieval calls (OpenAI embedding + pymongo $vectorSearch)
+# and prompt tokenization.
+# The default executor only has min(32, cpu + 4) workers, which is 5 on our fly.io box.
+RETRIEVAL_EXECUTOR = ThreadPoolExecutor(
+    max_workers=int(os.environ.get("RETRIEVAL_MAX_WORKERS", "16")),
+    thread_name_prefix="retrieval"
+)
+
 def build_system_prompt(search_results: list[Dict[str, Any]], with_debug_log: bool = False) -> str:
     # Group documents by source and format them with source tags
     docs_by_source = {}
@@ -109,13 +123,153 @@ def build_chat_input(messages: list[Dict[str, Any]]) -> str:
     return chat_str.strip()
 
 
-def build_messages(
-    tokenizer: PreTrainedTokenizer | PreTrainedTokenizerFast,
+# Minimum number of characters kept from a partially included result; shorter
+# fragments are dropped instead (matches the old bisection lower bound).
+MIN_PARTIAL_CONTENT_CHARS = 1000
+# Maximum number of exact tokenizations used to verify a packing plan.
+MAX_PACKING_ROUNDS = 4
+# Summed per-part token counts are within a few tokens of the exact count, so a plan
+# that keeps every result and is estimated this far under the limit skips verification.
+PACKING_SAFETY_MARGIN = 256
+
+
+class ContextPacker:
+    """
+    Pack search results into the system prompt under a token budget.
+
+    The fixed parts of the conversation (system prompt template, last bot response,
+    user question) are tokenized once in the constructor, and every search result is
+    tokenized at most once in `pack`. Results are selected with prefix sums of their
+    token counts, and the first result that does not fit is cut at a token boundary.
+    Token counts are not perfectly additive across template boundaries, so a plan
+    close to the limit is verified with one exact tokenization and shrunk by the
+    overflow if needed.
+    """
+
+    def __init__(
+        self,
+        tokenizer: Tokenizer,
+        messages: list[Dict[str, Any]],
+    ):
+        self.tokenizer = tokenizer
+        self.messages = messages
+        self._offsets: Dict[int, list[int]] = {}
+        # Prompt size of the last `pack` (exact when it was verified, else estimated).
+        self.packed_tokens = 0
+
+        fixed_messages = copy.deepcopy(messages)
+        fixed_messages[0]['content'] = SYSTEM_PROMPT.format(context="")
+        self.fixed_tokens = len(tokenizer.encode(
+            build_chat_input(fixed_messages)))
+        # "\n".join(...) adds one separator per quote and per source block.
+        self.quote_tokens = count_tokens(
+            tokenizer, QUOTE_TEMPLATE.format(quote="")) + 1
+        self.source_template_tokens = count_tokens(
+            tokenizer, SOURCE_TEMPLATE.format(name="", quotes="")) + 1
+        self.tokenizer_name = tokenizer_name(tokenizer)
+
+    def pack(self, search_results: list[Dict[str, Any]], max_tokens: int) -> Tuple[list[Dict[str, Any]], int, bool]:
+        self._offsets = {}
+        budget = max_tokens - self.fixed_tokens
+
+        # prefix[i] is the token cost of the first i results. Results past the first
+        # one that overflows the budget are never tokenized.
+        prefix, seen = [0], set()
+        for rs in search_results:
+            if prefix[-1] > budget:
+                break
+            prefix.append(prefix[-1] + self._result_cost(rs, rs['source'] in seen))
+            seen.add(rs['source'])
+
+        for _ in range(MAX_PACKING_ROUNDS):
+            num_results, cut = self._plan(search_results, prefix, budget)
+            self.packed_tokens = self.fixed_tokens + prefix[num_results]
+            if cut == 0 and self.packed_tokens <= max_tokens - PACKING_SAFETY_MARGIN:
+                break
+
+            total = len(self.tokenizer.encode(build_chat_input(
+                self._messages_for(search_results, num_results, cut))))
+            logger.debug(
+                f"Packing [0..{num_results - 1}]({num_results}) + cut {cut}: {total} tokens, max {max_tokens}")
+            self.packed_tokens = total
+            if total <= max_tokens:
+                break
+            budget -= total - max_tokens
+        else:
+            logger.warning(
+                f"Could not pack search results into {max_tokens} tokens")
+            num_results, cut = 0, 0
+            self.packed_tokens = self.fixed_tokens
+
+        self.messages[0]['content'] = build_system_prompt(
+            self._packed_results(search_results, num_results, cut), True)
+        return [self.messages, num_results, cut > 0]
+
+    def _plan(self, search_results: list[Dict[str, Any]], prefix: list[int], budget: int) -> Tuple[int, int]:
+        """
+        Return `(num_results, cut)`: the number of whole results that fit into
+        `budget`, and how many characters of the next result to keep (0 for none).
+        """
+        num_results = max(bisect.bisect_right(prefix, budget) - 1, 0)
+        if num_results == len(search_results):
+            return num_results, 0
+
+        rs = search_results[num_results]
+        overhead = self.quote_tokens
+        if rs['source'] not in {r['source'] for r in search_results[:num_results]}:
+            overhead += self._source_cost(rs['source'])
+        remaining = budget - prefix[num_results] - overhead
+        if remaining <= 0:
+            return num_results, 0
+
+        if num_results not in self._offsets:
+            self._offsets[num_results] = token_end_offsets(
+                self.tokenizer, rs['content'])
+        offsets = self._offsets[num_results]
+        cut = offsets[min(remaining, len(offsets)) - 1] if offsets else 0
+        if cut < MIN_PARTIAL_CONTENT_CHARS:
+            return num_results, 0
+        return num_results, cut
+
+    def _messages_for(self, search_results: list[Dict[str, Any]], num_results: int, cut: int) -> list[Dict[str, Any]]:
+        messages = [dict(msg) for msg in self.messages]
+        messages[0]['content'] = build_system_prompt(
+            self._packed_results(search_results, num_results, cut))
+        return messages
+
+    def _packed_results(self, search_results: list[Dict[str, Any]], num_results: int, cut: int) -> list[Dict[str, Any]]:
+        packed = search_results[:num_results]
+        if cut > 0:
+            partial = dict(search_results[num_results])
+            partial['content'] = partial['content'][:cut]
+            packed = packed + [partial]
+        return packed
+
+    def _result_cost(self, rs: Dict[str, Any], source_seen: bool) -> int:
+        # Chunks ingested with the same tokenizer carry their token count already.
+        if rs.get('token_count') is not None and rs.get('tokenizer') == self.tokenizer_name:
+            content_tokens = rs['token_count']
+        else:
+            content_tokens = count_tokens(self.tokenizer, rs['content'])
+        cost = self.quote_tokens + content_tokens
+        if not source_seen:
+            cost += self._source_cost(rs['source'])
+        return cost
+
+    def _source_cost(self, source: str) -> int:
+        return self.source_template_tokens + count_tokens(self.tokenizer, source)
+
+
+def build_context_packer(
+    tokenizer: Tokenizer,
     query: fp.ProtocolMessage,
     user_messages: list[str],
-    search_results: list[Dict[str, Any]],
     override_max_tokens: int = 0
-) -> Optional[Tuple[list[Dict[str, Any]], int, bool]]:
+) -> Tuple[ContextPacker, int]:
+    """
+    Tokenize the fixed part of the prompt: everything but the search results, so it
+    can run while the search is in flight. Returns the packer and the token limit.
+    """
     last_bot_response = None
     for message in reversed(query):
         if message.role == "bot":
@@ -137,103 +291,122 @@ def build_messages(
         max_tokens = override_max_tokens
         logger.debug(f"Overriding max tokens: {max_tokens}")
 
-    # cpsr = search_results.copy()
-    # while cpsr:
-    #     system_message_content = build_system_prompt(cpsr)
-    #     for msg in messages:
-    #         if msg['role'] == "system":
-    #             msg['content'] = system_message_content
-    #             break
-    #     conversation_str = build_chat_input(messages)
-    #     token_ids = tokenizer.encode(conversation_str)
-    #     logger.debug(
-    #         f"[0..{len(cpsr) - 1}]({len(cpsr)}), Tokens: {len(token_ids)}")
-    #     cpsr.pop()
-
-    def get_token_length(total_sr: int, str_len: int) -> int:
-        """
-        Calculate the token length for a given conversation with truncated search results.
-
-        Args:
-            total_sr (int): Number of search results to include from the start
-            str_len (int): Length to truncate the last search result content to
+    return ContextPacker(tokenizer, messages), max_tokens
 
-        Returns:
-            int: Number of tokens in the resulting conversation string
-        """
-        cprs = copy.deepcopy(search_results)[:total_sr]
-        cp_messages = copy.deepcopy(messages)
-
-        cprs[total_sr-1]['content'] = cprs[total_sr-1]['content'][:str_len]
-        cp_messages[0]['content'] = build_system_prompt(cprs)
-        conversation_str = build_chat_input(cp_messages)
-        n = len(tokenizer.encode(conversation_str))
-        del cp_messages, conversation_str, cprs
-        return n
-
-    valid_len = 0
-    ll, hl = 1, len(search_results)
-    while ll <= hl:
-        ml = (ll + hl) // 2
-        output = get_token_length(ml, len(search_results[ml-1]['content']))
-        if output <= max_tokens:
-            logger.debug(f"Valid: [0..{ml-1}]({ml}): {output} <= {max_tokens}")
-            valid_len = ml  # Valid from 0..mid-1
-            ll = ml + 1
-        else:
-            logger.debug(
-                f"Invalid: [0..{ml-1}]({ml}): {output} > {max_tokens}")
-            hl = ml - 1
 
-    if valid_len == len(search_results):
-        messages[0]['content'] = build_system_prompt(
-            search_results[:valid_len], True)
-        return [messages, valid_len, False]
-
-    ok_str = 0
-    ll, hl = 1000, len(search_results[valid_len]['content'])
-    logger.debug(f"Valid length: {valid_len}, hl: {hl}")
-    while ll <= hl:
-        ml = (ll + hl) // 2
-        output = get_token_length(valid_len+1, ml)
-        if output <= max_tokens:
-            logger.debug(
-                f"Valid: [0..{valid_len-1}]+[{valid_len}][0..{ml-1}]: {output} <= {max_tokens}")
-            ok_str = ml
-            ll = ml + 1
-        else:
-            logger.debug(
-                f"Invalid: [0..{valid_len-1}]+[{valid_len}][0..{ml-1}]: {output} > {max_tokens}")
-            hl = ml - 1
+def build_messages(
+    tokenizer: Tokenizer,
+    query: fp.ProtocolMessage,
+    user_messages: list[str],
+    search_results: list[Dict[str, Any]],
+    override_max_tokens: int = 0
+) -> Optional[Tuple[list[Dict[str, Any]], int, bool]]:
+    packer, max_tokens = build_context_packer(
+        tokenizer, query, user_messages, override_max_tokens)
+    return packer.pack(search_results, max_tokens)
 
-    if ok_str == 0:
-        messages[0]['content'] = build_system_prompt(
-            search_results[:valid_len], True)
-        return [messages, valid_len, False]
 
-    valid_len += 1
-    cpsr = search_results.copy()
-    cpsr[valid_len-1]['content'] = cpsr[valid_len-1]['content'][:ok_str]
-    messages[0]['content'] = build_system_prompt(cpsr[:valid_len], True)
-    return [messages, valid_len - 1, True]
+def build_search_query(user_messages: list[str]) -> str:
+    """The text that is embedded / matched for retrieval: one line per user message."""
+    return '\n'.join([text.replace('\n', ' ')
+                      for text in user_messages])
 
 
 def similarity_search(vector_store: MongoDBAtlasVectorSearch, user_messages: list[str], limit: int = 10, filter: Optional[Callable[[Document], bool]] = None) -> list[Dict[str, Any]]:
-    keyword = '\n'.join([text.replace('\n', ' ')
-                         for text in user_messages])
+    keyword = build_search_query(user_messages)
 
     output = vector_store.similarity_search_with_score(
         query=keyword, k=limit, pre_filter=filter
     )
 
     return [{
+        'id': str(doc.metadata['_id']) if '_id' in doc.metadata else None,
         'source': doc.metadata.get('source', 'Unknown'),
         'content': doc.page_content,
         'score': score * 100,
         'chunk_num': doc.metadata.get('chunk_num', 0),
+        'token_count': doc.metadata.get('token_count'),
+        'tokenizer': doc.metadata.get('tokenizer'),
     } for doc, score in output]
 
 
+async def asimilarity_search(vector_store: MongoDBAtlasVectorSearch, user_messages: list[str], limit: int = 10, filter: Optional[Callable[[Document], bool]] = None) -> list[Dict[str, Any]]:
+    """
+    Non-blocking variant of `similarity_search` for use inside the bot's async handlers.
+    The search runs on `RETRIEVAL_EXECUTOR`, so concurrent conversations overlap their
+    retrieval instead of stalling the event loop one after another.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        RETRIEVAL_EXECUTOR,
+        functools.partial(similarity_search, vector_store,
+                          user_messages, limit=limit, filter=filter)
+    )
+
+
+# Reciprocal rank fusion constant; 60 is the usual choice from the RRF paper.
+RRF_K = 60
+# Share of the query's IDF mass the best lexical hit must contain for the dense
+# search (and its embedding call) to be skipped, e.g. queries naming a sutta.
+LEXICAL_CONFIDENCE = float(os.environ.get("LEXICAL_CONFIDENCE", "0.9"))
+
+
+def lexical_search(lexical_index: LexicalIndex, user_messages: list[str], limit: int = 10) -> list[Dict[str, Any]]:
+    """BM25 results from `lexical_index`, scored by query coverage like `similarity_search`."""
+    lexical_results = lexical_index.search(
+        build_search_query(user_messages), k=limit)
+    for rs in lexical_results:
+        rs['score'] = rs['coverage'] * 100
+    return lexical_results
+
+
+def lexical_is_confident(lexical_results: list[Dict[str, Any]], limit: int = 10) -> bool:
+    """Enough hits and the best one covers nearly all query terms: no dense search needed."""
+    return len(lexical_results) >= limit and lexical_results[0]['coverage'] >= LEXICAL_CONFIDENCE
+
+
+def fuse_results(vector_results: list[Dict[str, Any]], lexical_results: list[Dict[str, Any]], limit: int = 10) -> list[Dict[str, Any]]:
+    """Merge vector and lexical results with reciprocal rank fusion."""
+    fused: Dict[Any, Dict[str, Any]] = {}
+    for results in (vector_results, lexical_results):
+        for rank, rs in enumerate(results):
+            key = rs['id'] or (rs['source'], rs['chunk_num'])
+            if key not in fused:
+                fused[key] = {**rs, 'rrf': 0.0}
+            fused[key]['rrf'] += 1 / (RRF_K + rank + 1)
+
+    search_results = sorted(
+        fused.values(), key=lambda rs: rs['rrf'], reverse=True)
+    return search_results[:limit]
+
+
+def hybrid_search(vector_store: MongoDBAtlasVectorSearch, lexical_index: LexicalIndex, user_messages: list[str], limit: int = 10) -> list[Dict[str, Any]]:
+    """
+    Combine BM25 results from `lexical_index` with `similarity_search` using
+    reciprocal rank fusion. When the lexical results are confident (enough hits and
+    the best one covers nearly all query terms), they are returned directly.
+    """
+    lexical_results = lexical_search(lexical_index, user_messages, limit=limit)
+    if lexical_is_confident(lexical_results, limit):
+        logger.debug(
+            f"Lexical search is confident ({lexical_results[0]['coverage']:.2f}), skipping vector search")
+        return lexical_results
+
+    vector_results = similarity_search(
+        vector_store, user_messages, limit=limit)
+    return fuse_results(vector_results, lexical_results, limit)
+
+
+async def ahybrid_search(vector_store: MongoDBAtlasVectorSearch, lexical_index: LexicalIndex, user_messages: list[str], limit: int = 10) -> list[Dict[str, Any]]:
+    """Non-blocking variant of `hybrid_search`, see `asimilarity_search`."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        RETRIEVAL_EXECUTOR,
+        functools.partial(hybrid_search, vector_store,
+                          lexical_index, user_messages, limit=limit)
+    )
+
+
 def similarity_search_with_overrall_reranking(vector_store: MongoDBAtlasVectorSearch, rerank_vs: MongoDBAtlasVectorSearch, user_messages: list[str], limit: int = 15, rerank_limit: int = 30) -> list[Dict[str, Any]]:
     search_results = similarity_search(
         vector_store, user_messages, limit=limit)
@@ -287,7 +460,11 @@ def similarity_search_with_detailed_reranking(vector_store: MongoDBAtlasVectorSe
     return transformed_sources[:limit]
 
 
-def rerank_with_memory_similarity_search(search_results: list[Dict[str, Any]], embeddings: OpenAIEmbeddings, user_messages: list[str]) -> list[Dict[str, Any]]:
+def rerank_with_memory_similarity_search(search_results: list[Dict[str, Any]], embeddings: "Embeddings", user_messages: list[str]) -> list[Dict[str, Any]]:
+    # Experimental reranking only; not imported by the bot at startup.
+    from langchain_core.vectorstores import InMemoryVectorStore
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+
     mem_vs = InMemoryVectorStore(embeddings)
     total_chunks = 0
     for result in search_results:
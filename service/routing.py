@@ -0,0 +1,180 @@
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+from .tokenizer import Tokenizer, load_tokenizer, vendored_tokenizer_path
+
+logger = logging.getLogger(__name__)
+
+# Together chat models and the Hugging Face tokenizer matching each of them.
+MODEL_MAPPING = {
+    "Qwen/Qwen2.5-72B-Instruct-Turbo": "Qwen/Qwen2.5-72B-Instruct",
+    "meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-405B-Instruct-Turbo",
+    "deepseek-ai/DeepSeek-R1-Distill-Llama-70B": "deepseek-ai/DeepSeek-R1-Distill-Llama-70B",
+    "deepseek-ai/deepseek-llm-67b-chat": "deepseek-ai/deepseek-llm-67b-chat",
+    "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-8B-Instruct-Turbo",
+    "meta-llama/Llama-3.2-3B-Instruct-Turbo": "meta-llama/Llama-3.2-3B-Instruct-Turbo",
+    "Qwen/Qwen2.5-7B-Instruct-Turbo": "Qwen/Qwen2.5-7B-Instruct",
+    "mistralai/Mixtral-8x7B-Instruct-v0.1": "mistralai/Mixtral-8x7B-Instruct-v0.1",
+    "microsoft/WizardLM-2-8x22B": "microsoft/WizardLM-2-8x22B",
+    "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo": "meta-llama/Meta-Llama-3.1-70B-Instruct-Turbo",
+    "mistralai/Mixtral-8x22B-Instruct-v0.1": "mistralai/Mixtral-8x22B-Instruct-v0.1",
+    "Qwen/Qwen2-72B-Instruct": "Qwen/Qwen2-72B-Instruct",
+    "scb10x/scb10x-llama3-typhoon-v1-5x-4f316": "scb10x/scb10x-llama3-typhoon-v1-5x-4f316",
+    "meta-llama/Meta-Llama-3-70B-Instruct-Lite": "meta-llama/Meta-Llama-3-70B-Instruct-Lite",
+    "meta-llama/Llama-3-8b-chat-hf": "meta-llama/Llama-3-8b-chat-hf",
+    "meta-llama/Llama-2-13b-chat-hf": "meta-llama/Llama-2-13b-chat-hf",
+}
+
+# Tokenizers that are identical to another one: every Qwen2.5 size ships the same
+# vocabulary and chat template. Sharing them avoids packing the prompt twice, and
+# keeps the ingest-time token counts (computed with the 72B tokenizer) usable.
+SHARED_TOKENIZERS = {
+    "Qwen/Qwen2.5-7B-Instruct": "Qwen/Qwen2.5-72B-Instruct",
+}
+
+DEFAULT_MODEL = "Qwen/Qwen2.5-72B-Instruct-Turbo"
+# Weight of the newest sample in the latency averages.
+EWMA_ALPHA = 0.2
+# Latency averages older than this are not trusted any more, so a tier that was
+# avoided because it was slow is tried again.
+STATS_WINDOW_SECONDS = 120.0
+
+
+class ModelRouter:
+    """
+    Pick the generation model for a request.
+
+    The default model answers unless one of these holds, in which case the small
+    model does:
+    - the packed prompt is at most `small_context_tokens` long, i.e. few or short
+      results, which the small model handles as well;
+    - `max_default_in_flight` generations of the default model are already running;
+    - the recent average time to first token of the default model exceeds
+      `latency_target` seconds (provider queueing shows there first; the total
+      generation time mostly depends on the answer length).
+
+    Tokenizers are loaded on first use of a model, see `tokenizer`. Per-model usage
+    (counted by `record` once the model that runs is settled) and latency are
+    available from `stats`.
+    """
+
+    def __init__(
+            self,
+            default_model: str = DEFAULT_MODEL,
+            small_model: Optional[str] = None,
+            small_context_tokens: int = 6000,
+            max_default_in_flight: int = 16,
+            latency_target: float = 5.0,
+    ) -> None:
+        for model in filter(None, (default_model, small_model)):
+            if model not in MODEL_MAPPING:
+                raise ValueError(f"Unknown model {model}")
+            if not os.path.exists(os.path.join(vendored_tokenizer_path(tokenizer_for(model)), "tokenizer.json")):
+                logger.warning(
+                    f"Tokenizer of {model} is not vendored; it is downloaded on first use "
+                    f"(python cmd/vendor_tokenizer.py {tokenizer_for(model)})")
+        self.default_model = default_model
+        self.small_model = small_model
+        self.small_context_tokens = small_context_tokens
+        self.max_default_in_flight = max_default_in_flight
+        self.latency_target = latency_target
+
+        self._lock = threading.Lock()
+        self._stats: Dict[str, Dict[str, Any]] = {
+            model: {"requests": 0, "errors": 0, "in_flight": 0, "latency": None, "first_token": None,
+                    "updated_at": 0.0, "reasons": {}}
+            for model in filter(None, (default_model, small_model))
+        }
+
+    def tokenizer(self, model: str) -> Tokenizer:
+        """The tokenizer of `model`, loaded on first use (blocking)."""
+        return load_tokenizer(tokenizer_for(model))
+
+    def same_tokenizer(self, model: str, other: str) -> bool:
+        return tokenizer_for(model) == tokenizer_for(other)
+
+    def route(self, prompt_tokens: int) -> tuple[str, str]:
+        """Return `(model, reason)` for a prompt of `prompt_tokens` tokens; see `record`."""
+        if self.small_model is None:
+            return self.default_model, "default"
+        with self._lock:
+            default = self._stats[self.default_model]
+            in_flight = default["in_flight"]
+            recent = time.monotonic() - default["updated_at"] <= STATS_WINDOW_SECONDS
+            latency = default["first_token"] if recent else None
+        if prompt_tokens <= self.small_context_tokens:
+            return self.small_model, "short_context"
+        if in_flight >= self.max_default_in_flight:
+            return self.small_model, "load"
+        if latency is not None and latency > self.latency_target:
+            return self.small_model, "latency"
+        return self.default_model, "default"
+
+    def record(self, model: str, reason: str) -> None:
+        """Count a request answered by `model`, e.g. after a fallback from the routed one."""
+        with self._lock:
+            stats = self._stats[model]
+            stats["requests"] += 1
+            stats["reasons"][reason] = stats["reasons"].get(reason, 0) + 1
+
+    @contextmanager
+    def track(self, model: str) -> Iterator["Generation"]:
+        """Count an in-flight generation of `model` and record its latency."""
+        generation = Generation()
+        with self._lock:
+            self._stats[model]["in_flight"] += 1
+        try:
+            yield generation
+        except Exception:
+            with self._lock:
+                self._stats[model]["errors"] += 1
+            raise
+        finally:
+            latency = time.perf_counter() - generation.started
+            with self._lock:
+                stats = self._stats[model]
+                stats["in_flight"] -= 1
+                stats["latency"] = _ewma(stats["latency"], latency)
+                if generation.first_token is not None:
+                    stats["first_token"] = _ewma(
+                        stats["first_token"], generation.first_token)
+                stats["updated_at"] = time.monotonic()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {model: {**stats, "reasons": dict(stats["reasons"])}
+                    for model, stats in self._stats.items()}
+
+
+class Generation:
+    """Timing of one generation, see `ModelRouter.track`."""
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.first_token: Optional[float] = None
+
+    def token(self) -> None:
+        if self.first_token is None:
+            self.first_token = time.perf_counter() - self.started
+
+
+def tokenizer_for(model: str) -> str:
+    tokenizer = MODEL_MAPPING[model]
+    return SHARED_TOKENIZERS.get(tokenizer, tokenizer)
+
+
+def routable_tokenizers() -> list[str]:
+    """Every tokenizer `ModelRouter` can load, the default model's first."""
+    names = [tokenizer_for(DEFAULT_MODEL)]
+    for model in MODEL_MAPPING:
+        if tokenizer_for(model) not in names:
+            names.append(tokenizer_for(model))
+    return names
+
+
+def _ewma(average: Optional[float], sample: float) -> float:
+    return sample if average is None else (1 - EWMA_ALPHA) * average + EWMA_ALPHA * sample
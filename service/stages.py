@@ -0,0 +1,38 @@
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Dict, Iterator
+
+
+class StageTimer:
+    """
+    Durations of the stages of one bot request, in seconds.
+
+    Stages may overlap: `timed` measures an awaitable from the moment it is awaited
+    here, so stages started concurrently each get their own duration. `mark` records
+    the time elapsed since the request started, e.g. the first LLM token.
+    """
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.timings: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    async def timed(self, name: str, awaitable: Awaitable[Any]) -> Any:
+        started = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.timings[name] = time.perf_counter() - started
+
+    def mark(self, name: str) -> None:
+        self.timings[name] = time.perf_counter() - self.started
+
+    def summary(self) -> str:
+        return " ".join(f"{name}={seconds * 1000:.0f}ms" for name, seconds in self.timings.items())
@@ -0,0 +1,151 @@
+import functools
+import json
+import logging
+import os
+from typing import TYPE_CHECKING, Any, Dict, Union
+
+from tokenizers import Tokenizer as RustTokenizer
+
+if TYPE_CHECKING:
+    from transformers import PreTrainedTokenizer, PreTrainedTokenizerFast
+
+logger = logging.getLogger(__name__)
+
+# Tokenizer matching the deployed chat model (Qwen/Qwen2.5-72B-Instruct-Turbo).
+TOKENIZER_NAME = "Qwen/Qwen2.5-72B-Instruct"
+# Vendored tokenizers, one `<name>/tokenizer.json` (+ `tokenizer_config.json`) per
+# Hugging Face repo. The Docker image fills it with `python cmd/vendor_tokenizer.py`.
+TOKENIZER_DIR = os.environ.get("TOKENIZER_DIR", os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "assets", "tokenizers"))
+# What `transformers` reports when a tokenizer config has no `model_max_length`.
+VERY_LARGE_INTEGER = int(1e30)
+
+
+class FastTokenizer:
+    """
+    The part of the `transformers` tokenizer API used by this service, backed directly
+    by a Rust `tokenizers.Tokenizer` loaded from a vendored tokenizer.json. It gives
+    the same ids and offsets as `PreTrainedTokenizerFast` for that file, without
+    importing `transformers` or reaching the Hugging Face hub.
+    """
+
+    is_fast = True
+
+    def __init__(self, tokenizer: RustTokenizer, name_or_path: str, model_max_length: int = VERY_LARGE_INTEGER) -> None:
+        # Like `PreTrainedTokenizerFast`: truncation and padding are opt-in per call.
+        tokenizer.no_truncation()
+        tokenizer.no_padding()
+        self._tokenizer = tokenizer
+        self.name_or_path = name_or_path
+        self.model_max_length = model_max_length
+
+    @classmethod
+    def from_dir(cls, path: str, name_or_path: str) -> "FastTokenizer":
+        config: Dict[str, Any] = {}
+        config_path = os.path.join(path, "tokenizer_config.json")
+        if os.path.exists(config_path):
+            with open(config_path, "r", encoding="utf-8") as f:
+                config = json.load(f)
+        return cls(RustTokenizer.from_file(os.path.join(path, "tokenizer.json")), name_or_path,
+                   config.get("model_max_length", VERY_LARGE_INTEGER))
+
+    def encode(self, text: str, add_special_tokens: bool = True) -> list[int]:
+        return self._tokenizer.encode(text, add_special_tokens=add_special_tokens).ids
+
+    def decode(self, ids: list[int], skip_special_tokens: bool = False) -> str:
+        return self._tokenizer.decode(ids, skip_special_tokens=skip_special_tokens)
+
+    def __call__(self, text: str | list[str], add_special_tokens: bool = True, return_offsets_mapping: bool = False) -> Dict[str, Any]:
+        if isinstance(text, str):
+            encodings = [self._tokenizer.encode(
+                text, add_special_tokens=add_special_tokens)]
+        else:
+            encodings = self._tokenizer.encode_batch(
+                text, add_special_tokens=add_special_tokens)
+        result = {"input_ids": [e.ids for e in encodings],
+                  "attention_mask": [e.attention_mask for e in encodings]}
+        if return_offsets_mapping:
+            result["offset_mapping"] = [e.offsets for e in encodings]
+        if isinstance(text, str):
+            result = {key: value[0] for key, value in result.items()}
+        return result
+
+
+# Any tokenizer with the API above: a vendored one or a `transformers` fallback.
+Tokenizer = Union[FastTokenizer,
+                  "PreTrainedTokenizer", "PreTrainedTokenizerFast"]
+
+
+def vendored_tokenizer_path(name: str) -> str:
+    return os.path.join(TOKENIZER_DIR, *name.split("/"))
+
+
+@functools.lru_cache(maxsize=None)
+def load_tokenizer(name: str = TOKENIZER_NAME) -> Tokenizer:
+    """
+    Load a tokenizer once per process; the bot and the ingestion API share it.
+    The vendored tokenizer.json is used when present; otherwise it is downloaded
+    from the Hugging Face hub. Only repos without a tokenizer.json need
+    `transformers`, which is not part of the service image (requirements-tools.txt).
+    """
+    path = vendored_tokenizer_path(name)
+    if os.path.exists(os.path.join(path, "tokenizer.json")):
+        logger.info(f"Loading tokenizer {name} from {path}")
+        return FastTokenizer.from_dir(path, name)
+
+    logger.info(f"Loading tokenizer {name} from the Hugging Face hub")
+    from huggingface_hub import hf_hub_download
+    from huggingface_hub.errors import EntryNotFoundError, LocalEntryNotFoundError
+    try:
+        path = os.path.dirname(hf_hub_download(name, "tokenizer.json"))
+        try:
+            hf_hub_download(name, "tokenizer_config.json")
+        except EntryNotFoundError:
+            pass
+        return FastTokenizer.from_dir(path, name)
+    except LocalEntryNotFoundError as e:
+        # Offline or firewalled, and not in the local hub cache either. Checked before
+        # EntryNotFoundError, which it subclasses.
+        raise RuntimeError(
+            f"Tokenizer {name} is not vendored in {TOKENIZER_DIR} and could not be downloaded; "
+            f"run `python cmd/vendor_tokenizer.py {name}`") from e
+    except EntryNotFoundError:
+        logger.warning(f"{name} has no tokenizer.json, loading it with transformers")
+
+    try:
+        from transformers import AutoTokenizer
+    except ImportError as e:
+        raise RuntimeError(
+            f"Tokenizer {name} has no tokenizer.json and needs transformers "
+            f"(pip install -r requirements-tools.txt)") from e
+    return AutoTokenizer.from_pretrained(name, trust_remote_code=True)
+
+
+def tokenizer_name(tokenizer: Tokenizer) -> str:
+    return getattr(tokenizer, "name_or_path", "")
+
+
+def count_tokens(tokenizer: Tokenizer, text: str) -> int:
+    return len(tokenizer.encode(text, add_special_tokens=False))
+
+
+def count_tokens_batch(tokenizer: Tokenizer, texts: list[str]) -> list[int]:
+    if not texts:
+        return []
+    encoding = tokenizer(texts, add_special_tokens=False)
+    return [len(ids) for ids in encoding["input_ids"]]
+
+
+def token_end_offsets(tokenizer: Tokenizer, text: str) -> list[int]:
+    """
+    Return, for each token of `text`, the character offset where that token ends.
+    Cutting `text` at `offsets[n-1]` therefore keeps exactly the first `n` tokens.
+    """
+    if getattr(tokenizer, "is_fast", False):
+        encoding = tokenizer(
+            text, add_special_tokens=False, return_offsets_mapping=True)
+        return [end for _, end in encoding["offset_mapping"]]
+
+    # Slow tokenizers have no offset mapping; decode growing prefixes instead.
+    ids = tokenizer.encode(text, add_special_tokens=False)
+    return [len(tokenizer.decode(ids[:n + 1]).rstrip("�")) for n in range(len(ids))]